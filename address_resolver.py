@@ -0,0 +1,152 @@
+from collections import defaultdict
+
+
+class AddressGroupResolver:
+    # Flattens "firewall addrgrp" membership into the set of leaf (non-group)
+    # members of every group. Closures are memoized per group, cycles are found
+    # as strongly connected components, and set_groups()/update_group() only
+    # recompute the changed groups and the groups that contain them.
+    def __init__(self, groups=None):
+        self.groups = {}
+        self.parents = defaultdict(set)
+        self.closure = {}
+        self.cycles = []
+        if groups:
+            self.set_groups(groups)
+
+    @classmethod
+    def from_config(cls, config_dict):
+        groups = {}
+        for name, values in config_dict.get("firewall addrgrp", {}).items():
+            members = values.get("member", [])
+            groups[name] = members if isinstance(members, list) else [members]
+        return cls(groups)
+
+    def is_group(self, name):
+        return name in self.groups
+
+    def members(self, name):
+        # Leaf members of a group; anything that is not a group resolves to itself
+        if name in self.groups:
+            return self.closure[name]
+        return frozenset((name,))
+
+    def expand(self, names):
+        result = set()
+        for name in names:
+            result |= self.members(name)
+        return result
+
+    def closure_rows(self):
+        for group, members in self.closure.items():
+            for member in members:
+                yield group, member
+
+    def set_groups(self, groups):
+        # Replaces the whole group table and returns the groups whose closure changed
+        changed = {name for name in self.groups if name not in groups}
+        for name in changed:
+            self._set_members(name, None)
+        for name, members in groups.items():
+            if self.groups.get(name) != list(members):
+                self._set_members(name, members)
+                changed.add(name)
+        return self._recompute(changed)
+
+    def update_group(self, name, members):
+        self._set_members(name, members)
+        return self._recompute({name})
+
+    def remove_group(self, name):
+        self._set_members(name, None)
+        return self._recompute({name})
+
+    def _set_members(self, name, members):
+        for member in self.groups.get(name, ()):
+            self.parents[member].discard(name)
+        if members is None:
+            self.groups.pop(name, None)
+            return
+        self.groups[name] = list(members)
+        for member in members:
+            self.parents[member].add(name)
+
+    def _ancestors(self, names):
+        seen = set(names)
+        todo = list(names)
+        while todo:
+            for parent in self.parents.get(todo.pop(), ()):
+                if parent not in seen:
+                    seen.add(parent)
+                    todo.append(parent)
+        return seen
+
+    def _recompute(self, changed):
+        affected = self._ancestors(changed)
+        old = {name: self.closure.pop(name, None) for name in affected}
+        self.cycles = [cycle for cycle in self.cycles if affected.isdisjoint(cycle)]
+        nodes = {name for name in affected if name in self.groups}
+
+        # Iterative Tarjan over the affected groups; groups outside `nodes`
+        # keep their memoized closure.
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        for root in sorted(nodes):
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.groups[root]))]
+            while work:
+                node, successors = work[-1]
+                descended = False
+                for member in successors:
+                    if member not in nodes:
+                        continue
+                    if member not in index:
+                        index[member] = low[member] = len(index)
+                        stack.append(member)
+                        on_stack.add(member)
+                        work.append((member, iter(self.groups[member])))
+                        descended = True
+                        break
+                    if member in on_stack:
+                        low[node] = min(low[node], index[member])
+                if descended:
+                    continue
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    self._close_component(component)
+
+        return {name for name in affected if old[name] != self.closure.get(name)}
+
+    def _close_component(self, component):
+        in_component = set(component)
+        leaves = set()
+        for group in component:
+            for member in self.groups[group]:
+                if member in in_component:
+                    continue
+                if member in self.groups:
+                    leaves |= self.closure[member]
+                else:
+                    leaves.add(member)
+        leaves = frozenset(leaves)
+        for group in component:
+            self.closure[group] = leaves
+
+        if len(component) > 1 or component[0] in self.groups[component[0]]:
+            self.cycles.append(sorted(component))
@@ -0,0 +1,68 @@
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config_diff import ConfigDiff
+from fortigate_parser import FortiGateConfigParser
+from policy_engine import PolicyEngine
+from synthetic import generate_config_lines
+
+
+def measure(load, paths):
+    # Memory retained by the trees of every path held at once, and the peak
+    # while building them (tracemalloc, so Python allocations only)
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    trees = [load(path) for path in paths]
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return trees, retained, peak, elapsed
+
+
+def main():
+    # Several devices held at once, as for diffing or fleet analysis
+    policies = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    devices = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for seed in range(devices):
+            path = os.path.join(directory, f"device{seed}.conf")
+            with open(path, "w") as f:
+                f.writelines(generate_config_lines(policies=policies, addresses=policies // 2, seed=seed + 1))
+            paths.append(path)
+
+        dicts, dict_retained, dict_peak, dict_time = measure(
+            lambda path: FortiGateConfigParser().parse_from_file(path), paths)
+        compacts, compact_retained, compact_peak, compact_time = measure(
+            lambda path: FortiGateConfigParser().parse_compact(path), paths)
+        assert all(compact.to_dict() == tree for compact, tree in zip(compacts, dicts))
+
+    # The compact trees feed the policy engine and the diff unchanged
+    def compiled(config):
+        return [vars(policy) for policy in PolicyEngine.from_config(config).policies]
+
+    assert compiled(compacts[0]) == compiled(dicts[0])
+    if devices > 1:
+        compact_diff = list(ConfigDiff(compacts[0], compacts[1]))
+        assert compact_diff == list(ConfigDiff(dicts[0], dicts[1]))
+        json.dumps(compact_diff)
+
+    print(f"{devices} devices x {policies} policies")
+    print(f"{'':>10} {'retained MB':>12} {'peak MB':>10} {'parse s':>8}")
+    for label, retained, peak, elapsed in (("dict", dict_retained, dict_peak, dict_time),
+                                           ("compact", compact_retained, compact_peak, compact_time)):
+        print(f"{label:>10} {retained / 2 ** 20:>12.1f} {peak / 2 ** 20:>10.1f} {elapsed:>8.2f}")
+    print(f"retained memory: {dict_retained / compact_retained:.1f}x smaller")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fortigate_parser import FortiGateConfigParser
+from synthetic import generate_certificate_lines, generate_config_lines
+
+
+def run(method, path, repeat):
+    # Best time of `repeat` runs, then the traced peak of one more. No tree
+    # is kept alive between runs, so the garbage collector sees the same
+    # heap for both paths.
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        parser = FortiGateConfigParser()
+        start = time.perf_counter()
+        getattr(parser, method)(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        del parser
+    gc.collect()
+    tracemalloc.start()
+    getattr(FortiGateConfigParser(), method)(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    # A certificate-heavy backup: PEM blocks, ssh keys and scripts next to a
+    # regular policy table
+    certificates = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    policies = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "backup.conf")
+        with open(path, "w") as f:
+            f.writelines(generate_config_lines(policies=policies, addresses=policies // 2))
+            f.writelines(generate_certificate_lines(certificates=certificates, admins=certificates // 4))
+        size = os.path.getsize(path) / 2 ** 20
+
+        text, text_peak = run("parse_from_file", path, 3)
+        mapped, mapped_peak = run("parse_mmap", path, 3)
+        mapped_config = FortiGateConfigParser().parse_mmap(path)
+        assert mapped_config == FortiGateConfigParser().parse_from_file(path)
+        certificate = mapped_config["vpn certificate local"]["cert_0"]["certificate"]
+        assert certificate.startswith("-----BEGIN CERTIFICATE-----\n") and certificate.count("\n") == 21
+
+    print(f"{size:.0f} MB, {certificates} certificates, {policies} policies")
+    print(f"{'path':>16} {'seconds':>8} {'MB/s':>8} {'peak MB':>8}")
+    print(f"{'text mode':>16} {text:>8.2f} {size / text:>8.1f} {text_peak / 2 ** 20:>8.1f}")
+    print(f"{'mmap chunks':>16} {mapped:>8.2f} {size / mapped:>8.1f} {mapped_peak / 2 ** 20:>8.1f}")
+    print(f"speedup: {text / mapped:.2f}x, peak memory: {mapped_peak / text_peak:.2f}x of text mode")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import gc
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fortigate_parser import FortiGateConfigParser
+from synthetic import generate_config_lines
+
+
+class LegacyParser:
+    # The startswith chain / root-walk engine the parser used before the
+    # keyword dispatch + cursor stack, kept here as the "before" baseline.
+    def __init__(self):
+        self.config = {}
+        self.stack = []
+
+    def _get_nested_dict(self):
+        d = self.config
+        for key in self.stack:
+            d = d.setdefault(key, {})
+        return d
+
+    def _normalize_value(self, key, value):
+        list_keys = {
+            "member", "service", "allowaccess", "dns-server",
+            "ntp-server", "dnsfilter-profile", "ssh-filter-profile",
+            "ipv6-address", "groups"
+        }
+        value = value.strip('"')
+        if key in list_keys:
+            return [v.strip('"') for v in value.split()]
+        return value
+
+    def parse_line(self, line):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            return
+        if line.startswith("config "):
+            self.stack.append(line.split("config ", 1)[1].strip())
+        elif line.startswith("edit "):
+            context = line.split("edit ", 1)[1].strip().strip('"')
+            current_dict = self._get_nested_dict()
+            self.stack.append(context)
+            current_dict.setdefault(context, {})
+        elif line.startswith("set "):
+            parts = line.split(None, 2)
+            if len(parts) == 2:
+                key, value = parts[1], ""
+            else:
+                _, key, value = parts
+            self._get_nested_dict()[key] = self._normalize_value(key, value)
+        elif line.startswith("unset "):
+            self._get_nested_dict().pop(line.split("unset ", 1)[1].strip(), None)
+        elif line.startswith("delete "):
+            self._get_nested_dict().pop(line.split("delete ", 1)[1].strip(), None)
+        elif line.startswith("rename "):
+            pass
+        elif line == "next" or line == "end":
+            if self.stack:
+                self.stack.pop()
+
+    def parse_config(self, lines):
+        for line in lines:
+            self.parse_line(line)
+        return self.config
+
+
+def parse_legacy_file(path):
+    # How parse_from_file read a file before: every line into a list first
+    with open(path) as f:
+        lines = f.readlines()
+    return LegacyParser().parse_config(lines)
+
+
+def run(parse, arg, repeat):
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        parse(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [2000, 20000, 100000]
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for policies in sizes:
+            lines = list(generate_config_lines(policies=policies, addresses=policies // 2))
+            path = os.path.join(directory, f"{policies}.conf")
+            with open(path, "w") as f:
+                f.writelines(lines)
+            rows.append((
+                policies, len(lines),
+                run(lambda lines: LegacyParser().parse_config(lines), lines, 3),
+                run(lambda lines: FortiGateConfigParser().parse_config(lines), lines, 3),
+                run(parse_legacy_file, path, 3),
+                run(lambda path: FortiGateConfigParser().parse_from_file(path), path, 3),
+            ))
+            del lines
+    # parse_config() over lines already in memory, then the whole
+    # parse_from_file() path including reading the file
+    for title, column in (("parse_config(lines)", 2), ("parse_from_file(path)", 4)):
+        print(title)
+        print(f"{'policies':>10} {'lines':>10} {'before l/s':>14} {'after l/s':>14} {'speedup':>8}")
+        for row in rows:
+            policies, count, before, after = row[0], row[1], row[column], row[column + 1]
+            print(f"{policies:>10} {count:>10} {count / before:>14,.0f} "
+                  f"{count / after:>14,.0f} {before / after:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fortigate_parser import FortiGateConfigParser
+from policy_engine import PolicyEngine
+from rule_analysis import RuleAnalyzer, covers
+from synthetic import generate_config_lines
+
+
+def add_broad_rules(config, count, seed=1):
+    # Synthetic policies are host-to-host; mix in group and "all" rules so
+    # some later rules really are shadowed
+    rng = random.Random(seed)
+    policies = config["firewall policy"]
+    groups = list(config.get("firewall addrgrp", {}))
+    ids = list(policies)
+    for n in range(count):
+        policy_id = str(len(ids) + 1 + n)
+        policies[policy_id] = {
+            "srcintf": ["any"],
+            "dstintf": [f"port{rng.randrange(200)}"],
+            "srcaddr": [rng.choice(groups + ["all"])],
+            "dstaddr": ["all"],
+            "service": ["ALL"],
+            "action": rng.choice(["accept", "deny"]),
+        }
+    # Move the broad rules to random positions
+    items = list(policies.items())
+    rng.shuffle(items)
+    config["firewall policy"] = dict(items)
+
+
+def naive_shadowed(policies):
+    # The O(n^2) pairwise baseline
+    found = 0
+    for j, policy in enumerate(policies):
+        for i in range(j):
+            if covers(policies[i], policy):
+                found += 1
+                break
+    return found
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [2000, 15000]
+    print(f"{'policies':>10} {'indexed s':>10} {'findings':>9} {'naive s':>10} {'speedup':>8}")
+    for size in sizes:
+        parser = FortiGateConfigParser()
+        parser.parse_config(list(generate_config_lines(policies=size, addresses=size // 2)))
+        config = parser.config
+        add_broad_rules(config, size // 100)
+        policies = PolicyEngine.from_config(config).policies
+
+        analyzer = RuleAnalyzer(policies)
+        findings = analyzer.analyze()
+        indexed = sum(analyzer.timings.values())
+
+        # The naive pass only covers the shadowed/redundant half of the work,
+        # so the comparison is conservative
+        start = time.perf_counter()
+        naive_shadowed(analyzer.policies)
+        naive = time.perf_counter() - start
+        print(f"{size:>10} {indexed:>10.2f} {len(findings):>9} {naive:>10.2f} {naive / indexed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
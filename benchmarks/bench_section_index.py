@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fortigate_parser import FortiGateConfigParser
+from synthetic import generate_certificate_lines, generate_config_lines
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def main():
+    # One large backup, from which a tool needs a single small section
+    policies = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "backup.conf")
+        with open(path, "w") as f:
+            f.writelines(generate_config_lines(policies=policies, addresses=policies // 2))
+            f.writelines(generate_certificate_lines(certificates=policies // 20, admins=policies // 50))
+        size = os.path.getsize(path) / 2 ** 20
+
+        full, full_time = timed(lambda: FortiGateConfigParser().parse_mmap(path))
+        _, scan_time = timed(lambda: FortiGateConfigParser().index_file(path, persist=True))
+
+        # A later run: the stored index is current, only the section is read
+        def lookup(name):
+            parser = FortiGateConfigParser()
+            parser.index_file(path)
+            return parser.section(name)
+
+        small, small_time = timed(lambda: lookup("system global"))
+        policies_section, policies_time = timed(lambda: lookup("firewall policy"))
+        assert small == full["system global"] and policies_section == full["firewall policy"]
+
+    print(f"{size:.0f} MB, {policies} policies")
+    print(f"{'full parse':>32} {full_time:>8.3f}s")
+    print(f"{'index scan (first run)':>32} {scan_time:>8.3f}s")
+    print(f"{'stored index + system global':>32} {small_time * 1000:>8.1f}ms")
+    print(f"{'stored index + firewall policy':>32} {policies_time:>8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
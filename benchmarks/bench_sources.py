@@ -0,0 +1,76 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import sys
+import tarfile
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config_sources import iter_archive
+from fortigate_parser import FortiGateConfigParser
+from synthetic import generate_config_lines
+
+COMPRESSORS = {
+    "": lambda data: data,
+    ".gz": gzip.compress,
+    ".bz2": bz2.compress,
+    ".xz": lzma.compress,
+}
+try:
+    import zstandard
+    COMPRESSORS[".zst"] = lambda data: zstandard.ZstdCompressor().compress(data)
+except ImportError:
+    zstandard = None
+
+
+def write_archive(path, members):
+    # A tar of (name, bytes) members, compressed as a whole like `path` says
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    data = buffer.getvalue()
+    for suffix, compress in COMPRESSORS.items():
+        if suffix and path.endswith(f".tar{suffix}"):
+            data = compress(data)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def main():
+    # Every member compression inside plain and compressed tars; each member
+    # must parse to the same config as the plain file
+    policies = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    text = "".join(generate_config_lines(policies=policies, addresses=policies // 2)).encode()
+    with tempfile.TemporaryDirectory() as directory:
+        plain = os.path.join(directory, "fw.conf")
+        with open(plain, "wb") as f:
+            f.write(text)
+        expected = FortiGateConfigParser().parse_from_file(plain)
+        members = [(f"fw{i}.conf{suffix}", compress(text)) for i, (suffix, compress) in enumerate(COMPRESSORS.items())]
+
+        print(f"{len(text) / 2 ** 20:.0f} MB per member, {policies} policies")
+        if zstandard is None:
+            print("zstandard is not installed: .zst is not checked")
+        print(f"{'archive':>14} {'member':>16} {'seconds':>8} {'MB/s':>8}")
+        for suffix in COMPRESSORS:
+            path = os.path.join(directory, f"configs.tar{suffix}")
+            write_archive(path, members)
+            start = time.perf_counter()
+            for member, lines in iter_archive(path):
+                parsed = FortiGateConfigParser().parse_stream(lines, member)
+                elapsed = time.perf_counter() - start
+                assert parsed == expected, f"{member} of {os.path.basename(path)} parsed differently"
+                print(f"{os.path.basename(path):>14} {member:>16} {elapsed:>8.2f} "
+                      f"{len(text) / 2 ** 20 / elapsed:>8.1f}")
+                start = time.perf_counter()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter so every import is cold
+PROBE = r"""
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+timings = {}
+start = time.perf_counter()
+import fortigate_parser
+timings["import fortigate_parser"] = time.perf_counter() - start
+timings["parser pulls in sqlalchemy"] = "sqlalchemy" in sys.modules
+start = time.perf_counter()
+import main
+timings["import main"] = time.perf_counter() - start
+start = time.perf_counter()
+import database_handler
+timings["import database_handler"] = time.perf_counter() - start
+start = time.perf_counter()
+database_handler.FortiGateDatabaseHandler(sys.argv[2])
+timings["construct handler"] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+
+def probe(db_url, repeat):
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", PROBE, REPO_DIR, db_url],
+            check=True, capture_output=True, text=True
+        ).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {key: min(run[key] for run in runs) for key in runs[0]}
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        db_url = f"sqlite:///{db_path}"
+
+        new_db = []
+        for _ in range(repeat):
+            if os.path.exists(db_path):
+                os.remove(db_path)
+            new_db.append(probe(db_url, 1)["construct handler"])
+        existing = probe(db_url, repeat)
+
+    if existing["parser pulls in sqlalchemy"]:
+        print("[ERROR] fortigate_parser imports sqlalchemy")
+        sys.exit(1)
+    for key in ("import fortigate_parser", "import main", "import database_handler"):
+        print(f"{key:<40} {existing[key] * 1000:8.1f} ms")
+    print(f"{'handler, new database (create_all)':<40} {min(new_db) * 1000:8.1f} ms")
+    print(f"{'handler, existing database':<40} {existing['construct handler'] * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
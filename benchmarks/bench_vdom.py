@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database_handler import FortiGateDatabaseHandler
+from fortigate_parser import FortiGateConfigParser
+from synthetic import generate_vdom_config_lines
+from vdom_ingest import load_vdoms
+
+
+def timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def main():
+    # One multi-VDOM device, loaded in one process and with one process per VDOM
+    vdoms = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    policies = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "vdoms.conf")
+        with open(path, "w") as f:
+            f.writelines(generate_vdom_config_lines(vdoms=vdoms, policies=policies))
+
+        serial_db = FortiGateDatabaseHandler(f"sqlite:///{os.path.join(directory, 'serial.db')}")
+        serial, serial_time = timed(
+            lambda: serial_db.bulk_load(FortiGateConfigParser().parse_mmap(path), "vdoms.conf", path))
+        parallel_db = FortiGateDatabaseHandler(f"sqlite:///{os.path.join(directory, 'parallel.db')}")
+        parallel, parallel_time = timed(lambda: load_vdoms(path, db=parallel_db, parallel=True))
+        assert serial == parallel
+
+    print(f"{vdoms} VDOMs, {policies} policies, {sum(serial.values())} rows")
+    print(f"{'parse + bulk_load':>24} {serial_time:>8.2f}s")
+    print(f"{'load_vdoms (parallel)':>24} {parallel_time:>8.2f}s")
+    print(f"{'CPUs':>24} {os.cpu_count():>8}")
+
+
+if __name__ == "__main__":
+    main()
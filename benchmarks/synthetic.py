@@ -0,0 +1,128 @@
+import itertools
+import random
+
+
+def generate_config_lines(policies=10000, addresses=5000, interfaces=200, seed=1):
+    rng = random.Random(seed)
+
+    yield "config system global\n"
+    yield '    set hostname "FGT-SYNTHETIC"\n'
+    yield "    set timezone 26\n"
+    yield "end\n"
+
+    yield "config system interface\n"
+    for i in range(interfaces):
+        yield f'    edit "port{i}"\n'
+        yield f"        set ip 10.{i // 256}.{i % 256}.1 255.255.255.0\n"
+        yield "        set allowaccess ping https ssh\n"
+        yield f'        set alias "Port {i} uplink"\n'
+        yield "        config ipv6\n"
+        yield f"            set ip6-address 2001:db8:{i:x}::1/64\n"
+        yield "        end\n"
+        yield "    next\n"
+    yield "end\n"
+
+    yield "config firewall address\n"
+    for i in range(addresses):
+        yield f'    edit "addr_{i}"\n'
+        yield f"        set subnet 172.{16 + i // 65536 % 16}.{i // 256 % 256}.{i % 256} 255.255.255.255\n"
+        yield f'        set comment "Synthetic host {i}"\n'
+        yield "    next\n"
+    yield "end\n"
+
+    yield "config firewall addrgrp\n"
+    for i in range(max(1, addresses // 50)):
+        members = " ".join(f'"addr_{rng.randrange(addresses)}"' for _ in range(8))
+        yield f'    edit "grp_{i}"\n'
+        yield f"        set member {members}\n"
+        yield "    next\n"
+    yield "end\n"
+
+    yield "config firewall policy\n"
+    for i in range(1, policies + 1):
+        yield f"    edit {i}\n"
+        yield f'        set name "policy_{i}"\n'
+        yield f'        set srcintf "port{rng.randrange(interfaces)}"\n'
+        yield f'        set dstintf "port{rng.randrange(interfaces)}"\n'
+        yield f'        set srcaddr "addr_{rng.randrange(addresses)}"\n'
+        yield f'        set dstaddr "addr_{rng.randrange(addresses)}"\n'
+        yield "        set action accept\n"
+        yield '        set schedule "always"\n'
+        yield '        set service "HTTP" "HTTPS" "SSH"\n'
+        yield "        set logtraffic all\n"
+        yield "    next\n"
+    yield "end\n"
+
+
+def generate_certificate_lines(certificates=2000, admins=500, seed=1):
+    # Backup-style blocks whose quoted values span many lines: PEM
+    # certificates and keys, ssh public keys and a CLI script
+    rng = random.Random(seed)
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+
+    def base64_lines(lines):
+        return "\n".join("".join(rng.choice(alphabet) for _ in range(64)) for _ in range(lines))
+
+    def pem(kind, lines):
+        return f"-----BEGIN {kind}-----\n{base64_lines(lines)}\n-----END {kind}-----"
+
+    yield "config vpn certificate local\n"
+    for i in range(certificates):
+        yield f'    edit "cert_{i}"\n'
+        yield f"        set password ENC {rng.getrandbits(128):032x}\n"
+        yield f'        set comments "Synthetic certificate {i}"\n'
+        yield f'        set private-key "{pem("ENCRYPTED PRIVATE KEY", 26)}"\n'
+        yield f'        set certificate "{pem("CERTIFICATE", 20)}"\n'
+        yield "    next\n"
+    yield "end\n"
+
+    yield "config system admin\n"
+    for i in range(admins):
+        yield f'    edit "admin_{i}"\n'
+        yield '        set accprofile "super_admin"\n'
+        yield f'        set ssh-public-key1 "ssh-rsa {base64_lines(6)} admin_{i}@example"\n'
+        yield "    next\n"
+    yield "end\n"
+
+    yield "config system auto-script\n"
+    yield '    edit "backup"\n'
+    yield '        set script "config system global\n'
+    yield '    set hostname \\"FGT\\"\n'
+    yield "end\n"
+    yield 'execute backup config ftp"\n'
+    yield "    next\n"
+    yield "end\n"
+
+
+def generate_vdom_config_lines(vdoms=40, policies=100000, interfaces=200, seed=1):
+    # A multi-VDOM backup: the VDOM list, "config global" with the system
+    # settings and interfaces, then one "edit <vdom>" per VDOM with its own
+    # addresses, groups and policies. The first VDOM holds a quarter of the
+    # policies and the others share the rest.
+    names = ["root"] + [f"vd{i}" for i in range(1, vdoms)]
+    yield "config vdom\n"
+    for name in names:
+        yield f"edit {name}\n"
+        yield "next\n"
+    yield "end\n"
+
+    yield "config global\n"
+    yield from itertools.takewhile(lambda line: line != "config firewall address\n",
+                                   generate_config_lines(interfaces=interfaces, seed=seed))
+    yield "end\n"
+
+    yield "config vdom\n"
+    for i, name in enumerate(names):
+        count = policies // 4 if i == 0 or vdoms == 1 else max(1, policies * 3 // 4 // (vdoms - 1))
+        yield f"edit {name}\n"
+        lines = generate_config_lines(policies=count, addresses=max(50, count // 2), interfaces=interfaces,
+                                      seed=seed + i)
+        yield from itertools.dropwhile(lambda line: line != "config firewall address\n", lines)
+        yield "next\n"
+    yield "end\n"
+
+
+def write_config(path, **kwargs):
+    with open(path, "w") as f:
+        f.writelines(generate_config_lines(**kwargs))
+    return path
@@ -0,0 +1,203 @@
+from collections.abc import Mapping
+
+# Compact, read-only form of a parsed config. The plain parser output stores a
+# fresh str for every key of every object and a dict per object; here
+#   - keys and short values are interned once per config, so "srcintf",
+#     "accept" or "port1" exist once however many policies use them,
+#   - an object is a Record with two slots: a Shape (its key tuple plus a
+#     key -> position index, shared by every object with the same keys in the
+#     same order, e.g. nearly all policies) and a tuple of values,
+#   - list values are interned tuples,
+#   - a table of named objects ("edit" entries) is a Table over one dict.
+# Records and tables are Mappings, and to_dict() materializes a plain dict
+# identical to the parser's (same keys, order, lists) only when asked for.
+
+# Values up to this length are interned; longer ones (comments, certificates,
+# uuids) are rarely repeated
+INTERN_MAX_LENGTH = 32
+
+
+class Shape:
+    __slots__ = ("keys", "index")
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.index = {key: i for i, key in enumerate(keys)}
+
+
+class Record(Mapping):
+    # One object or settings block: a shared Shape and its values
+    __slots__ = ("_shape", "_values")
+
+    def __init__(self, shape, values):
+        self._shape = shape
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._shape.index[key]]
+
+    def __iter__(self):
+        return iter(self._shape.keys)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._shape.index
+
+    def items(self):
+        return zip(self._shape.keys, self._values)
+
+    def to_dict(self):
+        return {key: _materialize(value) for key, value in zip(self._shape.keys, self._values)}
+
+    def __repr__(self):
+        return f"Record({self.to_dict()!r})"
+
+
+class Table(Mapping):
+    # Named objects of one config table ("edit <name>" entries), in order
+    __slots__ = ("_items",)
+
+    def __init__(self, items):
+        self._items = items
+
+    def __getitem__(self, key):
+        return self._items[key]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def items(self):
+        return self._items.items()
+
+    def to_dict(self):
+        return {name: _materialize(value) for name, value in self._items.items()}
+
+    def __repr__(self):
+        return f"Table({len(self._items)} objects)"
+
+
+def _materialize(value):
+    if isinstance(value, (Record, Table)):
+        return value.to_dict()
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+
+def _merge(target, data):
+    # Same merge as the parser applies to a reopened "config" block
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = value
+
+
+class CompactBuilder:
+    # Converts parsed dicts, interning strings, tuples and shapes in tables
+    # that live only as long as the builder
+    def __init__(self):
+        self.strings = {}
+        self.tuples = {}
+        self.shapes = {}
+
+    def intern(self, value):
+        if len(value) > INTERN_MAX_LENGTH:
+            return value
+        return self.strings.setdefault(value, value)
+
+    def shape(self, keys):
+        shape = self.shapes.get(keys)
+        if shape is None:
+            shape = self.shapes[keys] = Shape(keys)
+        return shape
+
+    def node(self, data):
+        # A dict whose values are all dicts is a table of objects
+        if data and all(type(value) is dict for value in data.values()):
+            intern = self.intern
+            return Table({intern(name): self.node(value) for name, value in data.items()})
+        # Hot path (one call per object): interning inlined
+        strings = self.strings
+        keys = []
+        for key in data:
+            keys.append(strings.setdefault(key, key) if len(key) <= INTERN_MAX_LENGTH else key)
+        values = []
+        for value in data.values():
+            kind = type(value)
+            if kind is str:
+                if len(value) <= INTERN_MAX_LENGTH:
+                    value = strings.setdefault(value, value)
+            elif kind is list:
+                value = self.value(value)
+            elif kind is dict:
+                value = self.node(value)
+            values.append(value)
+        return Record(self.shape(tuple(keys)), tuple(values))
+
+    def value(self, value):
+        if isinstance(value, str):
+            return self.intern(value)
+        if isinstance(value, list):
+            items = tuple(self.intern(item) if isinstance(item, str) else item for item in value)
+            return self.tuples.setdefault(items, items)
+        if isinstance(value, dict):
+            return self.node(value)
+        return value
+
+
+class CompactConfig(Mapping):
+    # Section name -> Table or Record. Plain dicts are materialized per
+    # section (section_dict, iter_sections) or for the whole tree (to_dict).
+    def __init__(self, sections=None):
+        self.sections = sections if sections is not None else {}
+
+    @classmethod
+    def from_sections(cls, sections):
+        # sections: iterable of (name, dict), e.g. FortiGateConfigParser.iter_sections(),
+        # so only one section exists as plain dicts at a time
+        builder = CompactBuilder()
+        compact = {}
+        for name, data in sections:
+            if name in compact:
+                merged = _materialize(compact[name])
+                if isinstance(merged, dict) and isinstance(data, dict):
+                    _merge(merged, data)
+                    data = merged
+            compact[builder.intern(name)] = builder.value(data)
+        return cls(compact)
+
+    @classmethod
+    def from_dict(cls, config_dict):
+        return cls.from_sections(config_dict.items())
+
+    def __getitem__(self, section):
+        return self.sections[section]
+
+    def __iter__(self):
+        return iter(self.sections)
+
+    def __len__(self):
+        return len(self.sections)
+
+    def section_dict(self, section, default=None):
+        # One section as the parser would have returned it
+        if section not in self.sections:
+            return default
+        return _materialize(self.sections[section])
+
+    def iter_sections(self):
+        # (name, plain dict) one section at a time, for bulk_load, sync or the exporters
+        for section, node in self.sections.items():
+            yield section, _materialize(node)
+
+    def to_dict(self):
+        return dict(self.iter_sections())
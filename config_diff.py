@@ -0,0 +1,204 @@
+import argparse
+import json
+import sys
+import time
+from bisect import bisect_left
+from collections.abc import Mapping
+from fortigate_parser import FortiGateConfigParser, lookup_digest
+
+ADDED = "added"
+REMOVED = "removed"
+MODIFIED = "modified"
+MOVED = "moved"
+
+
+def _moved_keys(old_keys, new_keys):
+    # Keys present in both whose relative order changed: everything outside a
+    # longest increasing run of old positions, taken in new order
+    old_position = {key: i for i, key in enumerate(old_keys)}
+    common = [key for key in new_keys if key in old_position]
+    tails, tail_index, previous = [], [], [None] * len(common)
+    for i, key in enumerate(common):
+        position = old_position[key]
+        j = bisect_left(tails, position)
+        if j == len(tails):
+            tails.append(position)
+            tail_index.append(i)
+        else:
+            tails[j] = position
+            tail_index[j] = i
+        previous[i] = tail_index[j - 1] if j else None
+    keep = set()
+    i = tail_index[-1] if tail_index else None
+    while i is not None:
+        keep.add(common[i])
+        i = previous[i]
+    return [key for key in common if key not in keep]
+
+
+def _plain(value):
+    # Values of a compact tree (compact_config Records, Tables and tuples) as
+    # the parser's dicts and lists, so records stay JSON-serializable
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, Mapping):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+
+class ConfigDiff:
+    # Structural diff of two parsed configs. Subtrees whose Merkle digests
+    # match are skipped without being walked, so the cost follows the size of
+    # the change rather than the size of the config. Records are yielded one
+    # at a time: added/removed objects with their values, modified objects
+    # with attribute-level changes, and objects moved within their section.
+    # Either config may also be a compact_config.CompactConfig; its subtrees
+    # have no digests and are compared by value instead.
+    def __init__(self, old_config, new_config, old_digests=None, new_digests=None):
+        self.old_config = old_config
+        self.new_config = new_config
+        # Digests recorded by FortiGateConfigParser(hash_subtrees=True) are
+        # reused; anything missing is hashed on first use
+        self.old_digests = {} if old_digests is None else old_digests
+        self.new_digests = {} if new_digests is None else new_digests
+
+    def _same(self, old, new):
+        if type(old) is dict and type(new) is dict:
+            return lookup_digest(old, self.old_digests) == lookup_digest(new, self.new_digests)
+        if isinstance(old, Mapping) and isinstance(new, Mapping):
+            # Mapping equality ignores key order, which digests include
+            return old == new and list(old) == list(new)
+        return old == new
+
+    def __iter__(self):
+        if self._same(self.old_config, self.new_config):
+            return
+        for section in self._keys(self.old_config, self.new_config):
+            old = self.old_config.get(section)
+            new = self.new_config.get(section)
+            if old is None or new is None or not self._same(old, new):
+                # A section only on one side is diffed against an empty one,
+                # so it still comes out as one record per object
+                yield from self._diff_section(section, old or {}, new or {})
+
+    def _keys(self, old, new):
+        # New order first, then keys only present in the old tree
+        return list(new) + [key for key in old if key not in new]
+
+    def _diff_section(self, section, old, new):
+        if not isinstance(old, Mapping) or not isinstance(new, Mapping):
+            yield from self._replace(section, None, old, new)
+            return
+        # Direct settings of the section ("system global") form one object
+        settings_old = {key: _plain(value) for key, value in old.items() if not isinstance(value, Mapping)}
+        settings_new = {key: _plain(value) for key, value in new.items() if not isinstance(value, Mapping)}
+        if not settings_old and settings_new:
+            yield dict(op=ADDED, section=section, object=None, values=settings_new)
+        elif settings_old and not settings_new:
+            yield dict(op=REMOVED, section=section, object=None, values=settings_old)
+        elif settings_old != settings_new:
+            changes = list(self._changes([], settings_old, settings_new))
+            yield dict(op=MODIFIED, section=section, object=None, changes=changes)
+
+        old_digests, new_digests = self.old_digests, self.new_digests
+        for name in self._keys(old, new):
+            old_object = old.get(name)
+            new_object = new.get(name)
+            if type(old_object) is dict and type(new_object) is dict:
+                # Inline digest comparison: this is the hot loop on large sections
+                old_entry = old_digests.get(id(old_object))
+                new_entry = new_digests.get(id(new_object))
+                if old_entry is not None and new_entry is not None and old_entry[1] == new_entry[1]:
+                    continue
+                if not self._same(old_object, new_object):
+                    changes = list(self._changes([], old_object, new_object))
+                    if changes:
+                        yield dict(op=MODIFIED, section=section, object=name, changes=changes)
+            elif isinstance(old_object, Mapping) and isinstance(new_object, Mapping):
+                if not self._same(old_object, new_object):
+                    changes = list(self._changes([], old_object, new_object))
+                    if changes:
+                        yield dict(op=MODIFIED, section=section, object=name, changes=changes)
+            elif not isinstance(old_object, Mapping) and not isinstance(new_object, Mapping):
+                continue
+            elif old_object is None:
+                yield dict(op=ADDED, section=section, object=name, values=_plain(new_object))
+            elif new_object is None:
+                yield dict(op=REMOVED, section=section, object=name, values=_plain(old_object))
+            else:
+                yield from self._replace(section, name, old_object, new_object)
+
+        if list(old) == list(new):
+            return
+        old_objects = [key for key, value in old.items() if isinstance(value, Mapping)]
+        new_objects = [key for key, value in new.items() if isinstance(value, Mapping)]
+        if old_objects != new_objects:
+            previous = dict(zip(new_objects, [None] + new_objects[:-1]))
+            for name in _moved_keys(old_objects, new_objects):
+                yield dict(op=MOVED, section=section, object=name, after=previous[name])
+
+    def _replace(self, section, name, old, new):
+        if old is not None:
+            yield dict(op=REMOVED, section=section, object=name, values=_plain(old))
+        if new is not None:
+            yield dict(op=ADDED, section=section, object=name, values=_plain(new))
+
+    def _changes(self, path, old, new):
+        # Attribute-level changes below one object; equal nested blocks are
+        # skipped by digest
+        for key in self._keys(old, new):
+            old_value = old.get(key)
+            new_value = new.get(key)
+            if isinstance(old_value, Mapping) and isinstance(new_value, Mapping):
+                if not self._same(old_value, new_value):
+                    yield from self._changes(path + [key], old_value, new_value)
+            elif old_value != new_value:
+                yield dict(path=path + [key], old=_plain(old_value), new=_plain(new_value))
+
+
+def diff_files(old_path, new_path):
+    # Parses both files with subtree hashing and returns the ConfigDiff
+    old_parser = FortiGateConfigParser(hash_subtrees=True)
+    new_parser = FortiGateConfigParser(hash_subtrees=True)
+    old_config = old_parser.parse_from_file(old_path)
+    new_config = new_parser.parse_from_file(new_path)
+    return ConfigDiff(old_config, new_config, old_parser.digests, new_parser.digests)
+
+
+def write_jsonl(records, f):
+    count = 0
+    for record in records:
+        f.write(json.dumps(record))
+        f.write("\n")
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Diff two FortiGate config files")
+    arg_parser.add_argument("old_file", help="older .conf file")
+    arg_parser.add_argument("new_file", help="newer .conf file")
+    arg_parser.add_argument("--output", help="write JSONL here instead of stdout")
+    arg_parser.add_argument("--device", help="store the diff in the config_diffs table under this device")
+    arg_parser.add_argument("--db-url", default='sqlite:///fortigate_config.db')
+    args = arg_parser.parse_args()
+
+    start = time.perf_counter()
+    diff = diff_files(args.old_file, args.new_file)
+    parsed = time.perf_counter() - start
+
+    records = diff
+    if args.device:
+        from database_handler import FortiGateDatabaseHandler
+        db = FortiGateDatabaseHandler(args.db_url)
+        records = db.save_config_diff(diff, args.device, args.old_file.split('/')[-1],
+                                      args.new_file.split('/')[-1])
+    if args.output:
+        with open(args.output, "w") as f:
+            count = write_jsonl(records, f)
+    else:
+        count = write_jsonl(records, sys.stdout)
+    print(f"[INFO] {count} changes (parse {parsed:.2f}s, total {time.perf_counter() - start:.2f}s)",
+          file=sys.stderr)
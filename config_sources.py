@@ -0,0 +1,114 @@
+import bz2
+import codecs
+import gzip
+import io
+import lzma
+import os
+
+# Plain config files, before any compression suffix
+CONFIG_EXTENSIONS = (".conf", ".cfg")
+
+# Compressed files are recognized by their leading bytes, so a backup that
+# lost its suffix still reads; the suffixes are only stripped from names
+MAGIC = (
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+)
+COMPRESSION_SUFFIXES = (".gz", ".bz2", ".xz", ".zst")
+ARCHIVE_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz", ".tar.zst", ".tzst")
+
+
+def _zstandard():
+    # Optional, and imported on first use only: it would add more to the
+    # parser's import time than the rest of this module
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstandard is required to read .zst files (pip install zstandard)") from None
+    return zstandard
+
+
+def _compression(head):
+    for magic, kind in MAGIC:
+        if head.startswith(magic):
+            return kind
+    return None
+
+
+def compression_of(filepath):
+    # "gzip", "bz2", "xz", "zstd" or None for a plain file
+    with open(filepath, 'rb') as f:
+        return _compression(f.read(6))
+
+
+def decompressed(f):
+    # Binary stream f, decompressed on the fly if it starts with a known
+    # magic number. f must support peek() (files opened 'rb', tar members).
+    kind = _compression(f.peek(6)[:6])
+    if kind == "gzip":
+        return gzip.GzipFile(fileobj=f)
+    if kind == "bz2":
+        return bz2.BZ2File(f)
+    if kind == "xz":
+        return lzma.LZMAFile(f)
+    if kind == "zstd":
+        # The zstd reader only has read()/readinto(); buffered, it can be
+        # iterated by line like the other decompressors
+        return io.BufferedReader(_zstandard().ZstdDecompressor().stream_reader(f, closefd=False))
+    return f
+
+
+def open_config(filepath):
+    # Text stream over a config file, plain or compressed; decompression
+    # happens as lines are read, nothing is written to disk
+    kind = compression_of(filepath)
+    if kind == "gzip":
+        return gzip.open(filepath, 'rt')
+    if kind == "bz2":
+        return bz2.open(filepath, 'rt')
+    if kind == "xz":
+        return lzma.open(filepath, 'rt')
+    if kind == "zstd":
+        return io.TextIOWrapper(_zstandard().ZstdDecompressor().stream_reader(open(filepath, 'rb')))
+    return open(filepath, 'r')
+
+
+def strip_compression(name):
+    # "fw01.conf.gz" -> "fw01.conf"
+    for suffix in COMPRESSION_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def is_config_name(name):
+    return strip_compression(name).endswith(CONFIG_EXTENSIONS)
+
+
+def is_archive(filepath):
+    if filepath.endswith(ARCHIVE_SUFFIXES):
+        return True
+    if is_config_name(filepath) or not os.path.isfile(filepath):
+        return False
+    import tarfile
+    return tarfile.is_tarfile(filepath)
+
+
+def iter_archive(filepath, config_only=True):
+    # Yields (member_name, lines) for each regular file of a tar archive
+    # (optionally compressed as a whole, and members may be compressed too)
+    # in archive order. The archive is read once as a stream: nothing is
+    # extracted, and each member's lines are only readable until the next
+    # member is yielded.
+    import tarfile
+    with open(filepath, 'rb') as raw:
+        with tarfile.open(fileobj=decompressed(raw), mode="r|") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                if config_only and not is_config_name(member.name):
+                    continue
+                # A streamed member cannot seek, which io.TextIOWrapper needs
+                yield member.name, codecs.iterdecode(decompressed(tar.extractfile(member)), "utf-8")
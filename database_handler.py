@@ -1,253 +1,847 @@
 from sqlalchemy import (
-    create_engine, MetaData, Table, Column, Integer, String, ForeignKey
+    create_engine, MetaData, Table, Column, Integer, String, ForeignKey,
+    ForeignKeyConstraint, Index, and_, bindparam, func, inspect, literal, select, union_all
 )
+from sqlalchemy.dialects.sqlite import insert
 from sqlalchemy.orm import sessionmaker
+from collections import OrderedDict, defaultdict
+from address_resolver import AddressGroupResolver
+from fortigate_parser import DEFAULT_VDOM, GLOBAL_VDOM, VDOM_SECTIONS, iter_vdom_sections
+from ip_index import AddressIndex, from_key, interface_range, ip_range_columns, parse_ip_range, to_key
 import datetime
+import json
+import hashlib
 
-class FortiGateDatabaseHandler:
-    def __init__(self, db_url='sqlite:///fortigate_config.db'):
-        self.engine = create_engine(db_url, echo=False)
-        self.metadata = MetaData()
-
-        self.system_interface = Table(
-            'system_interface', self.metadata,
-            Column('name', String, primary_key=True),
-            Column('ip', String),
-            Column('allowaccess', String),
-            Column('alias', String),
-            Column('source_file', String),
-            Column('local_file', String),
-            Column('created_at', String)
-        )
+# ingest_cache.section value holding the digest of the whole file
+FILE_DIGEST_KEY = ""
 
-        self.firewall_address = Table(
-            'firewall_address', self.metadata,
-            Column('name', String, primary_key=True),
-            Column('subnet', String),
-            Column('fqdn', String),
-            Column('source_file', String),
-            Column('local_file', String),
-            Column('created_at', String)
-        )
+# Bump whenever the table definitions below change, and add the step that
+# upgrades the previous version to MIGRATIONS
+SCHEMA_VERSION = 13
 
-        self.firewall_addrgrp = Table(
-            'firewall_addrgrp', self.metadata,
-            Column('name', String, primary_key=True),
-            Column('member', String),
-            Column('source_file', String),
-            Column('local_file', String),
-            Column('created_at', String)
-        )
+# {version: function(handler, conn)} upgrading a database of that schema
+# version to the next one, applied in order by _ensure_schema. A database
+# whose version has no step here cannot be upgraded and must be re-created.
+MIGRATIONS = {}
 
-        self.firewall_policies = Table(
-            'firewall_policies', self.metadata,
-            Column('id', Integer, primary_key=True),
-            Column('name', String),
-            Column('srcintf', String),
-            Column('dstintf', String),
-            Column('srcaddr', String),
-            Column('dstaddr', String),
-            Column('service', String),
-            Column('action', String),
-            Column('schedule', String),
-            Column('logtraffic', String),
-            Column('source_file', String),
-            Column('local_file', String),
-            Column('created_at', String)
-        )
 
-        self.vpn_phase1 = Table(
-            'vpn_phase1', self.metadata,
-            Column('name', String, primary_key=True),
-            Column('interface', String),
-            Column('peertype', String),
-            Column('net_device', String),
-            Column('proposal', String),
-            Column('remote_gw', String),
-            Column('psksecret', String),
-            Column('source_file', String),
-            Column('local_file', String),
-            Column('created_at', String)
-        )
+def _migration(version):
+    def register(step):
+        MIGRATIONS[version] = step
+        return step
+    return register
 
-        self.vpn_phase2 = Table(
-            'vpn_phase2', self.metadata,
-            Column('name', String, primary_key=True),
-            Column('phase1name', String),
-            Column('proposal', String),
-            Column('pfs', String),
-            Column('replay', String),
-            Column('source_file', String),
-            Column('local_file', String),
-            Column('created_at', String)
-        )
+# Device name used when a load does not specify one and has no source file
+DEFAULT_DEVICE = "default"
 
-        self.phase2_selectors = Table(
-            'phase2_selectors', self.metadata,
-            Column('vpn_name', String, ForeignKey('vpn_phase2.name')),
-            Column('selector_id', String),
-            Column('src_subnet', String),
-            Column('dst_subnet', String),
-            Column('source_file', String),
-            Column('local_file', String),
-            Column('created_at', String)
-        )
+# Address resolvers and indexes kept per handler, most recently used first;
+# each holds a whole group closure or range index, and a long-running loader
+# (fleet_ingest, watch_ingest) creates a new snapshot per file
+ADDRESS_CACHE_SIZE = 8
 
-        self.dhcp_servers = Table(
-            'dhcp_servers', self.metadata,
-            Column('id', Integer, primary_key=True),
-            Column('dns_service', String),
-            Column('default_gateway', String),
-            Column('netmask', String),
-            Column('interface', String),
-            Column('timezone_option', String),
-            Column('tftp_server', String),
-            Column('source_file', String),
-            Column('local_file', String),
-            Column('created_at', String)
-        )
+# Bookkeeping columns left out of the row hash used by sync()
+UNHASHED_COLUMNS = {"source_file", "local_file", "created_at"}
 
-        self.ip_ranges = Table(
-            'ip_ranges', self.metadata,
-            Column('dhcp_id', Integer, ForeignKey('dhcp_servers.id')),
-            Column('range_id', String),
-            Column('start_ip', String),
-            Column('end_ip', String),
-            Column('source_file', String),
-            Column('local_file', String),
-            Column('created_at', String)
-        )
+# Top-level config section -> method building its rows, keyed by table
+SECTION_ROW_BUILDERS = {
+    "system global": "_system_global_rows",
+    "system interface": "_system_interface_rows",
+    "firewall address": "_firewall_address_rows",
+    "firewall address6": "_firewall_address6_rows",
+    "firewall addrgrp": "_firewall_addrgrp_rows",
+    "firewall policy": "_firewall_policies_rows",
+    "user local": "_user_local_rows",
+    "dhcp server": "_dhcp_servers_rows",
+    "vpn ipsec phase1-interface": "_vpn_phase1_rows",
+    "vpn ipsec phase2-interface": "_vpn_phase2_rows",
+    "firewall service custom": "_firewall_service_custom_rows",
+    "router static": "_router_static_rows",
+    "system admin": "_system_admin_rows",
+    "firewall schedule recurring": "_firewall_schedule_recurring_rows",
+    "firewall vip": "_firewall_vip_rows",
+}
 
-        self.user_local = Table(
-            'user_local', self.metadata,
-            Column('username', String, primary_key=True),
-            Column('password', String),
-            Column('type', String),
-            Column('source_file', String),
-            Column('local_file', String),
-            Column('created_at', String)
-        )
 
-        self.system_global = Table(
-            'system_global', self.metadata,
-            Column('setting', String, primary_key=True),
-            Column('value', String),
-            Column('source_file', String),
-            Column('local_file', String),
-            Column('created_at', String)
-        )
+def _snapshot_key_columns():
+    # Rows are keyed by device, snapshot and VDOM first, so the primary key
+    # index also serves lookups of one VDOM of a snapshot
+    return [
+        Column('device_name', String, primary_key=True),
+        Column('snapshot_id', Integer, ForeignKey('snapshots.id'), primary_key=True),
+        Column('vdom', String, primary_key=True)
+    ]
 
-        self.config_changes = Table(
-            'config_changes', self.metadata,
-            Column('id', Integer, primary_key=True, autoincrement=True),
-            Column('action', String),
-            Column('object_type', String),
-            Column('object_name', String),
-            Column('new_name', String),
-            Column('source_file', String),
-            Column('local_file', String),
-            Column('timestamp', String)
-        )
 
-        self.firewall_service_custom = Table(
-            'firewall_service_custom', self.metadata,
-            Column('name', String, primary_key=True),
-            Column('protocol', String),
-            Column('tcp_portrange', String),
-            Column('udp_portrange', String),
-            Column('icmp_type', String),
-            Column('icmp_code', String),
-            Column('comment', String),
-            Column('source_file', String),
-            Column('local_file', String),
-            Column('created_at', String)
-        )
+def _link_table(name, owner_column, owner_type, owner_table, owner_key):
+    return Table(
+        name, metadata,
+        *_snapshot_key_columns(),
+        Column(owner_column, owner_type, primary_key=True),
+        Column('name', String, primary_key=True),
+        Column('position', Integer),
+        ForeignKeyConstraint(
+            ['device_name', 'snapshot_id', 'vdom', owner_column],
+            [f'{owner_table}.device_name', f'{owner_table}.snapshot_id', f'{owner_table}.vdom',
+             f'{owner_table}.{owner_key}']
+        ),
+        Index(f'ix_{name}_name', 'name', 'device_name', 'snapshot_id', 'vdom')
+    )
 
-        self.router_static = Table(
-            'router_static', self.metadata,
-            Column('id', Integer, primary_key=True),
-            Column('dst', String),
-            Column('gateway', String),
-            Column('device', String),
-            Column('priority', String),
-            Column('distance', String),
-            Column('comment', String),
-            Column('source_file', String),
-            Column('local_file', String),
-            Column('created_at', String)
-        )
 
-        self.system_admin = Table(
-            'system_admin', self.metadata,
-            Column('username', String, primary_key=True),
-            Column('password', String),
-            Column('ssh_public_key1', String),
-            Column('accprofile', String),
-            Column('source_file', String),
-            Column('local_file', String),
-            Column('created_at', String)
-        )
+def _range_columns(prefix=""):
+    # Numeric bounds of an address as fixed-width hex (see ip_index.to_key)
+    return [
+        Column(f'{prefix}ip_version', Integer),
+        Column(f'{prefix}range_start', String),
+        Column(f'{prefix}range_end', String)
+    ]
+
+
+def _range_index(table_name, prefix=""):
+    return Index(
+        f'ix_{table_name}_{prefix}range',
+        f'{prefix}ip_version', f'{prefix}range_start', f'{prefix}range_end'
+    )
+
+
+def _interface_range_columns(value, prefix=""):
+    bounds = interface_range(value)
+    if bounds is None:
+        return ip_range_columns(None, prefix=prefix)
+    version, start, end = bounds
+    return {f"{prefix}ip_version": version, f"{prefix}range_start": to_key(start), f"{prefix}range_end": to_key(end)}
+
+
+def _next_day(day):
+    return (datetime.date.fromisoformat(day) + datetime.timedelta(days=1)).isoformat()
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, dict)):
+        return list(value)
+    return [value]
+
+
+# Copies of the tables in a database attached as "stage" (merge_stages)
+staged_metadata = MetaData()
+
+
+class _BoundedCache(OrderedDict):
+    # Dict that keeps its `size` most recently used entries
+    def __init__(self, size):
+        super().__init__()
+        self.size = size
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.size:
+            self.popitem(last=False)
+
+
+def _staged_table(table):
+    key = f"stage.{table.name}"
+    if key in staged_metadata.tables:
+        return staged_metadata.tables[key]
+    return table.to_metadata(staged_metadata, schema="stage")
+
+
+# Tables are defined once per process at import time; handler instances only
+# open an engine against them.
+metadata = MetaData()
+
+snapshots = Table(
+    'snapshots', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('device_name', String, nullable=False),
+    Column('source_file', String),
+    Column('local_file', String),
+    Column('created_at', String),
+    # Last time the snapshot's rows were written: its creation, or a later
+    # in-place sync or section save
+    Column('updated_at', String),
+    Index('ix_snapshots_device_created', 'device_name', 'created_at'),
+    Index('ix_snapshots_created', 'created_at'),
+    Index('ix_snapshots_updated', 'updated_at')
+)
+
+system_interface = Table(
+    'system_interface', metadata,
+    *_snapshot_key_columns(),
+    Column('name', String, primary_key=True),
+    Column('ip', String),
+    Column('allowaccess', String),
+    Column('alias', String),
+    *_range_columns(),
+    Column('ip6', String),
+    *_range_columns('ip6_'),
+    Column('source_file', String),
+    Column('local_file', String),
+    Column('created_at', String),
+    _range_index('system_interface'),
+    _range_index('system_interface', 'ip6_')
+)
+
+firewall_address = Table(
+    'firewall_address', metadata,
+    *_snapshot_key_columns(),
+    Column('name', String, primary_key=True),
+    Column('subnet', String),
+    Column('fqdn', String),
+    Column('start_ip', String),
+    Column('end_ip', String),
+    *_range_columns(),
+    Column('source_file', String),
+    Column('local_file', String),
+    Column('created_at', String),
+    _range_index('firewall_address')
+)
+
+firewall_address6 = Table(
+    'firewall_address6', metadata,
+    *_snapshot_key_columns(),
+    Column('name', String, primary_key=True),
+    Column('ip6', String),
+    Column('fqdn', String),
+    *_range_columns(),
+    Column('source_file', String),
+    Column('local_file', String),
+    Column('created_at', String),
+    _range_index('firewall_address6')
+)
 
-        self.firewall_schedule_recurring = Table(
-            'firewall_schedule_recurring', self.metadata,
-            Column('name', String, primary_key=True),
-            Column('start', String),
-            Column('end', String),
-            Column('day', String),
-            Column('source_file', String),
-            Column('local_file', String),
-            Column('created_at', String)
+firewall_addrgrp = Table(
+    'firewall_addrgrp', metadata,
+    *_snapshot_key_columns(),
+    Column('name', String, primary_key=True),
+    Column('member', String),
+    Column('source_file', String),
+    Column('local_file', String),
+    Column('created_at', String)
+)
+
+firewall_policies = Table(
+    'firewall_policies', metadata,
+    *_snapshot_key_columns(),
+    Column('id', Integer, primary_key=True),
+    Column('name', String),
+    Column('srcintf', String),
+    Column('dstintf', String),
+    Column('srcaddr', String),
+    Column('dstaddr', String),
+    Column('service', String),
+    Column('action', String),
+    Column('schedule', String),
+    Column('logtraffic', String),
+    Column('source_file', String),
+    Column('local_file', String),
+    Column('created_at', String)
+)
+
+# One row per value of a multi-valued field, indexed on both sides: the primary
+# key serves "members of X" and ix_<table>_name serves "what references X".
+policy_srcintf = _link_table('policy_srcintf', 'policy_id', Integer, 'firewall_policies', 'id')
+policy_dstintf = _link_table('policy_dstintf', 'policy_id', Integer, 'firewall_policies', 'id')
+policy_srcaddr = _link_table('policy_srcaddr', 'policy_id', Integer, 'firewall_policies', 'id')
+policy_dstaddr = _link_table('policy_dstaddr', 'policy_id', Integer, 'firewall_policies', 'id')
+policy_service = _link_table('policy_service', 'policy_id', Integer, 'firewall_policies', 'id')
+addrgrp_member = _link_table('addrgrp_member', 'group_name', String, 'firewall_addrgrp', 'name')
+
+# Flattened (transitive) address group membership, filled at load time
+addrgrp_closure = Table(
+    'addrgrp_closure', metadata,
+    *_snapshot_key_columns(),
+    Column('group_name', String, primary_key=True),
+    Column('member_name', String, primary_key=True),
+    ForeignKeyConstraint(
+        ['device_name', 'snapshot_id', 'vdom', 'group_name'],
+        ['firewall_addrgrp.device_name', 'firewall_addrgrp.snapshot_id', 'firewall_addrgrp.vdom',
+         'firewall_addrgrp.name']
+    ),
+    Index('ix_addrgrp_closure_member', 'member_name', 'device_name', 'snapshot_id', 'vdom')
+)
+
+# Policy field -> link table holding its values
+POLICY_LINK_TABLES = {
+    "srcintf": policy_srcintf,
+    "dstintf": policy_dstintf,
+    "srcaddr": policy_srcaddr,
+    "dstaddr": policy_dstaddr,
+    "service": policy_service,
+}
+
+# Materialized policy -> interface -> address join (the README query), one row
+# per combination of source/destination interface and address. Loads refresh
+# only the rows of the policies they touch (_refresh_resolved_policies).
+# Addresses are joined within the policy's VDOM; interfaces by name alone,
+# since a multi-VDOM config defines them all under "config global".
+resolved_policies = Table(
+    'resolved_policies', metadata,
+    Column('device_name', String, nullable=False),
+    Column('snapshot_id', Integer, ForeignKey('snapshots.id'), nullable=False),
+    Column('vdom', String, nullable=False),
+    Column('policy_id', Integer, nullable=False),
+    Column('policy_name', String),
+    Column('srcintf', String),
+    Column('srcintf_alias', String),
+    Column('srcintf_ip', String),
+    Column('dstintf', String),
+    Column('dstintf_alias', String),
+    Column('dstintf_ip', String),
+    Column('srcaddr', String),
+    Column('src_subnet', String),
+    Column('dstaddr', String),
+    Column('dst_subnet', String),
+    Column('service', String),
+    Column('action', String),
+    Column('schedule', String),
+    Column('logtraffic', String),
+    Column('source_file', String),
+    Column('created_at', String),
+    Index('ix_resolved_policies_policy', 'device_name', 'snapshot_id', 'vdom', 'policy_id'),
+    Index('ix_resolved_policies_srcintf', 'srcintf', 'device_name', 'snapshot_id'),
+    Index('ix_resolved_policies_dstintf', 'dstintf', 'device_name', 'snapshot_id'),
+    Index('ix_resolved_policies_srcaddr', 'srcaddr', 'device_name', 'snapshot_id'),
+    Index('ix_resolved_policies_dstaddr', 'dstaddr', 'device_name', 'snapshot_id'),
+    Index('ix_resolved_policies_action', 'action', 'device_name', 'snapshot_id')
+)
+
+# Tables feeding resolved_policies -> (what a changed row touches, key column).
+# Policies and addresses are touched as (vdom, key), interfaces by name.
+RESOLVED_SOURCES = {
+    firewall_policies: ("policy", "id"),
+    policy_srcintf: ("policy", "policy_id"),
+    policy_dstintf: ("policy", "policy_id"),
+    policy_srcaddr: ("policy", "policy_id"),
+    policy_dstaddr: ("policy", "policy_id"),
+    system_interface: ("interface", "name"),
+    firewall_address: ("address", "name"),
+}
+
+# Bound parameters per IN (...) list, below SQLite's variable limit
+IN_CLAUSE_SIZE = 500
+
+vpn_phase1 = Table(
+    'vpn_phase1', metadata,
+    *_snapshot_key_columns(),
+    Column('name', String, primary_key=True),
+    Column('interface', String),
+    Column('peertype', String),
+    Column('net_device', String),
+    Column('proposal', String),
+    Column('remote_gw', String),
+    Column('psksecret', String),
+    Column('source_file', String),
+    Column('local_file', String),
+    Column('created_at', String)
+)
+
+vpn_phase2 = Table(
+    'vpn_phase2', metadata,
+    *_snapshot_key_columns(),
+    Column('name', String, primary_key=True),
+    Column('phase1name', String),
+    Column('proposal', String),
+    Column('pfs', String),
+    Column('replay', String),
+    Column('source_file', String),
+    Column('local_file', String),
+    Column('created_at', String)
+)
+
+phase2_selectors = Table(
+    'phase2_selectors', metadata,
+    *_snapshot_key_columns(),
+    Column('vpn_name', String, primary_key=True),
+    Column('selector_id', String, primary_key=True),
+    Column('src_subnet', String),
+    Column('dst_subnet', String),
+    Column('source_file', String),
+    Column('local_file', String),
+    Column('created_at', String),
+    ForeignKeyConstraint(
+        ['device_name', 'snapshot_id', 'vdom', 'vpn_name'],
+        ['vpn_phase2.device_name', 'vpn_phase2.snapshot_id', 'vpn_phase2.vdom', 'vpn_phase2.name']
+    )
+)
+
+dhcp_servers = Table(
+    'dhcp_servers', metadata,
+    *_snapshot_key_columns(),
+    Column('id', Integer, primary_key=True),
+    Column('dns_service', String),
+    Column('default_gateway', String),
+    Column('netmask', String),
+    Column('interface', String),
+    Column('timezone_option', String),
+    Column('tftp_server', String),
+    Column('source_file', String),
+    Column('local_file', String),
+    Column('created_at', String)
+)
+
+ip_ranges = Table(
+    'ip_ranges', metadata,
+    *_snapshot_key_columns(),
+    Column('dhcp_id', Integer, primary_key=True),
+    Column('range_id', String, primary_key=True),
+    Column('start_ip', String),
+    Column('end_ip', String),
+    Column('source_file', String),
+    Column('local_file', String),
+    Column('created_at', String),
+    ForeignKeyConstraint(
+        ['device_name', 'snapshot_id', 'vdom', 'dhcp_id'],
+        ['dhcp_servers.device_name', 'dhcp_servers.snapshot_id', 'dhcp_servers.vdom', 'dhcp_servers.id']
+    )
+)
+
+user_local = Table(
+    'user_local', metadata,
+    *_snapshot_key_columns(),
+    Column('username', String, primary_key=True),
+    Column('password', String),
+    Column('type', String),
+    Column('source_file', String),
+    Column('local_file', String),
+    Column('created_at', String)
+)
+
+system_global = Table(
+    'system_global', metadata,
+    *_snapshot_key_columns(),
+    Column('setting', String, primary_key=True),
+    Column('value', String),
+    Column('source_file', String),
+    Column('local_file', String),
+    Column('created_at', String)
+)
+
+config_changes = Table(
+    'config_changes', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('device_name', String),
+    Column('snapshot_id', Integer),
+    Column('action', String),
+    Column('object_type', String),
+    Column('object_name', String),
+    Column('new_name', String),
+    Column('attribute', String),
+    Column('old_value', String),
+    Column('source_file', String),
+    Column('local_file', String),
+    Column('timestamp', String),
+    Index('ix_config_changes_object', 'object_type', 'object_name'),
+    Index('ix_config_changes_new_name', 'object_type', 'new_name'),
+    Index('ix_config_changes_source_action_time', 'source_file', 'action', 'timestamp'),
+    Index('ix_config_changes_device_time', 'device_name', 'timestamp'),
+    Index('ix_config_changes_time', 'timestamp')
+)
+
+# Per-day event counts of config_changes, upserted as events are appended so
+# reports never scan the journal. NULL device/source are stored as "" to keep
+# the key unique.
+config_change_daily = Table(
+    'config_change_daily', metadata,
+    Column('day', String, primary_key=True),
+    Column('device_name', String, primary_key=True),
+    Column('source_file', String, primary_key=True),
+    Column('action', String, primary_key=True),
+    Column('count', Integer, nullable=False),
+    Index('ix_config_change_daily_device_day', 'device_name', 'day')
+)
+
+firewall_service_custom = Table(
+    'firewall_service_custom', metadata,
+    *_snapshot_key_columns(),
+    Column('name', String, primary_key=True),
+    Column('protocol', String),
+    Column('tcp_portrange', String),
+    Column('udp_portrange', String),
+    Column('icmp_type', String),
+    Column('icmp_code', String),
+    Column('comment', String),
+    Column('source_file', String),
+    Column('local_file', String),
+    Column('created_at', String)
+)
+
+router_static = Table(
+    'router_static', metadata,
+    *_snapshot_key_columns(),
+    Column('id', Integer, primary_key=True),
+    Column('dst', String),
+    Column('gateway', String),
+    Column('device', String),
+    Column('priority', String),
+    Column('distance', String),
+    Column('comment', String),
+    Column('source_file', String),
+    Column('local_file', String),
+    Column('created_at', String)
+)
+
+system_admin = Table(
+    'system_admin', metadata,
+    *_snapshot_key_columns(),
+    Column('username', String, primary_key=True),
+    Column('password', String),
+    Column('ssh_public_key1', String),
+    Column('accprofile', String),
+    Column('source_file', String),
+    Column('local_file', String),
+    Column('created_at', String)
+)
+
+firewall_schedule_recurring = Table(
+    'firewall_schedule_recurring', metadata,
+    *_snapshot_key_columns(),
+    Column('name', String, primary_key=True),
+    Column('start', String),
+    Column('end', String),
+    Column('day', String),
+    Column('source_file', String),
+    Column('local_file', String),
+    Column('created_at', String)
+)
+
+firewall_vip = Table(
+    'firewall_vip', metadata,
+    *_snapshot_key_columns(),
+    Column('name', String, primary_key=True),
+    Column('extip', String),
+    Column('mappedip', String),
+    Column('portforward', String),
+    Column('extport', String),
+    Column('mappedport', String),
+    Column('protocol', String),
+    Column('comment', String),
+    Column('source_file', String),
+    Column('local_file', String),
+    Column('created_at', String)
+)
+
+# Section digests of the file a device's snapshot was last loaded from
+ingest_cache = Table(
+    'ingest_cache', metadata,
+    Column('device_name', String, primary_key=True),
+    Column('source_file', String, primary_key=True),
+    Column('section', String, primary_key=True),
+    Column('snapshot_id', Integer, ForeignKey('snapshots.id')),
+    Column('digest', String),
+    Column('updated_at', String)
+)
+
+# Output of rule_analysis.RuleAnalyzer for a snapshot's policies
+policy_findings = Table(
+    'policy_findings', metadata,
+    *_snapshot_key_columns(),
+    Column('policy_id', Integer, primary_key=True),
+    Column('finding', String),
+    Column('related_policy_id', Integer),
+    Column('action', String),
+    Column('related_action', String),
+    Column('created_at', String),
+    Index('ix_policy_findings_finding', 'finding', 'device_name', 'snapshot_id')
+)
+
+# Output of config_diff.ConfigDiff: one row per added/removed/modified/moved object
+config_diffs = Table(
+    'config_diffs', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('device_name', String),
+    Column('old_source', String),
+    Column('new_source', String),
+    Column('op', String),
+    Column('section', String),
+    Column('object_name', String),
+    Column('detail', String),
+    Column('created_at', String),
+    Index('ix_config_diffs_device_created', 'device_name', 'created_at'),
+    Index('ix_config_diffs_object', 'section', 'object_name')
+)
+
+# Tables that hold parsed config rows (scoped by device and snapshot)
+CONFIG_TABLES = [
+    table for table in metadata.sorted_tables
+    if table not in (
+        snapshots, config_changes, config_change_daily, ingest_cache, policy_findings, config_diffs,
+        resolved_policies
+    )
+]
+
+
+@_migration(10)
+def _key_ingest_cache_by_device(handler, conn):
+    # The cache was keyed by file name alone; it only saves work, so it is
+    # dropped and refilled by the next --incremental load of each device
+    conn.exec_driver_sql("DROP TABLE IF EXISTS ingest_cache")
+    ingest_cache.create(conn)
+
+
+@_migration(11)
+def _add_snapshot_updated_at(handler, conn):
+    conn.exec_driver_sql("ALTER TABLE snapshots ADD COLUMN updated_at VARCHAR")
+    conn.exec_driver_sql("UPDATE snapshots SET updated_at = created_at")
+    next(index for index in snapshots.indexes if index.name == 'ix_snapshots_updated').create(conn)
+
+
+@_migration(12)
+def _index_renamed_objects(handler, conn):
+    next(index for index in config_changes.indexes if index.name == 'ix_config_changes_new_name').create(conn)
+
+
+class FortiGateDatabaseHandler:
+    metadata = metadata
+    snapshots = snapshots
+    system_interface = system_interface
+    firewall_address = firewall_address
+    firewall_address6 = firewall_address6
+    firewall_addrgrp = firewall_addrgrp
+    firewall_policies = firewall_policies
+    policy_srcintf = policy_srcintf
+    policy_dstintf = policy_dstintf
+    policy_srcaddr = policy_srcaddr
+    policy_dstaddr = policy_dstaddr
+    policy_service = policy_service
+    addrgrp_member = addrgrp_member
+    addrgrp_closure = addrgrp_closure
+    vpn_phase1 = vpn_phase1
+    vpn_phase2 = vpn_phase2
+    phase2_selectors = phase2_selectors
+    dhcp_servers = dhcp_servers
+    ip_ranges = ip_ranges
+    user_local = user_local
+    system_global = system_global
+    config_changes = config_changes
+    config_change_daily = config_change_daily
+    firewall_service_custom = firewall_service_custom
+    router_static = router_static
+    system_admin = system_admin
+    firewall_schedule_recurring = firewall_schedule_recurring
+    firewall_vip = firewall_vip
+    ingest_cache = ingest_cache
+    policy_findings = policy_findings
+    config_diffs = config_diffs
+    resolved_policies = resolved_policies
+    config_tables = CONFIG_TABLES
+
+    def __init__(self, db_url='sqlite:///fortigate_config.db', batch_size=5000, reset_schema=False):
+        self.engine = create_engine(db_url, echo=False)
+        self.batch_size = batch_size
+        self.device_name = None
+        self.snapshot_id = None
+        # VDOM of the rows being built; loads set it per section
+        self.vdom = DEFAULT_VDOM
+        # (device_name, snapshot_id, vdom) -> AddressGroupResolver
+        self.address_resolvers = _BoundedCache(ADDRESS_CACHE_SIZE)
+        # (device_name, snapshot_id, vdom or None for all) -> AddressIndex
+        self.address_indexes = _BoundedCache(ADDRESS_CACHE_SIZE)
+        self._ensure_schema(reset_schema)
+        self.Session = sessionmaker(bind=self.engine)
+
+    def _ensure_schema(self, reset_schema):
+        # The schema version is kept in SQLite's PRAGMA user_version, so a
+        # normal launch costs a single PRAGMA read. An empty database gets
+        # every table; an older one is upgraded through MIGRATIONS or refused,
+        # since create_all never alters a table that already exists.
+        with self.engine.begin() as conn:
+            is_sqlite = conn.dialect.name == "sqlite"
+            if reset_schema:
+                self.metadata.drop_all(conn) # FOR DEV STAGE
+            elif is_sqlite:
+                version = conn.exec_driver_sql("PRAGMA user_version").scalar()
+                if version == SCHEMA_VERSION:
+                    return
+                if version or inspect(conn).get_table_names():
+                    self._migrate(conn, version)
+                    return
+            self.metadata.create_all(conn)
+            # New derived tables start from whatever the database already holds
+            self._rebuild_change_rollup(conn)
+            self._rebuild_resolved_policies(conn)
+            if is_sqlite:
+                conn.exec_driver_sql(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _migrate(self, conn, version):
+        while version != SCHEMA_VERSION:
+            step = MIGRATIONS.get(version)
+            if step is None:
+                raise RuntimeError(
+                    f"{self.engine.url.database} has schema v{version}, expected v{SCHEMA_VERSION}, and cannot "
+                    f"be upgraded: re-create the database (delete the file, or "
+                    f"FortiGateDatabaseHandler(reset_schema=True) to drop every table)"
+                )
+            step(self, conn)
+            version += 1
+            conn.exec_driver_sql(f"PRAGMA user_version = {version}")
+            print(f"[INFO] Upgraded {self.engine.url.database} to schema v{version}")
+
+    def _in_snapshot(self, table):
+        return and_(table.c.device_name == self.device_name, table.c.snapshot_id == self.snapshot_id)
+
+    def _in_vdom(self, table):
+        return and_(self._in_snapshot(table), table.c.vdom == self.vdom)
+
+    def _forget_indexes(self):
+        # Cached address indexes no longer match a rewritten snapshot
+        for key in [key for key in self.address_indexes if key[:2] == (self.device_name, self.snapshot_id)]:
+            del self.address_indexes[key]
+
+    def begin_snapshot(self, device_name=None, source_file=None, local_file=None, conn=None):
+        # Creates a new snapshot and makes it the target of subsequent saves
+        device_name = device_name or source_file or DEFAULT_DEVICE
+        created_at = datetime.datetime.utcnow().isoformat()
+        stmt = self.snapshots.insert().values(
+            device_name=device_name,
+            source_file=source_file,
+            local_file=local_file,
+            created_at=created_at,
+            updated_at=created_at
         )
+        if conn is None:
+            with self.engine.begin() as conn:
+                result = conn.execute(stmt)
+                self._forget_ingest_digests(conn, device_name)
+        else:
+            result = conn.execute(stmt)
+            self._forget_ingest_digests(conn, device_name)
+        self.device_name = device_name
+        self.snapshot_id = result.inserted_primary_key[0]
+        return self.snapshot_id
+
+    def _forget_ingest_digests(self, conn, device_name):
+        # Any write to a device makes its cached digests stale; the loads
+        # that keep them (main.py --incremental) store them again afterwards
+        conn.execute(self.ingest_cache.delete().where(self.ingest_cache.c.device_name == device_name))
 
-        self.firewall_vip = Table(
-            'firewall_vip', self.metadata,
-            Column('name', String, primary_key=True),
-            Column('extip', String),
-            Column('mappedip', String),
-            Column('portforward', String),
-            Column('extport', String),
-            Column('mappedport', String),
-            Column('protocol', String),
-            Column('comment', String),
-            Column('source_file', String),
-            Column('local_file', String),
-            Column('created_at', String)
+    def _snapshot_rewritten(self, conn):
+        # The current snapshot was changed in place
+        self._forget_ingest_digests(conn, self.device_name)
+        conn.execute(
+            self.snapshots.update().where(self.snapshots.c.id == self.snapshot_id)
+            .values(updated_at=datetime.datetime.utcnow().isoformat())
         )
 
-        self.metadata.drop_all(self.engine) # FOR DEV STAGE
-        self.metadata.create_all(self.engine)
-        self.Session = sessionmaker(bind=self.engine)
+    def latest_snapshot_id(self, device_name):
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select(func.max(self.snapshots.c.id)).where(self.snapshots.c.device_name == device_name)
+            ).scalar()
 
-    def save_config_changes(self, change_log):
-        session = self.Session()
+    def use_snapshot(self, device_name, snapshot_id=None):
+        # Points subsequent saves at an existing snapshot, the device's latest by default
+        self.device_name = device_name
+        self.snapshot_id = snapshot_id or self.latest_snapshot_id(device_name)
+        return self.snapshot_id
+
+    def _copy_columns(self, table, source=None):
+        # table's columns read from `source` (table itself or its copy in a
+        # staging database) with the device and snapshot replaced by the
+        # current ones
+        source = table if source is None else source
+        return [
+            literal(self.device_name).label(c.name) if c.name == 'device_name'
+            else literal(self.snapshot_id).label(c.name) if c.name == 'snapshot_id'
+            else source.c[c.name]
+            for c in table.columns
+        ]
+
+    def clone_snapshot(self, from_snapshot_id, conn=None):
+        # Copies every config row of another snapshot into the current one,
+        # along with its resolved policies
+        if conn is None:
+            with self.engine.begin() as conn:
+                return self.clone_snapshot(from_snapshot_id, conn)
+        for table in self.config_tables + [self.resolved_policies]:
+            conn.execute(table.insert().from_select(
+                [c.name for c in table.columns],
+                select(*self._copy_columns(table)).where(table.c.snapshot_id == from_snapshot_id)
+            ))
+
+    def merge_stages(self, stages, source_file=None, local_file=None, device_name=None):
+        # Builds one new snapshot from staging databases, each holding a
+        # single snapshot written by bulk_load(resolve=False), e.g. one VDOM
+        # loaded by a worker process (vdom_ingest). SQLite only detaches a
+        # database once the transaction that read it has ended, and attaches
+        # about ten at a time, so stages are first gathered into the first
+        # one as they arrive (a commit per stage, while the others are still
+        # being written); that one is then copied into a new snapshot with
+        # INSERT ... SELECT in a single transaction, and resolved policies
+        # are materialized once.
+        stages = iter(stages)
+        target = next(stages, None)
+        if target is None:
+            raise ValueError("No staging databases to merge")
+        gathered = create_engine(f"sqlite:///{target}")
         try:
-            for change in change_log:
-                session.execute(self.config_changes.insert().values(
-                    action=change.get("action"),
-                    object_type=change.get("object_type"),
-                    object_name=change.get("object_name"),
-                    new_name=change.get("new_name"),
-                    source_file=change.get("source_file"),
-                    local_file=change.get("local_file"),
-                    timestamp=change.get("timestamp")
-                ))
-            session.commit()
-        except Exception:
-            session.rollback()
-            raise
+            with gathered.connect() as conn:
+                for path in stages:
+                    self._copy_stage(conn, path)
+                    conn.commit()
+                    conn.exec_driver_sql("DETACH DATABASE stage")
         finally:
-            session.close()
+            gathered.dispose()
 
-    def save_system_global(self, config_dict):
+        with self.engine.connect() as conn:
+            try:
+                with conn.begin():
+                    self.begin_snapshot(device_name, source_file, local_file, conn=conn)
+                    counts = self._copy_stage(conn, target, snapshot=True)
+                    self._refresh_resolved_policies(conn)
+            except Exception:
+                self.device_name = self.snapshot_id = None
+                raise
+            finally:
+                conn.exec_driver_sql("DETACH DATABASE stage")
+        return counts
+
+    def _copy_stage(self, conn, path, snapshot=False):
+        # Attaches path as "stage" and copies its config tables into conn's
+        # database, into the current snapshot if snapshot is set
+        conn.exec_driver_sql("ATTACH DATABASE ? AS stage", (path,))
+        counts = {}
+        for table in self.config_tables:
+            staged = _staged_table(table)
+            columns = self._copy_columns(table, staged) if snapshot else [staged.c[c.name] for c in table.columns]
+            result = conn.execute(table.insert().from_select([c.name for c in table.columns], select(*columns)))
+            if result.rowcount:
+                counts[table.name] = result.rowcount
+        return counts
+
+    def _row_context(self, source_file, local_file):
+        if self.snapshot_id is None:
+            self.begin_snapshot(None, source_file, local_file)
+        return {
+            "device_name": self.device_name,
+            "snapshot_id": self.snapshot_id,
+            "vdom": self.vdom,
+            "source_file": source_file,
+            "local_file": local_file,
+            "created_at": datetime.datetime.utcnow().isoformat()
+        }
+
+    def _replace_rows(self, table_rows, scope=None, conn=None):
+        # Replaces the current VDOM's rows of each table, or the rows matching
+        # scope(table) within the snapshot. With conn, the rows are written in
+        # the caller's transaction; otherwise in a session of their own.
+        self._forget_indexes()
+        if conn is not None:
+            self._write_replaced_rows(conn, table_rows, scope)
+            return
         session = self.Session()
         try:
-            session.execute(self.system_global.delete())
-            data = config_dict.get("system global", {})
-            for key, value in data.items():
-                session.execute(self.system_global.insert().values(
-                    setting=key,
-                    value=str(value)
-                ))
+            self._write_replaced_rows(session, table_rows, scope)
             session.commit()
         except Exception:
             session.rollback()
@@ -255,331 +849,1046 @@ class FortiGateDatabaseHandler:
         finally:
             session.close()
 
-    def save_system_interface(self, config_dict):
-        session = self.Session()
+    def _write_replaced_rows(self, conn, table_rows, scope):
+        touched = self._new_touched()
+        for table, rows in table_rows.items():
+            where = self._in_vdom(table) if scope is None else and_(self._in_snapshot(table), scope(table))
+            if scope is None and table in RESOLVED_SOURCES:
+                self._touch_changed_rows(conn, table, rows, touched)
+            conn.execute(table.delete().where(where))
+            if rows:
+                conn.execute(table.insert(), rows)
+        # Whole VDOMs replaced: all of the snapshot's resolved rows
+        self._refresh_resolved_policies(conn, touched if scope is None else None)
+        self._snapshot_rewritten(conn)
+
+    def build_rows(self, section, data, source_file=None, local_file=None):
+        builder = SECTION_ROW_BUILDERS.get(section)
+        if builder is None:
+            return None
+        return getattr(self, builder)({section: data}, source_file, local_file)
+
+    def save_section(self, section, data, source_file=None, local_file=None, conn=None):
+        # Replaces one top-level section of the current snapshot. "global" and
+        # "vdom" of a multi-VDOM config replace every section of the units
+        # they hold (the global part, or all VDOMs), so removed sections and
+        # VDOMs disappear too.
+        if section in VDOM_SECTIONS:
+            return self._save_vdom_section(section, data, source_file, local_file, conn)
+        table_rows = self.build_rows(section, data, source_file, local_file)
+        if table_rows is None:
+            return False
+        self._replace_rows(table_rows, conn=conn)
+        return True
+
+    def _save_vdom_section(self, section, data, source_file, local_file, conn=None):
+        table_rows = {table: [] for table in self.config_tables}
+        for vdom, name, value in iter_vdom_sections([(section, data)]):
+            self.vdom = vdom
+            for table, rows in (self.build_rows(name, value, source_file, local_file) or {}).items():
+                table_rows[table].extend(rows)
+        self.vdom = DEFAULT_VDOM
+        if section == "global":
+            self._replace_rows(table_rows, lambda table: table.c.vdom == GLOBAL_VDOM, conn)
+        else:
+            self._replace_rows(table_rows, lambda table: table.c.vdom != GLOBAL_VDOM, conn)
+        return True
+
+    def bulk_load(self, parsed_config, source_file=None, local_file=None, batch_size=None, device_name=None,
+                  vdom=DEFAULT_VDOM, resolve=True):
+        # Loads a whole config as a new snapshot of the device in a single
+        # transaction. parsed_config may be a full parsed dict or an iterable of
+        # (section, data) pairs such as FortiGateConfigParser.iter_sections(), so
+        # rows are built as blocks arrive and flushed with executemany every
+        # batch_size rows. Sections of a multi-VDOM config are unwrapped into
+        # their VDOMs; any other section is stored under `vdom`. resolve=False
+        # leaves resolved_policies empty (staging databases, see merge_stages).
+        batch_size = batch_size or self.batch_size
+        if isinstance(parsed_config, dict):
+            parsed_config = parsed_config.items()
+
         try:
-            session.execute(self.system_interface.delete())
-            data = config_dict.get("system interface", {})
-            for name, values in data.items():
-                session.execute(self.system_interface.insert().values(
-                    name=name,
-                    ip=values.get("ip"),
-                    allowaccess=" | ".join(values.get("allowaccess", [])),
-                    alias=values.get("alias"),
-                ))
-            session.commit()
+            with self.engine.begin() as conn:
+                self.begin_snapshot(device_name, source_file, local_file, conn=conn)
+                counts = self._insert_batches(conn, iter_vdom_sections(parsed_config, vdom),
+                                              source_file, local_file, batch_size)
+                if resolve:
+                    self._refresh_resolved_policies(conn)
+                return counts
         except Exception:
-            session.rollback()
+            self.device_name = self.snapshot_id = None
             raise
         finally:
-            session.close()
+            self.vdom = DEFAULT_VDOM
 
-    def save_firewall_address(self, config_dict):
-        session = self.Session()
-        try:
-            session.execute(self.firewall_address.delete())
-            data = config_dict.get("firewall address", {})
-            for name, values in data.items():
-                session.execute(self.firewall_address.insert().values(
-                    name=name,
-                    subnet=values.get("subnet"),
-                    fqdn=values.get("fqdn"),
+    def _insert_batches(self, conn, vdom_sections, source_file, local_file, batch_size):
+        counts = defaultdict(int)
+        pending = defaultdict(list)
+        for vdom, section, data in vdom_sections:
+            self.vdom = vdom
+            table_rows = self.build_rows(section, data, source_file, local_file)
+            if not table_rows:
+                continue
+            for table, rows in table_rows.items():
+                batch = pending[table]
+                batch.extend(rows)
+                if len(batch) >= batch_size:
+                    conn.execute(table.insert(), batch)
+                    counts[table.name] += len(batch)
+                    pending[table] = []
+
+        for table, batch in pending.items():
+            if batch:
+                conn.execute(table.insert(), batch)
+                counts[table.name] += len(batch)
+        return dict(counts)
+
+    def _row_hash(self, row, columns):
+        return hashlib.sha1(repr(tuple(row[c] for c in columns)).encode()).hexdigest()
+
+    def _existing_hashes(self, conn, table, where=None):
+        key_columns = [c.name for c in table.primary_key.columns]
+        hashed_columns = [c.name for c in table.columns if c.name not in UNHASHED_COLUMNS]
+        existing = {}
+        where = self._in_snapshot(table) if where is None else where
+        query = select(*[table.c[c] for c in hashed_columns]).where(where)
+        for row in conn.execute(query).mappings():
+            existing[tuple(row[c] for c in key_columns)] = self._row_hash(row, hashed_columns)
+        return existing
+
+    def _upsert_statement(self, table):
+        stmt = insert(table)
+        key_columns = [c.name for c in table.primary_key.columns]
+        if len(key_columns) == len(table.columns):
+            return stmt.on_conflict_do_nothing(index_elements=key_columns)
+        return stmt.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={c.name: stmt.excluded[c.name] for c in table.columns if c.name not in key_columns}
+        )
+
+    def _delete_statement(self, table):
+        return table.delete().where(and_(*[
+            c == bindparam(f"key_{c.name}") for c in table.primary_key.columns
+        ]))
+
+    def sync(self, parsed_config, source_file=None, local_file=None, batch_size=None, device_name=None,
+             vdom=DEFAULT_VDOM):
+        # Differential alternative to bulk_load(): updates the device's latest
+        # snapshot in place. Incoming rows are compared with the stored ones by
+        # primary key (VDOM included) and a hash of their content columns, and
+        # only inserts, updates and deletes are written.
+        batch_size = batch_size or self.batch_size
+        if isinstance(parsed_config, dict):
+            parsed_config = parsed_config.items()
+        device_name = device_name or source_file or DEFAULT_DEVICE
+        if not self.use_snapshot(device_name):
+            self.begin_snapshot(device_name, source_file, local_file)
+        self._forget_indexes()
+
+        counts = {table.name: {"inserted": 0, "updated": 0, "deleted": 0} for table in self.config_tables}
+        pending = defaultdict(list)
+        touched = self._new_touched()
+        with self.engine.begin() as conn:
+            existing = {table: self._existing_hashes(conn, table) for table in self.config_tables}
+
+            for section_vdom, section, data in iter_vdom_sections(parsed_config, vdom):
+                self.vdom = section_vdom
+                table_rows = self.build_rows(section, data, source_file, local_file)
+                if not table_rows:
+                    continue
+                for table, rows in table_rows.items():
+                    key_columns = [c.name for c in table.primary_key.columns]
+                    hashed_columns = [c.name for c in table.columns if c.name not in UNHASHED_COLUMNS]
+                    stored = existing[table]
+                    for row in rows:
+                        key = tuple(row[c] for c in key_columns)
+                        stored_hash = stored.pop(key, None)
+                        if stored_hash is None:
+                            counts[table.name]["inserted"] += 1
+                        elif stored_hash != self._row_hash(row, hashed_columns):
+                            counts[table.name]["updated"] += 1
+                        else:
+                            continue
+                        if table in RESOLVED_SOURCES:
+                            self._touch(touched, table, row)
+                        batch = pending[table]
+                        batch.append(row)
+                        if len(batch) >= batch_size:
+                            conn.execute(self._upsert_statement(table), batch)
+                            pending[table] = []
+
+            for table, batch in pending.items():
+                if batch:
+                    conn.execute(self._upsert_statement(table), batch)
+
+            # Whatever is still in `existing` was not in the incoming config
+            for table in reversed(self.config_tables):
+                stale = existing[table]
+                if not stale:
+                    continue
+                key_columns = [c.name for c in table.primary_key.columns]
+                keys = [
+                    {f"key_{c}": value for c, value in zip(key_columns, key)}
+                    for key in stale
+                ]
+                for start in range(0, len(keys), batch_size):
+                    conn.execute(self._delete_statement(table), keys[start:start + batch_size])
+                counts[table.name]["deleted"] += len(keys)
+                if table in RESOLVED_SOURCES:
+                    for key in stale:
+                        self._touch(touched, table, dict(zip(key_columns, key)))
+            self._refresh_resolved_policies(conn, touched)
+            if any(any(changes.values()) for changes in counts.values()):
+                self._snapshot_rewritten(conn)
+        self.vdom = DEFAULT_VDOM
+        return counts
+
+    def _new_touched(self):
+        return {"policy": set(), "interface": set(), "address": set()}
+
+    def _touch(self, touched, table, row):
+        kind, column = RESOLVED_SOURCES[table]
+        touched[kind].add(row[column] if kind == "interface" else (row["vdom"], row[column]))
+
+    def _touch_changed_rows(self, conn, table, rows, touched):
+        # Keys whose row is new, different or gone compared with the stored VDOM
+        key_columns = [c.name for c in table.primary_key.columns]
+        hashed_columns = [c.name for c in table.columns if c.name not in UNHASHED_COLUMNS]
+        stored = self._existing_hashes(conn, table, self._in_vdom(table))
+        for row in rows:
+            key = tuple(row[c] for c in key_columns)
+            if stored.pop(key, None) != self._row_hash(row, hashed_columns):
+                self._touch(touched, table, row)
+        for key in stored:
+            self._touch(touched, table, dict(zip(key_columns, key)))
+
+    def _resolved_policy_query(self, policy_ids=None, all_snapshots=False, vdom=None):
+        # The policy -> interface -> address join producing resolved_policies
+        # rows, for the current snapshot unless all_snapshots is set. Links and
+        # addresses belong to the policy's VDOM; interfaces are per device (in
+        # "config global" of a multi-VDOM config), so they match by name.
+        p = self.firewall_policies
+        links = {field: POLICY_LINK_TABLES[field].alias(f"l_{field}")
+                 for field in ("srcintf", "dstintf", "srcaddr", "dstaddr")}
+        si_src = self.system_interface.alias("si_src")
+        si_dst = self.system_interface.alias("si_dst")
+        fa_src = self.firewall_address.alias("fa_src")
+        fa_dst = self.firewall_address.alias("fa_dst")
+
+        def same_snapshot(table):
+            return and_(table.c.device_name == p.c.device_name, table.c.snapshot_id == p.c.snapshot_id)
+
+        def same_vdom(table):
+            return and_(same_snapshot(table), table.c.vdom == p.c.vdom)
+
+        joined = p
+        for link in links.values():
+            joined = joined.outerjoin(link, and_(same_vdom(link), link.c.policy_id == p.c.id))
+        for table, field in ((si_src, "srcintf"), (si_dst, "dstintf")):
+            joined = joined.outerjoin(table, and_(same_snapshot(table), table.c.name == links[field].c.name))
+        for table, field in ((fa_src, "srcaddr"), (fa_dst, "dstaddr")):
+            joined = joined.outerjoin(table, and_(same_vdom(table), table.c.name == links[field].c.name))
+
+        query = select(
+            p.c.device_name,
+            p.c.snapshot_id,
+            p.c.vdom,
+            p.c.id.label('policy_id'),
+            p.c.name.label('policy_name'),
+            links["srcintf"].c.name.label('srcintf'),
+            si_src.c.alias.label('srcintf_alias'),
+            si_src.c.ip.label('srcintf_ip'),
+            links["dstintf"].c.name.label('dstintf'),
+            si_dst.c.alias.label('dstintf_alias'),
+            si_dst.c.ip.label('dstintf_ip'),
+            links["srcaddr"].c.name.label('srcaddr'),
+            fa_src.c.subnet.label('src_subnet'),
+            links["dstaddr"].c.name.label('dstaddr'),
+            fa_dst.c.subnet.label('dst_subnet'),
+            p.c.service,
+            p.c.action,
+            p.c.schedule,
+            p.c.logtraffic,
+            p.c.source_file,
+            p.c.created_at
+        ).select_from(joined)
+        if not all_snapshots:
+            query = query.where(self._in_snapshot(p))
+        if vdom is not None:
+            query = query.where(p.c.vdom == vdom)
+        if policy_ids is not None:
+            query = query.where(p.c.id.in_(policy_ids))
+        return query
+
+    def _rebuild_resolved_policies(self, conn):
+        resolved = self.resolved_policies
+        conn.execute(resolved.delete())
+        conn.execute(resolved.insert().from_select(
+            [c.name for c in resolved.columns], self._resolved_policy_query(all_snapshots=True)
+        ))
+
+    def _refresh_resolved_policies(self, conn, touched=None):
+        # Re-materializes the current snapshot's resolved rows for the touched
+        # policies and for the policies referencing a touched interface or
+        # address (found through the link table indexes); touched=None
+        # rebuilds the whole snapshot. Returns the number of policies refreshed.
+        resolved = self.resolved_policies
+        columns = [c.name for c in resolved.columns]
+        if touched is None:
+            conn.execute(resolved.delete().where(self._in_snapshot(resolved)))
+            conn.execute(resolved.insert().from_select(columns, self._resolved_policy_query()))
+            return None
+
+        # (vdom, policy_id) pairs
+        policy_keys = set(touched["policy"])
+        for field, kind in (("srcintf", "interface"), ("dstintf", "interface"),
+                            ("srcaddr", "address"), ("dstaddr", "address")):
+            link = POLICY_LINK_TABLES[field]
+            if kind == "interface":
+                names = sorted(touched[kind])
+            else:
+                names = sorted({name for _, name in touched[kind]})
+            for start in range(0, len(names), IN_CLAUSE_SIZE):
+                result = conn.execute(
+                    select(link.c.vdom, link.c.policy_id, link.c.name)
+                    .where(link.c.name.in_(names[start:start + IN_CLAUSE_SIZE]))
+                    .where(self._in_snapshot(link))
+                )
+                for vdom, policy_id, name in result:
+                    # An address only affects policies of its own VDOM
+                    if kind == "interface" or (vdom, name) in touched[kind]:
+                        policy_keys.add((vdom, policy_id))
+
+        by_vdom = defaultdict(list)
+        for vdom, policy_id in policy_keys:
+            by_vdom[vdom].append(policy_id)
+        for vdom, policy_ids in sorted(by_vdom.items()):
+            policy_ids.sort()
+            for start in range(0, len(policy_ids), IN_CLAUSE_SIZE):
+                chunk = policy_ids[start:start + IN_CLAUSE_SIZE]
+                conn.execute(
+                    resolved.delete().where(self._in_snapshot(resolved))
+                    .where(resolved.c.vdom == vdom).where(resolved.c.policy_id.in_(chunk))
+                )
+                conn.execute(resolved.insert().from_select(columns, self._resolved_policy_query(chunk, vdom=vdom)))
+        return len(policy_keys)
+
+    def _in_ingest_cache(self, device_name, source_file):
+        cache = self.ingest_cache
+        return and_(cache.c.device_name == device_name, cache.c.source_file == source_file)
+
+    def get_ingest_digests(self, device_name, source_file):
+        # Returns (snapshot_id, {section: digest}) for the snapshot of
+        # device_name last loaded from source_file, or (None, {}); the
+        # whole-file digest is stored under FILE_DIGEST_KEY
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(self.ingest_cache.c.section, self.ingest_cache.c.digest, self.ingest_cache.c.snapshot_id)
+                .where(self._in_ingest_cache(device_name, source_file))
+            ).all()
+        if not rows:
+            return None, {}
+        return rows[0].snapshot_id, {row.section: row.digest for row in rows}
+
+    def store_ingest_digests(self, source_file, digests, conn=None):
+        # Records the digests of the file the current snapshot was loaded from
+        if conn is None:
+            with self.engine.begin() as conn:
+                return self.store_ingest_digests(source_file, digests, conn)
+        updated_at = datetime.datetime.utcnow().isoformat()
+        conn.execute(self.ingest_cache.delete().where(self._in_ingest_cache(self.device_name, source_file)))
+        if digests:
+            conn.execute(self.ingest_cache.insert(), [
+                dict(device_name=self.device_name, source_file=source_file, section=section,
+                     snapshot_id=self.snapshot_id, digest=digest, updated_at=updated_at)
+                for section, digest in digests.items()
+            ])
+
+    def save_policy_findings(self, findings):
+        # Replaces the findings of the current snapshot's VDOM
+        created_at = datetime.datetime.utcnow().isoformat()
+        with self.engine.begin() as conn:
+            conn.execute(self.policy_findings.delete().where(self._in_vdom(self.policy_findings)))
+            if findings:
+                conn.execute(self.policy_findings.insert(), [
+                    dict(device_name=self.device_name, snapshot_id=self.snapshot_id, vdom=self.vdom,
+                         created_at=created_at, **finding)
+                    for finding in findings
+                ])
+
+    def save_config_diff(self, records, device_name, old_source=None, new_source=None, batch_size=None):
+        # Stores config_diff records in batches while yielding them back, so a
+        # diff can be written to the database and streamed out in one pass
+        batch_size = batch_size or self.batch_size
+        created_at = datetime.datetime.utcnow().isoformat()
+        batch = []
+        with self.engine.begin() as conn:
+            for record in records:
+                detail = {key: value for key, value in record.items() if key not in ("op", "section", "object")}
+                batch.append(dict(
+                    device_name=device_name,
+                    old_source=old_source,
+                    new_source=new_source,
+                    op=record["op"],
+                    section=record["section"],
+                    object_name=record["object"],
+                    detail=json.dumps(detail),
+                    created_at=created_at
                 ))
-            session.commit()
-        except Exception:
-            session.rollback()
-            raise
-        finally:
-            session.close()
+                if len(batch) >= batch_size:
+                    conn.execute(self.config_diffs.insert(), batch)
+                    batch = []
+                yield record
+            if batch:
+                conn.execute(self.config_diffs.insert(), batch)
 
-    def save_firewall_addrgrp(self, config_dict):
-        session = self.Session()
-        try:
-            session.execute(self.firewall_addrgrp.delete())
-            data = config_dict.get("firewall addrgrp", {})
-            for name, values in data.items():
-                session.execute(self.firewall_addrgrp.insert().values(
-                    name=name,
-                    member=" | ".join(values.get("member", [])),
+    def save_config_changes(self, change_log, source_file=None, local_file=None, timestamp=None, batch_size=None):
+        # Appends the parser's ChangeEvents to the journal with executemany
+        # batches in one transaction; timestamp is the parse run's
+        batch_size = batch_size or self.batch_size
+        timestamp = timestamp or datetime.datetime.utcnow().isoformat()
+        rollup = defaultdict(int)
+        with self.engine.begin() as conn:
+            batch = []
+            for event in change_log:
+                rollup[(timestamp[:10], self.device_name or "", source_file or "", event.action)] += 1
+                batch.append(dict(
+                    device_name=self.device_name,
+                    snapshot_id=self.snapshot_id,
+                    source_file=source_file,
+                    local_file=local_file,
+                    timestamp=timestamp,
+                    **event._asdict()
                 ))
-            session.commit()
-        except Exception:
-            session.rollback()
-            raise
-        finally:
-            session.close()
+                if len(batch) >= batch_size:
+                    conn.execute(self.config_changes.insert(), batch)
+                    batch = []
+            if batch:
+                conn.execute(self.config_changes.insert(), batch)
+            if rollup:
+                self._update_change_rollup(conn, rollup)
 
-    def save_user_local(self, config_dict):
-        session = self.Session()
-        try:
-            session.execute(self.user_local.delete())
-            data = config_dict.get("user local", {})
-            for username, values in data.items():
-                session.execute(self.user_local.insert().values(
-                    username=username,
-                    password=values.get("password"),
-                    type=values.get("type"),
+    def _rebuild_change_rollup(self, conn):
+        c = self.config_changes
+        keys = [
+            func.coalesce(func.substr(c.c.timestamp, 1, 10), ''),
+            func.coalesce(c.c.device_name, ''),
+            func.coalesce(c.c.source_file, ''),
+            func.coalesce(c.c.action, '')
+        ]
+        conn.execute(self.config_change_daily.delete())
+        conn.execute(self.config_change_daily.insert().from_select(
+            ['day', 'device_name', 'source_file', 'action', 'count'],
+            select(*keys, func.count()).group_by(*keys)
+        ))
+
+    def _update_change_rollup(self, conn, counts):
+        # counts: {(day, device_name, source_file, action): n} for the events just appended
+        stmt = insert(self.config_change_daily)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['day', 'device_name', 'source_file', 'action'],
+            set_={'count': self.config_change_daily.c.count + stmt.excluded['count']}
+        )
+        conn.execute(stmt, [
+            dict(day=day, device_name=device, source_file=source, action=action, count=n)
+            for (day, device, source, action), n in counts.items()
+        ])
+
+    def change_summary(self, since=None, until=None, device_name=None, source_file=None,
+                       group_by=("source_file", "action")):
+        # Event counts grouped by any of day/device_name/source_file/action,
+        # aggregated in SQL. since is inclusive and until exclusive, as ISO
+        # strings or date/datetime objects. Whole days come from the daily
+        # rollup; only the partial days at the edges of a finer window are
+        # counted from the indexed journal.
+        since = since.isoformat() if hasattr(since, "isoformat") else since
+        until = until.isoformat() if hasattr(until, "isoformat") else until
+        full_start = since if since is None or len(since) == 10 else _next_day(since[:10])
+        full_end = until if until is None or len(until) == 10 else until[:10]
+        if full_start is not None and full_end is not None and full_start >= full_end:
+            parts = [(False, since, until)]
+        else:
+            parts = [(True, full_start, full_end)]
+            if full_start != since:
+                parts.append((False, since, full_start))
+            if full_end != until:
+                parts.append((False, full_end, until))
+
+        totals = defaultdict(int)
+        with self.engine.connect() as conn:
+            for from_rollup, start, end in parts:
+                query = self._summary_query(from_rollup, start, end, device_name, source_file, group_by)
+                for row in conn.execute(query):
+                    totals[tuple(row[:-1])] += row[-1]
+        return [dict(zip(group_by, key), count=count) for key, count in sorted(totals.items())]
+
+    def _summary_query(self, from_rollup, since, until, device_name, source_file, group_by):
+        if from_rollup:
+            table = self.config_change_daily
+            columns = {name: table.c[name] for name in ("day", "device_name", "source_file", "action")}
+            time_column = table.c.day
+            total = func.sum(table.c.count)
+        else:
+            table = self.config_changes
+            columns = {
+                "day": func.substr(table.c.timestamp, 1, 10),
+                "device_name": func.coalesce(table.c.device_name, ''),
+                "source_file": func.coalesce(table.c.source_file, ''),
+                "action": table.c.action
+            }
+            time_column = table.c.timestamp
+            total = func.count()
+
+        selected = [columns[name] for name in group_by]
+        query = select(*selected, total)
+        if since is not None:
+            query = query.where(time_column >= since)
+        if until is not None:
+            query = query.where(time_column < until)
+        # Filters go on the plain columns so the journal indexes apply
+        if device_name is not None:
+            query = query.where(table.c.device_name == device_name)
+        if source_file is not None:
+            query = query.where(table.c.source_file == source_file)
+        if group_by:
+            query = query.group_by(*selected)
+        return query
+
+    def object_history(self, object_type, object_name, device_name=None):
+        # Replays the journal for one object: every event on it in order,
+        # following renames in both directions so events recorded under an
+        # earlier or later name are included. Each step is an index lookup on
+        # (object_type, object_name) or (object_type, new_name).
+        c = self.config_changes
+
+        def scoped(query):
+            query = query.where(c.c.object_type == object_type)
+            if device_name is not None:
+                query = query.where(c.c.device_name == device_name)
+            return query
+
+        names = {object_name}
+        with self.engine.connect() as conn:
+            new_names = names
+            while new_names:
+                batch = list(new_names)
+                renames = conn.execute(scoped(select(c.c.object_name, c.c.new_name)).where(
+                    c.c.action == "rename",
+                    c.c.object_name.in_(batch) | c.c.new_name.in_(batch)
                 ))
-            session.commit()
-        except Exception:
-            session.rollback()
-            raise
-        finally:
-            session.close()
+                new_names = {name for row in renames for name in row if name is not None} - names
+                names |= new_names
+            query = scoped(select(c)).where(c.c.object_name.in_(list(names))).order_by(c.c.timestamp, c.c.id)
+            return [dict(row) for row in conn.execute(query).mappings()]
 
-    def save_firewall_policies(self, config_dict):
-        session = self.Session()
-        try:
-            session.execute(self.firewall_policies.delete())
-            data = config_dict.get("firewall policy", {})
-            for policy_id, values in data.items():
-                session.execute(self.firewall_policies.insert().values(
-                    id=int(policy_id),
-                    name=values.get("name"),
-                    srcintf=values.get("srcintf"),
-                    dstintf=values.get("dstintf"),
-                    srcaddr=values.get("srcaddr"),
-                    dstaddr=values.get("dstaddr"),
-                    service=" | ".join(values.get("service", [])),
-                    action=values.get("action"),
-                    schedule=values.get("schedule"),
-                    logtraffic=values.get("logtraffic"),
+    def _system_global_rows(self, config_dict, source_file=None, local_file=None):
+        row_context = self._row_context(source_file, local_file)
+        data = config_dict.get("system global", {})
+        return {self.system_global: [
+            dict(setting=key, value=str(value), **row_context)
+            for key, value in data.items()
+        ]}
+
+    def _system_interface_rows(self, config_dict, source_file=None, local_file=None):
+        row_context = self._row_context(source_file, local_file)
+        data = config_dict.get("system interface", {})
+        rows = []
+        for name, values in data.items():
+            ipv6 = values.get("ipv6")
+            ip6 = ipv6.get("ip6-address") if isinstance(ipv6, dict) else None
+            rows.append(dict(
+                name=name,
+                ip=values.get("ip"),
+                allowaccess=" | ".join(values.get("allowaccess", [])),
+                alias=values.get("alias"),
+                ip6=ip6,
+                **_interface_range_columns(values.get("ip")),
+                **_interface_range_columns(ip6, "ip6_"),
+                **row_context
+            ))
+        return {self.system_interface: rows}
+
+    def _firewall_address_rows(self, config_dict, source_file=None, local_file=None):
+        row_context = self._row_context(source_file, local_file)
+        data = config_dict.get("firewall address", {})
+        rows = []
+        for name, values in data.items():
+            # subnet objects carry "subnet", iprange objects "start-ip"/"end-ip"
+            bounds = ip_range_columns(values.get("subnet"))
+            if bounds["ip_version"] is None:
+                bounds = ip_range_columns(values.get("start-ip"), values.get("end-ip"))
+            rows.append(dict(
+                name=name,
+                subnet=values.get("subnet"),
+                fqdn=values.get("fqdn"),
+                start_ip=values.get("start-ip"),
+                end_ip=values.get("end-ip"),
+                **bounds,
+                **row_context
+            ))
+        return {self.firewall_address: rows}
+
+    def _firewall_address6_rows(self, config_dict, source_file=None, local_file=None):
+        row_context = self._row_context(source_file, local_file)
+        data = config_dict.get("firewall address6", {})
+        return {self.firewall_address6: [
+            dict(
+                name=name,
+                ip6=values.get("ip6"),
+                fqdn=values.get("fqdn"),
+                **ip_range_columns(values.get("ip6")),
+                **row_context
+            )
+            for name, values in data.items()
+        ]}
+
+    def _firewall_addrgrp_rows(self, config_dict, source_file=None, local_file=None):
+        row_context = self._row_context(source_file, local_file)
+        data = config_dict.get("firewall addrgrp", {})
+        group_rows = []
+        member_rows = []
+        groups = {}
+        for name, values in data.items():
+            members = groups[name] = _as_list(values.get("member"))
+            group_rows.append(dict(
+                name=name,
+                member=" | ".join(members),
+                **row_context
+            ))
+            member_rows.extend(self._link_rows(row_context, "group_name", name, members))
+
+        resolver = self._resolver_for_groups(groups)
+        for cycle in resolver.cycles:
+            print(f"[WARN] Address group cycle in {self.device_name}: {' -> '.join(cycle + cycle[:1])}")
+        closure_rows = [
+            dict(
+                device_name=row_context["device_name"],
+                snapshot_id=row_context["snapshot_id"],
+                vdom=row_context["vdom"],
+                group_name=group,
+                member_name=member
+            )
+            for group, member in resolver.closure_rows()
+        ]
+        return {
+            self.firewall_addrgrp: group_rows,
+            self.addrgrp_member: member_rows,
+            self.addrgrp_closure: closure_rows
+        }
+
+    def _resolver_for_groups(self, groups):
+        # Reloading groups into the same snapshot (sync, save_section) only
+        # recomputes the groups whose membership changed and their parents.
+        key = (self.device_name, self.snapshot_id, self.vdom)
+        resolver = self.address_resolvers.get(key)
+        if resolver is None:
+            resolver = self.address_resolvers[key] = AddressGroupResolver(groups)
+        else:
+            resolver.set_groups(groups)
+        return resolver
+
+    def get_address_resolver(self, device_name=None, snapshot_id=None, vdom=None):
+        # Groups of one VDOM (the default one unless given)
+        device_name = device_name or self.device_name
+        snapshot_id = snapshot_id or self.snapshot_id or self.latest_snapshot_id(device_name)
+        vdom = vdom or DEFAULT_VDOM
+        key = (device_name, snapshot_id, vdom)
+        if key not in self.address_resolvers:
+            link = self.addrgrp_member
+            groups = {}
+            with self.engine.connect() as conn:
+                result = conn.execute(
+                    select(self.firewall_addrgrp.c.name)
+                    .where(self.firewall_addrgrp.c.device_name == device_name)
+                    .where(self.firewall_addrgrp.c.snapshot_id == snapshot_id)
+                    .where(self.firewall_addrgrp.c.vdom == vdom)
+                )
+                for row in result:
+                    groups[row.name] = []
+                result = conn.execute(
+                    select(link.c.group_name, link.c.name)
+                    .where(link.c.device_name == device_name)
+                    .where(link.c.snapshot_id == snapshot_id)
+                    .where(link.c.vdom == vdom)
+                    .order_by(link.c.group_name, link.c.position)
+                )
+                for row in result:
+                    groups[row.group_name].append(row.name)
+            self.address_resolvers[key] = AddressGroupResolver(groups)
+        return self.address_resolvers[key]
+
+    def get_address_index(self, device_name=None, snapshot_id=None, vdom=None):
+        # Interval index over the stored numeric bounds of one snapshot's
+        # address objects and interface subnets; built once, then cached.
+        # vdom limits it to the objects of one VDOM (interfaces always count).
+        device_name = device_name or self.device_name
+        snapshot_id = snapshot_id or self.snapshot_id or self.latest_snapshot_id(device_name)
+        key = (device_name, snapshot_id, vdom)
+        if key not in self.address_indexes:
+            entries = []
+            with self.engine.connect() as conn:
+                for table, kind, prefix in self._range_sources():
+                    query = (
+                        select(
+                            table.c.name,
+                            table.c[f"{prefix}ip_version"],
+                            table.c[f"{prefix}range_start"],
+                            table.c[f"{prefix}range_end"]
+                        )
+                        .where(table.c.device_name == device_name)
+                        .where(table.c.snapshot_id == snapshot_id)
+                        .where(table.c[f"{prefix}ip_version"].is_not(None))
+                    )
+                    if vdom is not None and table is not self.system_interface:
+                        query = query.where(table.c.vdom == vdom)
+                    result = conn.execute(query)
+                    for name, version, start, end in result:
+                        entries.append((version, from_key(start), from_key(end), (kind, name)))
+            self.address_indexes[key] = AddressIndex(entries)
+        return self.address_indexes[key]
+
+    def _range_sources(self):
+        return (
+            (self.firewall_address, "firewall address", ""),
+            (self.firewall_address6, "firewall address6", ""),
+            (self.system_interface, "system interface", ""),
+            (self.system_interface, "system interface", "ip6_")
+        )
+
+    def addresses_containing(self, address, device_name=None, snapshot_id=None):
+        # Fleet-wide SQL variant: range scans on the ix_<table>_range indexes
+        # instead of parsing every subnet in Python
+        bounds = parse_ip_range(address)
+        if bounds is None:
+            raise ValueError(f"Not an IP address or network: {address!r}")
+        version, start, end = bounds
+        queries = []
+        for table, kind, prefix in self._range_sources():
+            query = (
+                select(table.c.device_name, table.c.snapshot_id, table.c.vdom, literal(kind).label('object_type'),
+                       table.c.name)
+                .where(table.c[f"{prefix}ip_version"] == version)
+                .where(table.c[f"{prefix}range_start"] <= to_key(start))
+                .where(table.c[f"{prefix}range_end"] >= to_key(end))
+            )
+            if device_name is not None:
+                query = query.where(table.c.device_name == device_name)
+            if snapshot_id is not None:
+                query = query.where(table.c.snapshot_id == snapshot_id)
+            queries.append(query)
+        with self.engine.connect() as conn:
+            return [dict(row) for row in conn.execute(union_all(*queries)).mappings()]
+
+    def _user_local_rows(self, config_dict, source_file=None, local_file=None):
+        row_context = self._row_context(source_file, local_file)
+        data = config_dict.get("user local", {})
+        return {self.user_local: [
+            dict(
+                username=username,
+                password=values.get("password"),
+                type=values.get("type"),
+                **row_context
+            )
+            for username, values in data.items()
+        ]}
+
+    def _firewall_policies_rows(self, config_dict, source_file=None, local_file=None):
+        row_context = self._row_context(source_file, local_file)
+        data = config_dict.get("firewall policy", {})
+        table_rows = {self.firewall_policies: []}
+        links = POLICY_LINK_TABLES
+        for link_table in links.values():
+            table_rows[link_table] = []
+        for policy_id, values in data.items():
+            policy_id = int(policy_id)
+            fields = {key: _as_list(values.get(key)) for key in links}
+            table_rows[self.firewall_policies].append(dict(
+                id=policy_id,
+                name=values.get("name"),
+                srcintf=" | ".join(fields["srcintf"]) or None,
+                dstintf=" | ".join(fields["dstintf"]) or None,
+                srcaddr=" | ".join(fields["srcaddr"]) or None,
+                dstaddr=" | ".join(fields["dstaddr"]) or None,
+                service=" | ".join(fields["service"]),
+                action=values.get("action"),
+                schedule=values.get("schedule"),
+                logtraffic=values.get("logtraffic"),
+                **row_context
+            ))
+            for key, link_table in links.items():
+                table_rows[link_table].extend(self._link_rows(row_context, "policy_id", policy_id, fields[key]))
+        return table_rows
+
+    def _link_rows(self, row_context, owner_column, owner, names):
+        rows = []
+        seen = set()
+        for position, name in enumerate(names):
+            if name in seen:
+                continue
+            seen.add(name)
+            rows.append({
+                "device_name": row_context["device_name"],
+                "snapshot_id": row_context["snapshot_id"],
+                "vdom": row_context["vdom"],
+                owner_column: owner,
+                "name": name,
+                "position": position
+            })
+        return rows
+
+    def _vpn_phase1_rows(self, config_dict, source_file=None, local_file=None):
+        row_context = self._row_context(source_file, local_file)
+        data = config_dict.get("vpn ipsec phase1-interface", {})
+        return {self.vpn_phase1: [
+            dict(
+                name=name,
+                interface=values.get("interface"),
+                peertype=values.get("peertype"),
+                net_device=values.get("net-device"),
+                proposal=values.get("proposal"),
+                remote_gw=values.get("remote-gw"),
+                psksecret=values.get("psksecret"),
+                **row_context
+            )
+            for name, values in data.items()
+        ]}
+
+    def _vpn_phase2_rows(self, config_dict, source_file=None, local_file=None):
+        row_context = self._row_context(source_file, local_file)
+        data = config_dict.get("vpn ipsec phase2-interface", {})
+        phase2_rows = []
+        selector_rows = []
+        for name, values in data.items():
+            phase2_rows.append(dict(
+                name=name,
+                phase1name=values.get("phase1name"),
+                proposal=values.get("proposal"),
+                pfs=values.get("pfs"),
+                replay=values.get("replay"),
+                **row_context
+            ))
+            selectors = values.get("phase2selectors", {})
+            for sel_id, sel_vals in selectors.items():
+                selector_rows.append(dict(
+                    vpn_name=name,
+                    selector_id=sel_id,
+                    src_subnet=sel_vals.get("src-subnet"),
+                    dst_subnet=sel_vals.get("dst-subnet"),
+                    **row_context
                 ))
-            session.commit()
-        except Exception:
-            session.rollback()
-            raise
-        finally:
-            session.close()
+        return {self.vpn_phase2: phase2_rows, self.phase2_selectors: selector_rows}
 
-    def save_vpn_phase1_interfaces(self, config_dict):
-        session = self.Session()
-        try:
-            session.execute(self.vpn_phase1.delete())
-            data = config_dict.get("vpn ipsec phase1-interface", {})
-            for name, values in data.items():
-                session.execute(self.vpn_phase1.insert().values(
-                    name=name,
-                    interface=values.get("interface"),
-                    peertype=values.get("peertype"),
-                    net_device=values.get("net-device"),
-                    proposal=values.get("proposal"),
-                    remote_gw=values.get("remote-gw"),
-                    psksecret=values.get("psksecret"),
+    def _firewall_service_custom_rows(self, config_dict, source_file=None, local_file=None):
+        row_context = self._row_context(source_file, local_file)
+        services = config_dict.get("firewall service custom", {})
+        return {self.firewall_service_custom: [
+            dict(
+                name=name,
+                protocol=values.get("protocol"),
+                tcp_portrange=values.get("tcp-portrange"),
+                udp_portrange=values.get("udp-portrange"),
+                icmp_type=values.get("icmp-type"),
+                icmp_code=values.get("icmp-code"),
+                comment=values.get("comment"),
+                **row_context
+            )
+            for name, values in services.items()
+        ]}
+
+    def _router_static_rows(self, config_dict, source_file=None, local_file=None):
+        row_context = self._row_context(source_file, local_file)
+        routes = config_dict.get("router static", {})
+        return {self.router_static: [
+            dict(
+                id=int(route_id),
+                dst=values.get("dst"),
+                gateway=values.get("gateway"),
+                device=values.get("device"),
+                priority=values.get("priority"),
+                distance=values.get("distance"),
+                comment=values.get("comment"),
+                **row_context
+            )
+            for route_id, values in routes.items()
+        ]}
+
+    def _system_admin_rows(self, config_dict, source_file=None, local_file=None):
+        row_context = self._row_context(source_file, local_file)
+        admins = config_dict.get("system admin", {})
+        return {self.system_admin: [
+            dict(
+                username=username,
+                password=values.get("password"),
+                ssh_public_key1=values.get("ssh-public-key1"),
+                accprofile=values.get("accprofile"),
+                **row_context
+            )
+            for username, values in admins.items()
+        ]}
+
+    def _firewall_schedule_recurring_rows(self, config_dict, source_file=None, local_file=None):
+        row_context = self._row_context(source_file, local_file)
+        schedules = config_dict.get("firewall schedule recurring", {})
+        return {self.firewall_schedule_recurring: [
+            dict(
+                name=name,
+                start=values.get("start"),
+                end=values.get("end"),
+                day=" | ".join(_as_list(values.get("day"))),
+                **row_context
+            )
+            for name, values in schedules.items()
+        ]}
+
+    def _dhcp_servers_rows(self, config_dict, source_file=None, local_file=None):
+        row_context = self._row_context(source_file, local_file)
+        dhcp_data = config_dict.get("dhcp server", {})
+        server_rows = []
+        range_rows = []
+        for dhcp_id, dhcp_config in dhcp_data.items():
+            server_rows.append(dict(
+                id=int(dhcp_id),
+                dns_service=dhcp_config.get("dns-service"),
+                default_gateway=dhcp_config.get("default-gateway"),
+                netmask=dhcp_config.get("netmask"),
+                interface=dhcp_config.get("interface"),
+                timezone_option=dhcp_config.get("timezone-option"),
+                tftp_server=dhcp_config.get("tftp-server"),
+                **row_context
+            ))
+            ip_ranges = dhcp_config.get("ip-range", {})
+            for range_id, range_data in ip_ranges.items():
+                range_rows.append(dict(
+                    dhcp_id=int(dhcp_id),
+                    range_id=range_id,
+                    start_ip=range_data.get("start-ip"),
+                    end_ip=range_data.get("end-ip"),
+                    **row_context
                 ))
-            session.commit()
-        except Exception:
-            session.rollback()
-            raise
-        finally:
-            session.close()
+        return {self.dhcp_servers: server_rows, self.ip_ranges: range_rows}
+
+    def _firewall_vip_rows(self, config_dict, source_file=None, local_file=None):
+        row_context = self._row_context(source_file, local_file)
+        vips = config_dict.get("firewall vip", {})
+        return {self.firewall_vip: [
+            dict(
+                name=name,
+                extip=values.get("extip"),
+                mappedip=values.get("mappedip"),
+                portforward=values.get("portforward"),
+                protocol=values.get("protocol"),
+                extport=values.get("extport"),
+                mappedport=values.get("mappedport"),
+                comment=values.get("comment"),
+                **row_context
+            )
+            for name, values in vips.items()
+        ]}
+
+    def save_system_global(self, config_dict):
+        self._replace_rows(self._system_global_rows(config_dict))
+
+    def save_system_interface(self, config_dict):
+        self._replace_rows(self._system_interface_rows(config_dict))
+
+    def save_firewall_address(self, config_dict):
+        self._replace_rows(self._firewall_address_rows(config_dict))
+
+    def save_firewall_address6(self, config_dict):
+        self._replace_rows(self._firewall_address6_rows(config_dict))
+
+    def save_firewall_addrgrp(self, config_dict):
+        self._replace_rows(self._firewall_addrgrp_rows(config_dict))
+
+    def save_user_local(self, config_dict):
+        self._replace_rows(self._user_local_rows(config_dict))
+
+    def save_firewall_policies(self, config_dict):
+        self._replace_rows(self._firewall_policies_rows(config_dict))
+
+    def save_vpn_phase1_interfaces(self, config_dict):
+        self._replace_rows(self._vpn_phase1_rows(config_dict))
 
     def save_vpn_phase2_interfaces(self, config_dict):
-        session = self.Session()
-        try:
-            session.execute(self.vpn_phase2.delete())
-            session.execute(self.phase2_selectors.delete())
-
-            data = config_dict.get("vpn ipsec phase2-interface", {})
-            for name, values in data.items():
-                session.execute(self.vpn_phase2.insert().values(
-                    name=name,
-                    phase1name=values.get("phase1name"),
-                    proposal=values.get("proposal"),
-                    pfs=values.get("pfs"),
-                    replay=values.get("replay"),
-                ))
-                selectors = values.get("phase2selectors", {})
-                for sel_id, sel_vals in selectors.items():
-                    session.execute(self.phase2_selectors.insert().values(
-                        vpn_name=name,
-                        selector_id=sel_id,
-                        src_subnet=sel_vals.get("src-subnet"),
-                        dst_subnet=sel_vals.get("dst-subnet"),
-                    ))
-            session.commit()
-        except Exception:
-            session.rollback()
-            raise
-        finally:
-            session.close()
+        self._replace_rows(self._vpn_phase2_rows(config_dict))
 
     def save_firewall_service_custom(self, config_dict, source_file, local_file):
-        session = self.Session()
-        try:
-            session.execute(self.firewall_service_custom.delete())
-            services = config_dict.get("firewall service custom", {})
-            for name, values in services.items():
-                session.execute(self.firewall_service_custom.insert().values(
-                    name=name,
-                    protocol=values.get("protocol"),
-                    tcp_portrange=values.get("tcp-portrange"),
-                    udp_portrange=values.get("udp-portrange"),
-                    icmp_type=values.get("icmp-type"),
-                    icmp_code=values.get("icmp-code"),
-                    comment=values.get("comment"),
-                    source_file=source_file,
-                    local_file=local_file,
-                    created_at=datetime.datetime.utcnow().isoformat()
-                ))
-            session.commit()
-        except Exception:
-            session.rollback()
-            raise
-        finally:
-            session.close()
+        self._replace_rows(self._firewall_service_custom_rows(config_dict, source_file, local_file))
 
     def save_router_static(self, config_dict, source_file, local_file):
-        session = self.Session()
-        try:
-            session.execute(self.router_static.delete())
-            routes = config_dict.get("router static", {})
-            for route_id, values in routes.items():
-                session.execute(self.router_static.insert().values(
-                    id=int(route_id),
-                    dst=values.get("dst"),
-                    gateway=values.get("gateway"),
-                    device=values.get("device"),
-                    priority=values.get("priority"),
-                    distance=values.get("distance"),
-                    comment=values.get("comment"),
-                    source_file=source_file,
-                    local_file=local_file,
-                    created_at=datetime.datetime.utcnow().isoformat()
-                ))
-            session.commit()
-        except Exception:
-            session.rollback()
-            raise
-        finally:
-            session.close()
+        self._replace_rows(self._router_static_rows(config_dict, source_file, local_file))
 
     def save_system_admin(self, config_dict, source_file, local_file):
-        session = self.Session()
-        try:
-            session.execute(self.system_admin.delete())
-            admins = config_dict.get("system admin", {})
-            for username, values in admins.items():
-                session.execute(self.system_admin.insert().values(
-                    username=username,
-                    password=values.get("password"),
-                    ssh_public_key1=values.get("ssh-public-key1"),
-                    accprofile=values.get("accprofile"),
-                    source_file=source_file,
-                    local_file=local_file,
-                    created_at=datetime.datetime.utcnow().isoformat()
-                ))
-            session.commit()
-        except Exception:
-            session.rollback()
-            raise
-        finally:
-            session.close()
+        self._replace_rows(self._system_admin_rows(config_dict, source_file, local_file))
 
     def save_firewall_schedule_recurring(self, config_dict, source_file, local_file):
-        session = self.Session()
-        try:
-            session.execute(self.firewall_schedule_recurring.delete())
-            schedules = config_dict.get("firewall schedule recurring", {})
-            for name, values in schedules.items():
-                session.execute(self.firewall_schedule_recurring.insert().values(
-                    name=name,
-                    start=values.get("start"),
-                    end=values.get("end"),
-                    day=" | ".join(values.get("day", [])),
-                    source_file=source_file,
-                    local_file=local_file,
-                    created_at=datetime.datetime.utcnow().isoformat()
-                ))
-            session.commit()
-        except Exception:
-            session.rollback()
-            raise
-        finally:
-            session.close()
+        self._replace_rows(self._firewall_schedule_recurring_rows(config_dict, source_file, local_file))
 
     def save_dhcp_servers(self, config_dict):
-        dhcp_data = config_dict.get("dhcp server", {})
-        session = self.Session()
-        try:
-            session.execute(self.dhcp_servers.delete())
-            session.execute(self.ip_ranges.delete())
-            for dhcp_id, dhcp_config in dhcp_data.items():
-                session.execute(self.dhcp_servers.insert().values(
-                    id=int(dhcp_id),
-                    dns_service=dhcp_config.get("dns-service"),
-                    default_gateway=dhcp_config.get("default-gateway"),
-                    netmask=dhcp_config.get("netmask"),
-                    interface=dhcp_config.get("interface"),
-                    timezone_option=dhcp_config.get("timezone-option"),
-                    tftp_server=dhcp_config.get("tftp-server")
-                ))
-
-                ip_ranges = dhcp_config.get("ip-range", {})
-                for range_id, range_data in ip_ranges.items():
-                    session.execute(self.ip_ranges.insert().values(
-                        dhcp_id=int(dhcp_id),
-                        range_id=range_id,
-                        start_ip=range_data.get("start-ip"),
-                        end_ip=range_data.get("end-ip")
-                    ))
-            session.commit()
-        except Exception:
-            session.rollback()
-            raise
-        finally:
-            session.close()
+        self._replace_rows(self._dhcp_servers_rows(config_dict))
 
     def save_firewall_vip(self, config_dict, source_file, local_file):
-        session = self.Session()
-        try:
-            session.execute(self.firewall_vip.delete())
-            vips = config_dict.get("firewall vip", {})
-            for name, values in vips.items():
-                session.execute(self.firewall_vip.insert().values(
-                    name=name,
-                    extip=values.get("extip"),
-                    extintf=values.get("extintf"),
-                    mappedip=values.get("mappedip"),
-                    portforward=values.get("portforward"),
-                    protocol=values.get("protocol"),
-                    extport=values.get("extport"),
-                    mappedport=values.get("mappedport"),
-                    source_file=source_file,
-                    local_file=local_file,
-                    created_at=datetime.datetime.utcnow().isoformat()
-                ))
-            session.commit()
-        except Exception:
-            session.rollback()
-            raise
-        finally:
-            session.close()
+        self._replace_rows(self._firewall_vip_rows(config_dict, source_file, local_file))
 
-    def generate_change_report(self):
-        from collections import defaultdict
-        from sqlalchemy import text
+    def _policy_references(self, object_name, fields, device_name=None, snapshot_id=None):
+        # Index lookups on each link table's (name, device_name, snapshot_id, vdom) index
+        queries = []
+        for field in fields:
+            link = POLICY_LINK_TABLES[field]
+            query = select(
+                link.c.device_name, link.c.snapshot_id, link.c.vdom, link.c.policy_id, literal(field).label('field')
+            ).where(link.c.name == object_name)
+            if device_name is not None:
+                query = query.where(link.c.device_name == device_name)
+            if snapshot_id is not None:
+                query = query.where(link.c.snapshot_id == snapshot_id)
+            queries.append(query)
+        return union_all(*queries).subquery()
 
+    def policies_referencing(self, object_name, device_name=None, snapshot_id=None):
+        # Which policies use an interface, address or service, and through which field
+        refs = self._policy_references(object_name, POLICY_LINK_TABLES, device_name, snapshot_id)
+        with self.engine.connect() as conn:
+            return [dict(row) for row in conn.execute(select(refs)).mappings()]
+
+    def policies_using_address(self, address_name, since_days=30, device_name=None):
+        # Fleet-wide lookup over the srcaddr/dstaddr link tables, in snapshots
+        # written (loaded or synced) within the last since_days
+        cutoff = (datetime.datetime.utcnow() - datetime.timedelta(days=since_days)).isoformat()
+        refs = self._policy_references(address_name, ("srcaddr", "dstaddr"), device_name)
+        p = self.firewall_policies
+        query = (
+            select(refs.c.field, self.snapshots.c.created_at.label('snapshot_created_at'), p)
+            .join(p, and_(
+                p.c.device_name == refs.c.device_name,
+                p.c.snapshot_id == refs.c.snapshot_id,
+                p.c.vdom == refs.c.vdom,
+                p.c.id == refs.c.policy_id
+            ))
+            .join(self.snapshots, self.snapshots.c.id == refs.c.snapshot_id)
+            .where(self.snapshots.c.updated_at >= cutoff)
+        )
         with self.engine.connect() as conn:
-            result = conn.execute(text("SELECT source_file, action FROM config_changes"))
-            summary = defaultdict(lambda: defaultdict(int))
+            return [dict(row) for row in conn.execute(query).mappings()]
 
-            for row in result:
-                summary[row.source_file][row.action] += 1
+    def generate_change_report(self, since=None, until=None, device_name=None):
+        summary = defaultdict(dict)
+        for row in self.change_summary(since, until, device_name):
+            summary[row["source_file"]][row["action"]] = row["count"]
 
-            print("\n[CHANGE REPORT SUMMARY]")
-            for source_file, actions in summary.items():
-                print(f"\nSource: {source_file}")
-                for action, count in actions.items():
-                    print(f"  {action}: {count}")
+        print("\n[CHANGE REPORT SUMMARY]")
+        for source_file, actions in summary.items():
+            print(f"\nSource: {source_file}")
+            for action, count in actions.items():
+                print(f"  {action}: {count}")
 
     def print_all_data(self):
-        session = self.Session()
-        try:
+        # Rows are fetched in batches of batch_size and printed as they
+        # arrive, never a whole table at once (query_api.QueryAPI has the
+        # filtered and paginated variants)
+        with self.engine.connect() as conn:
             for table in self.metadata.sorted_tables:
                 print(f"\n--- {table.name} ---")
-                results = session.execute(table.select()).mappings().all()
-                for row in results:
+                result = conn.execution_options(yield_per=self.batch_size).execute(table.select())
+                for row in result.mappings():
                     print(dict(row))
-        finally:
-            session.close()
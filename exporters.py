@@ -0,0 +1,221 @@
+import argparse
+import json
+import os
+import re
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional, only needed by ParquetExporter
+    pa = pq = None
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # optional, only needed by XlsxExporter
+    Workbook = None
+
+# Exporters consume (table_name, columns, rows) triples: columns is a list of
+# (name, python_type) with python_type int or str, rows an iterable of dicts.
+# Sources below produce them one table at a time, so nothing holds more than
+# one section (or one batch of DB rows) in memory.
+
+
+def _flatten(value):
+    if isinstance(value, list):
+        return " ".join(value)
+    if isinstance(value, dict):
+        return json.dumps(value)
+    return value
+
+
+def section_table(section, data):
+    # One row per object ("edit" entry) of a parsed section; direct settings
+    # of the section ("system global") become setting/value rows
+    rows = []
+    columns = {}
+    for name, values in data.items():
+        if isinstance(values, dict):
+            columns.setdefault("object", str)
+            row = {"object": name}
+            for key, value in values.items():
+                row[key] = _flatten(value)
+                columns.setdefault(key, str)
+        else:
+            columns.setdefault("setting", str)
+            columns.setdefault("value", str)
+            row = {"setting": name, "value": _flatten(values)}
+        rows.append(row)
+    return section, list(columns.items()), rows
+
+
+def section_tables(sections):
+    # sections: iterable of (section, data), e.g. FortiGateConfigParser.iter_sections()
+    for section, data in sections:
+        yield section_table(section, data)
+
+
+def db_tables(db, device_name=None, snapshot_id=None, tables=None, batch_size=1000):
+    # Streams database tables with server-side batches of batch_size rows;
+    # tables keyed by device/snapshot are limited to the given ones
+    from sqlalchemy import Integer
+    from query_api import QueryAPI
+
+    api = QueryAPI(db, batch_size)
+    for table in db.metadata.sorted_tables:
+        if tables and table.name not in tables:
+            continue
+        columns = [(c.name, int if isinstance(c.type, Integer) else str) for c in table.columns]
+        yield table.name, columns, api.rows(table, device_name=device_name, snapshot_id=snapshot_id)
+
+
+class NdjsonExporter:
+    # One JSON object per line, tagged with its table
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "w")
+
+    def write_table(self, name, columns, rows):
+        count = 0
+        for row in rows:
+            self.file.write(json.dumps({"table": name, **row}))
+            self.file.write("\n")
+            count += 1
+        return count
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetExporter:
+    # One .parquet file per table in a directory, written in row groups of
+    # batch_size rows through a ParquetWriter
+    TYPES = {int: "int64", str: "string"}
+
+    def __init__(self, directory, batch_size=10000):
+        if pa is None:
+            raise RuntimeError("Parquet export requires pyarrow")
+        self.directory = directory
+        self.batch_size = batch_size
+        self.paths = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        # A section seen twice (a reopened config block) gets a second file
+        stem = re.sub(r"[^\w.-]+", "_", name)
+        count = self.paths[stem] = self.paths.get(stem, 0) + 1
+        suffix = "" if count == 1 else f".{count}"
+        return os.path.join(self.directory, f"{stem}{suffix}.parquet")
+
+    def write_table(self, name, columns, rows):
+        schema = pa.schema([(column, getattr(pa, self.TYPES[kind])()) for column, kind in columns])
+        count = 0
+        with pq.ParquetWriter(self._path(name), schema) as writer:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    writer.write_table(self._to_table(batch, columns, schema))
+                    count += len(batch)
+                    batch = []
+            if batch or not count:
+                writer.write_table(self._to_table(batch, columns, schema))
+                count += len(batch)
+        return count
+
+    def _to_table(self, batch, columns, schema):
+        arrays = {}
+        for column, kind in columns:
+            values = [row.get(column) for row in batch]
+            if kind is str:
+                values = [value if value is None or isinstance(value, str) else str(value) for value in values]
+            arrays[column] = values
+        return pa.Table.from_pydict(arrays, schema=schema)
+
+    def close(self):
+        pass
+
+
+class XlsxExporter:
+    # One worksheet per table; openpyxl's write-only mode streams rows to
+    # disk instead of keeping the workbook in memory
+    def __init__(self, path):
+        if Workbook is None:
+            raise RuntimeError("Excel export requires openpyxl")
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.titles = set()
+
+    def _title(self, name):
+        # Sheet titles: at most 31 characters, no []:*?/\, unique
+        base = re.sub(r"[\[\]:*?/\\]", "_", name)[:31]
+        title, n = base, 1
+        while title.lower() in self.titles:
+            n += 1
+            title = f"{base[:31 - len(str(n)) - 1]}~{n}"
+        self.titles.add(title.lower())
+        return title
+
+    def write_table(self, name, columns, rows):
+        sheet = self.workbook.create_sheet(self._title(name))
+        names = [column for column, _ in columns]
+        sheet.append(names)
+        count = 0
+        for row in rows:
+            sheet.append([row.get(column) for column in names])
+            count += 1
+        return count
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+EXPORTERS = {
+    "ndjson": NdjsonExporter,
+    "parquet": ParquetExporter,
+    "xlsx": XlsxExporter,
+}
+
+
+def open_exporter(export_format, path):
+    return EXPORTERS[export_format](path)
+
+
+def export_tables(exporter, tables):
+    # Writes every (name, columns, rows) triple and closes the exporter
+    total = 0
+    try:
+        for name, columns, rows in tables:
+            total += exporter.write_table(name, columns, rows)
+    finally:
+        exporter.close()
+    return total
+
+
+def export_sections(exporter, sections):
+    # Pass-through for a stream of (section, data): each section is exported
+    # as it goes by, then handed on unchanged (e.g. to the database loader)
+    for section, data in sections:
+        exporter.write_table(*section_table(section, data))
+        yield section, data
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Export the FortiGate database or a config file")
+    arg_parser.add_argument("format", choices=sorted(EXPORTERS))
+    arg_parser.add_argument("output", help="output file (ndjson/xlsx) or directory (parquet)")
+    arg_parser.add_argument("--config", help="export this .conf file's sections instead of the database")
+    arg_parser.add_argument("--db-url", default='sqlite:///fortigate_config.db')
+    arg_parser.add_argument("--device", help="only rows of this device")
+    arg_parser.add_argument("--snapshot", type=int, help="only rows of this snapshot")
+    arg_parser.add_argument("--table", action="append", help="table to export (repeatable; default: all)")
+    args = arg_parser.parse_args()
+
+    exporter = open_exporter(args.format, args.output)
+    if args.config:
+        from fortigate_parser import FortiGateConfigParser
+        tables = section_tables(FortiGateConfigParser().iter_sections(args.config))
+    else:
+        from database_handler import FortiGateDatabaseHandler
+        tables = db_tables(FortiGateDatabaseHandler(args.db_url), args.device, args.snapshot, args.table)
+    count = export_tables(exporter, tables)
+    print(f"[INFO] Exported {count} rows to {args.output}")
@@ -0,0 +1,182 @@
+import argparse
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from config_sources import is_archive, is_config_name, iter_archive, strip_compression
+from fortigate_parser import FortiGateConfigParser
+
+# Put on the result queue to tell the writer thread there is nothing left
+_DONE = object()
+# Seconds between checks that the writer is still alive while the queue is full
+PUT_TIMEOUT = 1.0
+
+
+def collect_config_files(path):
+    # A directory is scanned recursively for config files (plain or
+    # compressed) and tar archives of them; a single archive or config file
+    # is read as is; any other file is read as a manifest with one
+    # "local_path[,source_name]" entry per line.
+    entries = []
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                if is_config_name(name) or is_archive(os.path.join(root, name)):
+                    entries.append((os.path.join(root, name), strip_compression(name)))
+        return sorted(entries)
+    if is_archive(path):
+        return [(path, os.path.basename(path))]
+    if is_config_name(path):
+        return [(path, strip_compression(os.path.basename(path)))]
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            local_path, _, source_name = line.partition(",")
+            local_path = local_path.strip()
+            if not os.path.isabs(local_path):
+                local_path = os.path.join(base_dir, local_path)
+            entries.append((local_path, source_name.strip() or os.path.basename(strip_compression(local_path))))
+    return entries
+
+
+def iter_configs(entries):
+    # (local_file, source_file, parse function, arguments) per config. Tar
+    # archives are read here as a stream, member by member, and each member's
+    # text goes to a worker; only the members in flight are held in memory.
+    for local_path, source_name in entries:
+        if not is_archive(local_path):
+            yield local_path, source_name, parse_config_file, (local_path,)
+            continue
+        for member, lines in iter_archive(local_path):
+            yield (f"{local_path}:{member}", os.path.basename(strip_compression(member)),
+                   parse_config_text, ("".join(lines), member))
+
+
+def parse_config_file(local_file_path):
+    # Runs inside a worker process
+    parser = FortiGateConfigParser()
+    parsed_config = parser.parse_mmap(local_file_path)
+    return parsed_config, parser.change_log, parser.run_timestamp
+
+
+def parse_config_text(text, name):
+    # Runs inside a worker process, for an archive member
+    parser = FortiGateConfigParser()
+    parsed_config = parser.parse_stream(text.split("\n"), name)
+    return parsed_config, parser.change_log, parser.run_timestamp
+
+
+def _writer(db_url, results, stats):
+    # The only thread that touches the database. A file that fails to load
+    # is recorded and skipped; anything else stops the writer, and the error
+    # is left in stats for the producer (_put) to raise.
+    try:
+        from database_handler import FortiGateDatabaseHandler
+        db = FortiGateDatabaseHandler(db_url)
+        while True:
+            item = results.get()
+            if item is _DONE:
+                break
+            local_file, source_file, parsed_config, change_log, run_timestamp = item
+            try:
+                db.bulk_load(parsed_config, source_file, local_file)
+                db.save_config_changes(change_log, source_file, local_file, run_timestamp)
+                stats["loaded"] += 1
+            except Exception as e:
+                stats["failed"].append((local_file, f"load: {e}"))
+    except BaseException as e:
+        stats["writer_error"] = e
+
+
+def _put(results, item, writer, stats):
+    # Blocks while the writer is behind, but gives up once it has died
+    # instead of waiting forever for room in the queue
+    while True:
+        if not writer.is_alive():
+            raise RuntimeError("The database writer stopped") from stats.get("writer_error")
+        try:
+            results.put(item, timeout=PUT_TIMEOUT)
+            return
+        except queue.Full:
+            pass
+
+
+def ingest_fleet(path, db_url='sqlite:///fortigate_config.db', workers=None, queue_size=16):
+    entries = collect_config_files(path)
+    workers = workers or os.cpu_count() or 1
+    results = queue.Queue(maxsize=queue_size)
+    stats = {"loaded": 0, "total": 0, "failed": []}
+
+    # Create the schema once before the writer and workers start; parser
+    # workers never import the database layer
+    from database_handler import FortiGateDatabaseHandler
+    FortiGateDatabaseHandler(db_url)
+    writer = threading.Thread(target=_writer, args=(db_url, results, stats), daemon=True)
+    writer.start()
+
+    start = time.perf_counter()
+    pending = {}
+    remaining = iter_configs(entries)
+    # Parsed configs waiting in the queue are bounded by queue_size, and
+    # in-flight parses by workers, so memory stays flat for any fleet size.
+    max_in_flight = workers * 2
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while True:
+            while len(pending) < max_in_flight:
+                config = next(remaining, None)
+                if config is None:
+                    break
+                local_file, source_file, parse, arguments = config
+                try:
+                    future = pool.submit(parse, *arguments)
+                except BrokenProcessPool as e:
+                    # A worker died (killed for memory, say) and the pool takes
+                    # no more work: the configs not parsed yet are failures
+                    for local_file, *_ in itertools.chain([config], remaining):
+                        stats["total"] += 1
+                        stats["failed"].append((local_file, f"parse: {e}"))
+                    break
+                pending[future] = (local_file, source_file)
+                stats["total"] += 1
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                local_file, source_file = pending.pop(future)
+                try:
+                    parsed_config, change_log, run_timestamp = future.result()
+                except Exception as e:
+                    stats["failed"].append((local_file, f"parse: {e}"))
+                    continue
+                _put(results, (local_file, source_file, parsed_config, change_log, run_timestamp), writer, stats)
+
+    _put(results, _DONE, writer, stats)
+    writer.join()
+    if "writer_error" in stats:
+        raise RuntimeError("The database writer stopped") from stats["writer_error"]
+    elapsed = time.perf_counter() - start
+
+    print(f"[INFO] Loaded {stats['loaded']}/{stats['total']} files in {elapsed:.2f}s "
+          f"({stats['total'] / elapsed if elapsed else 0:.1f} files/sec)")
+    for local_file, error in stats["failed"]:
+        print(f"[ERROR] {local_file}: {error}")
+    return stats
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Parse and load a fleet of FortiGate configs")
+    arg_parser.add_argument("path", help="directory of config files, a tar archive or a manifest file")
+    arg_parser.add_argument("--db-url", default='sqlite:///fortigate_config.db')
+    arg_parser.add_argument("--workers", type=int, default=None, help="parser processes (default: CPU count)")
+    arg_parser.add_argument("--queue-size", type=int, default=16, help="parsed configs buffered for the writer")
+    args = arg_parser.parse_args()
+
+    ingest_fleet(args.path, args.db_url, args.workers, args.queue_size)
@@ -1,160 +1,509 @@
+import gc
 import re
+import os
 import json
-from collections import defaultdict
-from sqlalchemy import create_engine, Table, Column, Integer, String, MetaData, Text, ForeignKey
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.dialects.sqlite import insert
+import mmap
+import hashlib
+import datetime
+from collections import namedtuple
+from contextlib import contextmanager
+from config_sources import compression_of, open_config
+
+LIST_KEYS = frozenset({
+    "member", "service", "allowaccess", "dns-server",
+    "ntp-server", "dnsfilter-profile", "ssh-filter-profile",
+    "ipv6-address", "groups", "srcintf", "dstintf", "srcaddr",
+    "dstaddr", "day"
+})
+
+# One unset/delete/rename statement. object_type is the "/"-joined path of the
+# table holding the object; unset also records the attribute and the value it
+# cleared. The timestamp is kept once per parse run (parser.run_timestamp).
+ChangeEvent = namedtuple(
+    "ChangeEvent", ["action", "object_type", "object_name", "new_name", "attribute", "old_value"]
+)
+
+# A double-quoted token (with backslash escapes) or a bare word
+TOKEN_RE = re.compile(r'"((?:[^"\\]|\\.)*)"|(\S+)')
+ESCAPE_RE = re.compile(r'\\(.)')
+
+def split_tokens(text):
+    if '"' not in text:
+        return text.split()
+    tokens = []
+    for quoted, bare in TOKEN_RE.findall(text):
+        if bare:
+            tokens.append(bare)
+        elif "\\" in quoted:
+            tokens.append(ESCAPE_RE.sub(r"\1", quoted))
+        else:
+            tokens.append(quoted)
+    return tokens
+
+
+# VDOM of every section of a config without VDOMs, and the unit holding the
+# "config global" part of a multi-VDOM config
+DEFAULT_VDOM = "root"
+GLOBAL_VDOM = "global"
+# Top-level sections of a multi-VDOM config that wrap the real sections
+VDOM_SECTIONS = ("global", "vdom")
+
+
+def iter_vdom_sections(sections, vdom=DEFAULT_VDOM):
+    # (vdom, section, data) for (section, data) pairs of a parsed config. A
+    # multi-VDOM config nests its sections under "config global" and
+    # "config vdom" / "edit <vdom>"; those are unwrapped, anything else
+    # belongs to `vdom`.
+    for section, data in sections:
+        if section == "global" and isinstance(data, dict):
+            for name, value in data.items():
+                yield GLOBAL_VDOM, name, value
+        elif section == "vdom" and isinstance(data, dict):
+            for name, vdom_sections in data.items():
+                if isinstance(vdom_sections, dict):
+                    for section_name, value in vdom_sections.items():
+                        yield name, section_name, value
+        else:
+            yield vdom, section, data
+
+
+# Bytes of a memory-mapped file split into lines at a time (parse_mmap)
+MMAP_CHUNK_SIZE = 1 << 20
+
+
+# Backslash escapes, skipped when quotes are counted (str and bytes)
+QUOTE_ESCAPE_RES = {str: re.compile(r"\\.", re.S), bytes: re.compile(rb"\\.", re.S)}
+
+
+def odd_quotes(text):
+    # True if text (str, or bytes from a mapped file) opens or closes a
+    # quoted span: an odd number of unescaped double quotes. The parser, the
+    # section digests and section_index all decide where a multi-line quoted
+    # value ends with this one rule.
+    if isinstance(text, str):
+        quote, backslash = '"', "\\"
+    else:
+        text = bytes(text)
+        quote, backslash = b'"', b"\\"
+    if quote not in text:
+        return False
+    if backslash in text:
+        text = QUOTE_ESCAPE_RES[type(text)].sub(text[:0], text)
+    return text.count(quote) % 2 == 1
+
+
+@contextmanager
+def paused_gc():
+    # A parse allocates millions of dicts, lists and strings and frees none
+    # of them, so the cyclic collector keeps rescanning the growing tree for
+    # nothing (about a third of the parse time on a 1M-line config). The
+    # tree holds no cycles; it is paused for the build and restored after.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def subtree_digest(node, digests):
+    # Merkle digest of a parsed dict: its keys in order, leaf values by repr
+    # and child dicts by their own digest (memoized in `digests`, keyed by
+    # id with the dict kept alive so the id cannot be reused).
+    hasher = hashlib.blake2b(digest_size=16)
+    for key, value in node.items():
+        hasher.update(key.encode())
+        if isinstance(value, dict):
+            entry = digests.get(id(value))
+            child = entry[1] if entry is not None and entry[0] is value else subtree_digest(value, digests)
+            hasher.update(b"\x01")
+            hasher.update(child)
+        else:
+            hasher.update(b"\x02")
+            hasher.update(repr(value).encode())
+        hasher.update(b"\x00")
+    digest = hasher.digest()
+    digests[id(node)] = (node, digest)
+    return digest
+
+
+def lookup_digest(node, digests):
+    entry = digests.get(id(node))
+    if entry is not None and entry[0] is node:
+        return entry[1]
+    return subtree_digest(node, digests)
+
 
 class FortiGateConfigParser:
-    def __init__(self):
+    def __init__(self, hash_subtrees=False):
         self.config = {}
         self.stack = []
+        self.cursor = [self.config]
         self.change_log = []
+        self.run_timestamp = None
         self.current_file = ""
+        # With hash_subtrees, every dict gets a Merkle digest when its block
+        # closes (see subtree_digest), for config_diff to skip equal subtrees
+        self.hash_subtrees = hash_subtrees
+        self.digests = {}
+        # Lines of a quoted value still open at the end of a line
+        self._pending = None
+        # Byte offsets of the top-level blocks of an indexed file (index_file)
+        # and the sections parsed from it so far
+        self.section_index = {}
+        self._indexed_file = None
+        self._sections = {}
+        self._dispatch = {
+            "config": self._on_config,
+            "edit": self._on_edit,
+            "set": self._on_set,
+            "unset": self._on_unset,
+            "delete": self._on_delete,
+            "rename": self._on_rename,
+            "next": self._on_close,
+            "end": self._on_close,
+        }
+
+    def _reset(self):
+        self.config = {}
+        self.stack = []
+        self.cursor = [self.config]
+        self.digests = {}
+        self._pending = None
+
+    def _start_run(self):
+        # One timestamp shared by every change event of this parse
+        self.change_log = []
+        self.run_timestamp = datetime.datetime.utcnow().isoformat()
 
     def _get_nested_dict(self):
-        d = self.config
-        for key in self.stack:
-            d = d.setdefault(key, {})
-        return d
+        return self.cursor[-1]
 
     def _normalize_value(self, key, value):
-        list_keys = {
-            "member", "service", "allowaccess", "dns-server",
-            "ntp-server", "dnsfilter-profile", "ssh-filter-profile",
-            "ipv6-address", "groups"
-        }
-        value = value.strip('"')
-        if key in list_keys:
-            return [v.strip('"') for v in value.split()]
-        return value
-
-    def _assign_value(self, key, value):
-        current_dict = self._get_nested_dict()
-        current_dict[key] = value
-
-    def save_system_global(self, config_dict):
-        session = self.Session()
-        try:
-            data = config_dict.get("system global", {})
-            if not data:
-                return
-            session.execute(self.global_settings.insert().values(
-                hostname=data.get("hostname"),
-                timezone=data.get("timezone"),
-                admintimeout=data.get("admintimeout"),
-                alias=" | ".join(data.get("alias", [])) if isinstance(data.get("alias"), list) else data.get("alias")
-            ))
-            session.commit()
-        except Exception:
-            session.rollback()
-            raise
-        finally:
-            session.close()
+        single = value and value[0] == '"' and value[-1] == '"' and value.count('"') == 2
+        if key in LIST_KEYS:
+            return [value[1:-1]] if single else split_tokens(value)
+        if single:
+            return value[1:-1]
+        if '"' not in value:
+            return value
+        return " ".join(split_tokens(value))
+
+    def _open_child(self, name):
+        current_dict = self.cursor[-1]
+        child = current_dict.get(name)
+        if not isinstance(child, dict):
+            child = current_dict[name] = {}
+        self.stack.append(name)
+        self.cursor.append(child)
+
+    def _on_config(self, rest):
+        self._open_child(rest.strip())
+
+    def _on_edit(self, rest):
+        tokens = split_tokens(rest)
+        self._open_child(tokens[0] if tokens else "")
+
+    def _on_set(self, rest):
+        key, _, value = rest.partition(" ")
+        self.cursor[-1][key] = self._normalize_value(key, value.strip())
+
+    def _on_unset(self, rest):
+        key = rest.strip()
+        old_value = self.cursor[-1].pop(key, None)
+        if len(self.stack) > 1:
+            object_type, object_name = "/".join(self.stack[:-1]), self.stack[-1]
+        else:
+            object_type, object_name = "/".join(self.stack), None
+        if isinstance(old_value, list):
+            old_value = " ".join(old_value)
+        elif isinstance(old_value, dict):
+            old_value = None
+        self.change_log.append(ChangeEvent("unset", object_type, object_name, None, key, old_value))
+
+    def _on_delete(self, rest):
+        tokens = split_tokens(rest)
+        if tokens:
+            self.cursor[-1].pop(tokens[0], None)
+            self.change_log.append(ChangeEvent("delete", "/".join(self.stack), tokens[0], None, None, None))
+
+    def _on_rename(self, rest):
+        tokens = split_tokens(rest)
+        if len(tokens) == 3 and tokens[1] == "to":
+            del tokens[1]
+        if len(tokens) == 2:
+            old, new = tokens
+            current_dict = self.cursor[-1]
+            if old in current_dict:
+                current_dict[new] = current_dict.pop(old)
+            self.change_log.append(ChangeEvent("rename", "/".join(self.stack), old, new, None, None))
+
+    def _on_close(self, rest):
+        if self.stack:
+            if self.hash_subtrees:
+                subtree_digest(self.cursor[-1], self.digests)
+            self.stack.pop()
+            self.cursor.pop()
 
     def parse_line(self, line):
+        if self._pending is not None:
+            self._continue_quoted(line)
+            return
         line = line.strip()
-        if not line or line.startswith("#"):
+        if not line or line[0] == "#":
             return
+        # A quoted value that continues on the next lines is collected and
+        # joined once its quote closes
+        if '"' in line and odd_quotes(line):
+            self._pending = [line]
+            return
+        keyword, _, rest = line.partition(" ")
+        handler = self._dispatch.get(keyword)
+        if handler is not None:
+            handler(rest)
 
-        if line.startswith("config "):
-            block = line.split("config ", 1)[1].strip()
-            self.stack.append(block)
-
-        elif line.startswith("edit "):
-            context = line.split("edit ", 1)[1].strip().strip('"')
-            current_dict = self._get_nested_dict()
-            self.stack.append(context)
-            current_dict.setdefault(context, {})
+    def _continue_quoted(self, line):
+        line = line.rstrip("\r\n")
+        self._pending.append(line)
+        if '"' in line and odd_quotes(line):
+            line = "\n".join(self._pending)
+            self._pending = None
+            self._dispatch_line(line)
 
-        elif line.startswith("set "):
-            parts = line.split(None, 2)
-            if len(parts) == 2:
-                key, value = parts[1], ""
-            else:
-                _, key, value = parts
-            value = self._normalize_value(key, value)
-            self._assign_value(key, value)
-
-        elif line.startswith("unset "):
-            key = line.split("unset ", 1)[1].strip()
-            current_dict = self._get_nested_dict()
-            current_dict.pop(key, None)
-
-        elif line.startswith("delete "):
-            entry = line.split("delete ", 1)[1].strip()
-            current_dict = self._get_nested_dict()
-            current_dict.pop(entry, None)
-
-        elif line.startswith("rename "):
-            parts = line.split()
-            if len(parts) == 3:
-                old, new = parts[1], parts[2]
-                current_dict = self._get_nested_dict()
-                if old in current_dict:
-                    current_dict[new] = current_dict.pop(old)
-
-        elif line == "next":
-            if self.stack:
-                self.stack.pop()
-
-        elif line == "end":
-            if self.stack:
-                self.stack.pop()
-
-        elif line.startswith("unset "):
-            key = line.split("unset ", 1)[1].strip()
-            current_dict = self._get_nested_dict()
-            current_dict.pop(key, None)
-            self.change_log.append({
-                "action": "unset",
-                "object_type": self.stack[-1] if self.stack else "global",
-                "object_name": key,
-                "new_name": None,
-                "source_file": self.current_file,
-                "timestamp": datetime.datetime.utcnow().isoformat()
-            })
-
-        elif line.startswith("delete "):
-            entry = line.split("delete ", 1)[1].strip()
-            current_dict = self._get_nested_dict()
-            current_dict.pop(entry, None)
-            self.change_log.append({
-                "action": "delete",
-                "object_type": self.stack[-1] if self.stack else "global",
-                "object_name": entry,
-                "new_name": None,
-                "source_file": self.current_file,
-                "timestamp": datetime.datetime.utcnow().isoformat()
-            })
-
-        elif line.startswith("rename "):
-            parts = line.split()
-            if len(parts) == 3:
-                old, new = parts[1], parts[2]
-                current_dict = self._get_nested_dict()
-                if old in current_dict:
-                    current_dict[new] = current_dict.pop(old)
-                    self.change_log.append({
-                        "action": "rename",
-                        "object_type": self.stack[-1] if self.stack else "global",
-                        "object_name": old,
-                        "new_name": new,
-                        "source_file": self.current_file,
-                        "timestamp": datetime.datetime.utcnow().isoformat()
-                    })
+    def _dispatch_line(self, line):
+        keyword, _, rest = line.partition(" ")
+        handler = self._dispatch.get(keyword)
+        if handler is not None:
+            handler(rest)
 
     def parse_config(self, lines):
-        for line in lines:
-            self.parse_line(line)
+        if self.run_timestamp is None:
+            self._start_run()
+        parse_line = self.parse_line
+        with paused_gc():
+            for line in lines:
+                parse_line(line)
+            return self._finish()
+
+    def _finish(self):
+        if self._pending is not None:
+            # Quote never closed: keep what was read
+            line = "\n".join(self._pending)
+            self._pending = None
+            self._dispatch_line(line)
+        if self.hash_subtrees:
+            # Blocks left open by a truncated file, then the root
+            for node in reversed(self.cursor):
+                subtree_digest(node, self.digests)
         return self.config
 
+    def root_digest(self):
+        return lookup_digest(self.config, self.digests).hex()
+
     def parse_from_file(self, filepath):
+        # filepath may be gzip, bz2, xz or zstd compressed (config_sources)
         self.current_file = filepath.split('/')[-1]
-        with open(filepath, 'r') as f:
-            lines = f.readlines()
+        self._start_run()
+        # Lines are parsed as they are read, never held as a list
+        with open_config(filepath) as f:
+            return self.parse_config(f)
+
+    def parse_stream(self, lines, name=""):
+        # Parses any iterable of lines (an open text file, an archive member
+        # from config_sources.iter_archive) as it is read
+        self.current_file = name.split('/')[-1]
+        self._start_run()
         return self.parse_config(lines)
 
+    def parse_mmap(self, filepath):
+        # Same result as parse_from_file(), but the file is memory-mapped and
+        # decoded a chunk of whole lines at a time instead of line by line
+        # through a text file, which is faster on large backups
+        if compression_of(filepath):
+            # A compressed file cannot be mapped; it is decompressed as a stream
+            with open_config(filepath) as f:
+                return self.parse_stream(f, filepath)
+        self.current_file = filepath.split('/')[-1]
+        self._start_run()
+        with open(filepath, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer, paused_gc():
+                    self._parse_buffer(buffer)
+        return self._finish()
+
+    def _parse_buffer(self, buffer, chunk_size=MMAP_CHUNK_SIZE):
+        # The map is read a chunk of whole lines at a time (the partial last
+        # line waits for the next chunk) and each chunk is decoded in one
+        # call, which is cheaper than decoding values one by one
+        parse_line = self.parse_line
+        tail = b""
+        while True:
+            chunk = buffer.read(chunk_size)
+            if not chunk:
+                break
+            end = chunk.rfind(b"\n") + 1
+            if not end:
+                tail += chunk
+                continue
+            lines = (tail + chunk[:end]).decode().split("\n")
+            lines.pop()
+            for line in lines:
+                parse_line(line)
+            tail = chunk[end:]
+        if tail:
+            parse_line(tail.decode())
+
+    def iter_sections(self, filepath):
+        # Streams the file line by line and yields (section_name, section_dict)
+        # as soon as each top-level "config ... end" block is closed, so only
+        # one block is held in memory at a time.
+        with open_config(filepath) as f:
+            yield from self.iter_stream_sections(f, filepath)
+
+    def iter_stream_sections(self, lines, name=""):
+        # iter_sections() over any iterable of lines, as for parse_stream()
+        self.current_file = name.split('/')[-1]
+        self._reset()
+        self._start_run()
+        for line in lines:
+            self.parse_line(line)
+            if not self.stack and self.config:
+                for section, data in self.config.items():
+                    yield section, data
+                self._reset()
+        # End of input: a quoted value left open and a truncated last section
+        # are kept, as parse_config() keeps them
+        self._finish()
+        if self.config:
+            yield from self.config.items()
+            self._reset()
+
+    def parse_compact(self, filepath):
+        # Same content as parse_from_file() as a compact_config.CompactConfig
+        # (interned keys, slotted records), built one section at a time so
+        # the full dict tree never exists
+        from compact_config import CompactConfig
+        return CompactConfig.from_sections(self.iter_sections(filepath))
+
+    def index_file(self, filepath, persist=False):
+        # One scan for the offset and length of every top-level block (see
+        # section_index), reused from <file>.idx.json when that is current
+        # and written there with persist. section() then parses only the
+        # blocks it is asked for.
+        from section_index import load_index
+        if compression_of(filepath):
+            raise ValueError(f"A compressed config cannot be indexed by offset: {filepath}")
+        self.current_file = filepath.split('/')[-1]
+        self.section_index = load_index(filepath, persist)
+        self._indexed_file = filepath
+        self._sections = {}
+        return self.section_index
+
+    def section(self, name, default=None):
+        # One top-level section of the indexed file, as parse_from_file()
+        # would have returned it, parsed on first access and then cached
+        if name in self._sections:
+            return self._sections[name]
+        if self._indexed_file is None:
+            raise ValueError("section() needs index_file() first")
+        blocks = self.section_index.get(name)
+        if not blocks:
+            return default
+        from section_index import read_blocks
+        data = FortiGateConfigParser().parse_config(read_blocks(self._indexed_file, blocks)).get(name)
+        self._sections[name] = data
+        return data
+
+    def lazy_config(self, filepath, persist=False):
+        # A Mapping of section name -> dict that parses sections on access,
+        # for code that reads a few sections of a large file. Compressed
+        # files cannot be read by offset and are parsed in full instead.
+        if compression_of(filepath):
+            return self.parse_from_file(filepath)
+        from section_index import LazyConfig
+        self.index_file(filepath, persist)
+        return LazyConfig(self)
+
+    def vdom_units(self, filepath, persist=False):
+        # {unit: [[offset, length], ...]} for a multi-VDOM config: the inside
+        # of "config global" under GLOBAL_VDOM and of each "edit <vdom>" of
+        # "config vdom" under its name, each parseable on its own (see
+        # vdom_ingest). Empty for a config without VDOMs.
+        index = self.index_file(filepath, persist)
+        if "vdom" not in index and "global" not in index:
+            return {}
+        from section_index import build_units
+        return build_units(filepath, index)
+
+    def _iter_tagged_lines(self, f):
+        # Yields (top_level_section, stripped_line) without building any dict;
+        # lines outside a top-level config block are tagged with None.
+        section = None
+        depth = 0
+        quoted = False
+        for line in f:
+            if quoted:
+                # Inside a multi-line quoted value: no keywords here
+                line = line.rstrip("\r\n")
+                quoted = not ('"' in line and odd_quotes(line))
+                yield section, line
+                continue
+            line = line.strip()
+            if not line or line[0] == "#":
+                continue
+            if '"' in line and odd_quotes(line):
+                quoted = True
+                yield section, line
+                continue
+            keyword, _, rest = line.partition(" ")
+            if keyword == "config" or keyword == "edit":
+                if depth == 0 and keyword == "config":
+                    section = rest.strip()
+                depth += 1
+                yield section, line
+            elif keyword == "next" or keyword == "end":
+                yield section, line
+                if depth:
+                    depth -= 1
+                if depth == 0:
+                    section = None
+            else:
+                yield section, line
+
+    def section_digests(self, filepath):
+        hashers = {}
+        with open_config(filepath) as f:
+            for section, line in self._iter_tagged_lines(f):
+                if section is None:
+                    continue
+                hasher = hashers.get(section)
+                if hasher is None:
+                    hasher = hashers[section] = hashlib.sha256()
+                hasher.update(line.encode())
+                hasher.update(b"\n")
+        return {section: hasher.hexdigest() for section, hasher in hashers.items()}
+
+    def parse_sections(self, filepath, sections):
+        # Parses only the named top-level sections and skips the rest.
+        self.current_file = filepath.split('/')[-1]
+        self._reset()
+        self._start_run()
+        sections = set(sections)
+        with open_config(filepath) as f:
+            for section, line in self._iter_tagged_lines(f):
+                if section in sections:
+                    self.parse_line(line)
+        return self._finish()
+
+
+def file_digest(filepath, chunk_size=1024 * 1024):
+    hasher = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
 
 if __name__ == "__main__":
     import sys
@@ -162,5 +511,5 @@ if __name__ == "__main__":
         print("Usage: python fortigate_config_parser.py <config_file_path>")
     else:
         parser = FortiGateConfigParser()
-        config = parser.parse_from_file(sys.argv[1])
+        config = parser.lazy_config(sys.argv[1])
         print(json.dumps(config.get("system dhcp server", {}), indent=2))
@@ -0,0 +1,166 @@
+import ipaddress
+from bisect import bisect_right
+
+# Range bounds are stored in SQLite as fixed-width hex so IPv6 fits (SQLite
+# integers are 64-bit) and text order equals numeric order for the B-tree.
+KEY_WIDTH = 32
+
+
+def to_key(number):
+    return format(number, f"0{KEY_WIDTH}x")
+
+
+def from_key(key):
+    return int(key, 16)
+
+
+def parse_ip_range(value, end_value=None):
+    # Returns (version, start, end) as integers for "a.b.c.d m.m.m.m",
+    # "a.b.c.d/len", an IPv6 prefix, a single address, or a start/end pair
+    # (iprange objects); None if the value is not an address.
+    if not value:
+        return None
+    try:
+        if end_value:
+            start = ipaddress.ip_address(value.strip())
+            end = ipaddress.ip_address(end_value.strip())
+            if start.version != end.version:
+                return None
+            return start.version, int(start), int(end)
+        parts = value.split()
+        network = ipaddress.ip_network("/".join(parts[:2]), strict=False)
+    except ValueError:
+        return None
+    return network.version, int(network.network_address), int(network.broadcast_address)
+
+
+def ip_range_columns(value, end_value=None, prefix=""):
+    # Column values for the numeric bounds of an address, all None if unparsable
+    bounds = parse_ip_range(value, end_value)
+    if bounds is None:
+        return {f"{prefix}ip_version": None, f"{prefix}range_start": None, f"{prefix}range_end": None}
+    version, start, end = bounds
+    return {f"{prefix}ip_version": version, f"{prefix}range_start": to_key(start), f"{prefix}range_end": to_key(end)}
+
+
+def interface_range(value):
+    # An interface "ip" describes its connected subnet; 0.0.0.0 0.0.0.0 means unset
+    bounds = parse_ip_range(value)
+    if bounds is None or bounds[1] == 0 and bounds[2] in ((1 << 32) - 1, (1 << 128) - 1):
+        return None
+    return bounds
+
+
+class IntervalIndex:
+    # Static interval tree: intervals sorted by start, with an implicit
+    # balanced tree over the array whose nodes store the maximum end of their
+    # subtree. Point and range queries cost O(log n + k).
+    def __init__(self, intervals):
+        intervals = sorted(intervals, key=lambda item: (item[0], item[1]))
+        self.starts = [item[0] for item in intervals]
+        self.ends = [item[1] for item in intervals]
+        self.values = [item[2] for item in intervals]
+        self.max_end = list(self.ends)
+        self._build(0, len(intervals))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _build(self, lo, hi):
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        best = self.ends[mid]
+        for child in (self._build(lo, mid), self._build(mid + 1, hi)):
+            if child is not None and child > best:
+                best = child
+        self.max_end[mid] = best
+        return best
+
+    def overlapping(self, start, end):
+        # Intervals sharing at least one address with [start, end]
+        return self._search(end, start)
+
+    def containing(self, start, end=None):
+        # Intervals that fully contain [start, end] (a single point by default)
+        return self._search(start, start if end is None else end)
+
+    def _search(self, max_start, min_end):
+        # Intervals with start <= max_start and end >= min_end. Subtrees whose
+        # max_end is below min_end are pruned, and right subtrees are skipped
+        # once the node start passes max_start (starts are sorted).
+        found = []
+        todo = [(0, len(self.starts))]
+        while todo:
+            lo, hi = todo.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self.max_end[mid] < min_end:
+                continue
+            todo.append((lo, mid))
+            if self.starts[mid] > max_start:
+                continue
+            if self.ends[mid] >= min_end:
+                found.append(self.values[mid])
+            todo.append((mid + 1, hi))
+        return found
+
+    def within(self, start, end):
+        # Intervals fully inside [start, end]
+        found = []
+        lo = bisect_right(self.starts, start - 1)
+        hi = bisect_right(self.starts, end)
+        for i in range(lo, hi):
+            if self.ends[i] <= end:
+                found.append(self.values[i])
+        return found
+
+
+class AddressIndex:
+    # Per-IP-version interval indexes over address objects and interface subnets
+    def __init__(self, entries):
+        # entries: iterable of (version, start, end, value)
+        by_version = {4: [], 6: []}
+        for version, start, end, value in entries:
+            by_version[version].append((start, end, value))
+        self.indexes = {version: IntervalIndex(items) for version, items in by_version.items()}
+
+    @classmethod
+    def from_config(cls, config_dict):
+        entries = []
+        for name, values in config_dict.get("firewall address", {}).items():
+            bounds = parse_ip_range(values.get("subnet"))
+            if bounds is None:
+                bounds = parse_ip_range(values.get("start-ip"), values.get("end-ip"))
+            if bounds is not None:
+                entries.append((*bounds, ("firewall address", name)))
+        for name, values in config_dict.get("firewall address6", {}).items():
+            bounds = parse_ip_range(values.get("ip6"))
+            if bounds is not None:
+                entries.append((*bounds, ("firewall address6", name)))
+        for name, values in config_dict.get("system interface", {}).items():
+            ipv6 = values.get("ipv6")
+            for value in (values.get("ip"), ipv6.get("ip6-address") if isinstance(ipv6, dict) else None):
+                bounds = interface_range(value)
+                if bounds is not None:
+                    entries.append((*bounds, ("system interface", name)))
+        return cls(entries)
+
+    def _query(self, text, method):
+        bounds = parse_ip_range(text)
+        if bounds is None:
+            raise ValueError(f"Not an IP address or network: {text!r}")
+        version, start, end = bounds
+        return getattr(self.indexes[version], method)(start, end)
+
+    def containing(self, text):
+        # Objects that contain the whole address/network
+        return self._query(text, "containing")
+
+    def overlapping(self, text):
+        return self._query(text, "overlapping")
+
+    def within(self, text):
+        # Objects that lie entirely inside the network
+        return self._query(text, "within")
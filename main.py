@@ -1,62 +1,160 @@
-import sys
+import argparse
 import os
 import json
-from database_handler import FortiGateDatabaseHandler
-from fortigate_parser import FortiGateConfigParser
+from fortigate_parser import FortiGateConfigParser, file_digest
 
 
-def main(local_file_path, source_file_path):
-    print(f"[INFO] Loading config from: {local_file_path}")
+def debug_sections(sections):
+    print("[DEBUG] Parsed Configuration:")
+    for section, data in sections:
+        print(json.dumps({section: data}, indent=2))
+        yield section, data
 
-    # === Step 1: Parse configuration ===
-    parser = FortiGateConfigParser()
-    parsed_config = parser.parse_from_file(local_file_path)
 
-    # Debug output
-    print("[DEBUG] Parsed Configuration:")
-    print(json.dumps(parsed_config, indent=2))
+def load_changed_sections(db, parser, local_file_path, source_file, local_file, device_name, tap):
+    from database_handler import FILE_DIGEST_KEY
+
+    # The digests describe one snapshot of this device, the only one that
+    # unchanged sections can be copied from
+    digest = file_digest(local_file_path)
+    cached_snapshot_id, cached = db.get_ingest_digests(device_name, source_file)
+    if cached.get(FILE_DIGEST_KEY) == digest and cached_snapshot_id == db.latest_snapshot_id(device_name):
+        print(f"[INFO] {source_file} is unchanged since the last load, skipping")
+        return
+
+    digests = parser.section_digests(local_file_path)
+    changed = [section for section, section_digest in digests.items() if cached.get(section) != section_digest]
+    removed = [section for section in cached if section != FILE_DIGEST_KEY and section not in digests]
+    print(f"[INFO] {len(changed)} changed and {len(removed)} removed sections out of {len(digests)}")
+
+    parsed_config = parser.parse_sections(local_file_path, changed)
+    digests[FILE_DIGEST_KEY] = digest
+
+    # The new snapshot starts as a copy of the cached one; only changed
+    # sections are replaced. All of it is one transaction, so a failed load
+    # leaves neither a partial snapshot nor digests describing one.
+    try:
+        with db.engine.begin() as conn:
+            db.begin_snapshot(device_name, source_file, local_file, conn=conn)
+            if cached_snapshot_id:
+                db.clone_snapshot(cached_snapshot_id, conn=conn)
+            for section, data in tap(parsed_config.items()):
+                db.save_section(section, data, source_file, local_file, conn=conn)
+            for section in removed:
+                db.save_section(section, {}, source_file, local_file, conn=conn)
+            db.store_ingest_digests(source_file, digests, conn=conn)
+    except Exception:
+        db.device_name = db.snapshot_id = None
+        raise
+
+
+def load_sections(db, sections, source_file, local_file, device_name, sync):
+    # Differential or full reload of one config's sections
+    if sync:
+        counts = db.sync(sections, source_file, local_file, device_name=device_name)
+        for table, changes in counts.items():
+            if any(changes.values()):
+                print(f"[INFO] {table}: {changes['inserted']} inserted, "
+                      f"{changes['updated']} updated, {changes['deleted']} deleted")
+    else:
+        counts = db.bulk_load(sections, source_file, local_file, device_name=device_name)
+        print(f"[INFO] Loaded {sum(counts.values())} rows into {len(counts)} tables")
 
-    # === Step 2: Prepare file metadata ===
-    source_file = os.path.basename(source_file_path)
+
+def main(local_file_path, source_file_path=None, sync=False, incremental=False, device_name=None,
+         debug=False, export_format=None, export_path=None):
+    from config_sources import is_archive, iter_archive, strip_compression
+    print(f"[INFO] Loading config from: {local_file_path}")
+
+    # === Step 1: Prepare file metadata ===
+    # The file may be compressed (gzip, bz2, xz, zstd) or a tar archive of
+    # configs; both are read as streams, nothing is decompressed to disk
+    archive = is_archive(local_file_path)
+    source_file = os.path.basename(strip_compression(source_file_path or local_file_path))
     local_file = local_file_path
+    device_name = device_name or source_file
 
-    # === Step 3: Initialize DB handler ===
+    # === Step 2: Initialize DB handler (SQLAlchemy is only imported here) ===
+    from database_handler import FortiGateDatabaseHandler
     db = FortiGateDatabaseHandler()
 
-    # === Step 4: Save core configuration blocks ===
-    db.save_system_global(parsed_config)
-    db.save_system_interface(parsed_config)
-    db.save_firewall_address(parsed_config)
-    db.save_firewall_addrgrp(parsed_config)
-    db.save_firewall_policies(parsed_config)
-    db.save_user_local(parsed_config)
-    db.save_dhcp_servers(parsed_config)
-    db.save_vpn_phase1_interfaces(parsed_config)
-    db.save_vpn_phase2_interfaces(parsed_config)
-
-    # === Step 5: Save config blocks with file tracking ===
-    db.save_firewall_service_custom(parsed_config, source_file, local_file)
-    db.save_router_static(parsed_config, source_file, local_file)
-    db.save_system_admin(parsed_config, source_file, local_file)
-    db.save_firewall_schedule_recurring(parsed_config, source_file, local_file)
-    db.save_firewall_vip(parsed_config, source_file, local_file)
-
-    # === Step 6: Save change log with tracking ===
-    for change in parser.change_log:
-        change["source_file"] = source_file
-        change["local_file"] = local_file
-    db.save_config_changes(parser.change_log)
-
-    # === Step 7: Output confirmation ===
-    db.print_all_data()
+    # === Step 3: Parse and load (incremental, differential or full reload) ===
+    # Sections stream through the optional debug dump and exporter on their
+    # way to the database, one block at a time
+    exporter = None
+    if export_format:
+        from exporters import export_sections, open_exporter
+        exporter = open_exporter(export_format, export_path)
+
+    def tap(sections):
+        if debug:
+            sections = debug_sections(sections)
+        if exporter is not None:
+            sections = export_sections(exporter, sections)
+        return sections
+
+    parser = FortiGateConfigParser()
+    if archive:
+        # One snapshot per config in the archive, named after its member and
+        # parsed while the archive is read
+        members = 0
+        for member, lines in iter_archive(local_file_path):
+            source_file = os.path.basename(strip_compression(member))
+            local_file = f"{local_file_path}:{member}"
+            print(f"[INFO] Loading {member}")
+            sections = tap(parser.iter_stream_sections(lines, member))
+            load_sections(db, sections, source_file, local_file, source_file, sync)
+            db.save_config_changes(parser.change_log, source_file, local_file, parser.run_timestamp)
+            members += 1
+        print(f"[INFO] Loaded {members} configs from the archive")
+    else:
+        if incremental:
+            load_changed_sections(db, parser, local_file_path, source_file, local_file, device_name, tap)
+        else:
+            sections = tap(parser.iter_sections(local_file_path))
+            load_sections(db, sections, source_file, local_file, device_name, sync)
+
+        # === Step 4: Save change log with tracking ===
+        db.save_config_changes(parser.change_log, source_file, local_file, parser.run_timestamp)
+
+    if exporter is not None:
+        exporter.close()
+        print(f"[INFO] Exported parsed sections to {export_path}")
+
+    # === Step 5: Output confirmation ===
+    if debug:
+        db.print_all_data()
     print("[INFO] Configuration saved to database.")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("Usage: python main.py <path_to_local_fortigate_config> <path_to_source_fortigate_config>")
-        sys.exit(1)
+    arg_parser = argparse.ArgumentParser(description="Parse a FortiGate config and save it to SQLite")
+    arg_parser.add_argument("local_file_path",
+                            help="path to the local FortiGate config: plain, compressed "
+                                 "(.gz, .bz2, .xz, .zst) or a tar archive of configs")
+    arg_parser.add_argument("source_file_path", nargs="?",
+                            help="path/name of the source FortiGate config (default: the local file name; "
+                                 "archive members are named after themselves)")
+    arg_parser.add_argument("--sync", action="store_true",
+                            help="only insert/update/delete rows that changed instead of reloading every table")
+    arg_parser.add_argument("--incremental", action="store_true",
+                            help="skip unchanged files and reload only sections whose digest changed")
+    arg_parser.add_argument("--device", help="device the snapshot belongs to (default: source file name)")
+    arg_parser.add_argument("--debug", action="store_true",
+                            help="print every parsed section as JSON and dump all tables after loading")
+    arg_parser.add_argument("--export", choices=["ndjson", "parquet", "xlsx"],
+                            help="also stream the parsed sections to this format")
+    arg_parser.add_argument("--export-path", help="output file (ndjson/xlsx) or directory (parquet)")
+    args = arg_parser.parse_args()
+    if args.export and not args.export_path:
+        arg_parser.error("--export requires --export-path")
+    from config_sources import is_archive
+    if is_archive(args.local_file_path):
+        # Digests need a second pass over each config; archive members are read once
+        if args.incremental:
+            arg_parser.error("--incremental cannot be used with an archive, use --sync")
+        if args.device:
+            arg_parser.error("--device cannot be used with an archive (each member is its own device)")
 
-    local_file_path = sys.argv[1]
-    source_file_path = sys.argv[2]
-    main(local_file_path, source_file_path)
+    main(args.local_file_path, args.source_file_path, sync=args.sync, incremental=args.incremental,
+         device_name=args.device, debug=args.debug, export_format=args.export, export_path=args.export_path)
@@ -0,0 +1,412 @@
+import argparse
+import csv
+import ipaddress
+import time
+from bisect import bisect_right
+from collections.abc import Mapping
+from address_resolver import AddressGroupResolver
+from fortigate_parser import FortiGateConfigParser
+from ip_index import parse_ip_range
+
+try:
+    import numpy as np
+except ImportError:  # optional, only needed by match_arrays() / --numpy
+    np = None
+
+PROTOCOLS = {"tcp": 6, "udp": 17, "sctp": 132, "icmp": 1, "icmp6": 58}
+PORTRANGE_KEYS = (("tcp-portrange", 6), ("udp-portrange", 17), ("sctp-portrange", 132))
+
+# Predefined services that policies reference but that a saved config does not
+# always list under "firewall service custom"; entries in the config win.
+PREDEFINED_SERVICES = {
+    "ALL": {"protocol": "IP", "protocol-number": "0"},
+    "ALL_TCP": {"tcp-portrange": "1-65535"},
+    "ALL_UDP": {"udp-portrange": "1-65535"},
+    "ALL_ICMP": {"protocol": "ICMP"},
+    "ALL_ICMP6": {"protocol": "ICMP6"},
+    "PING": {"protocol": "ICMP"},
+    "HTTP": {"tcp-portrange": "80"},
+    "HTTPS": {"tcp-portrange": "443"},
+    "SSH": {"tcp-portrange": "22"},
+    "TELNET": {"tcp-portrange": "23"},
+    "FTP": {"tcp-portrange": "21"},
+    "SMTP": {"tcp-portrange": "25"},
+    "SMTPS": {"tcp-portrange": "465"},
+    "DNS": {"tcp-portrange": "53", "udp-portrange": "53"},
+    "NTP": {"tcp-portrange": "123", "udp-portrange": "123"},
+    "SNMP": {"tcp-portrange": "161-162", "udp-portrange": "161-162"},
+    "RDP": {"tcp-portrange": "3389"},
+    "SAMBA": {"tcp-portrange": "139"},
+    "SMB": {"tcp-portrange": "445"},
+}
+
+# Predefined addresses; a config entry of the same name wins only if it
+# resolves to a range (a saved "all" is often listed without a subnet)
+PREDEFINED_ADDRESSES = {
+    "all": "0.0.0.0 0.0.0.0",
+    "all6": "::/0",
+}
+
+FULL_PORTS = (0, 65535)
+
+
+def _names(value):
+    # value as parsed (list, str) or from a compact_config tree (tuple, Table)
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, Mapping)):
+        return list(value)
+    return value.split()
+
+
+def _merge(intervals):
+    # Sorted, non-overlapping (starts, ends) lists for bisect lookups
+    starts, ends = [], []
+    for start, end in sorted(intervals):
+        if ends and start <= ends[-1] + 1:
+            if end > ends[-1]:
+                ends[-1] = end
+        else:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
+
+
+def _in_ranges(ranges, value):
+    starts, ends = ranges
+    i = bisect_right(starts, value) - 1
+    return i >= 0 and ends[i] >= value
+
+
+def parse_portrange(value):
+    # "80 443 8000-8080:1024-65535" -> [(80, 80), (443, 443), (8000, 8080)].
+    # The optional ":src" part restricts source ports, which flows here do not
+    # carry, so it is ignored.
+    ranges = []
+    for token in _names(value):
+        dst = token.split(":", 1)[0]
+        low, _, high = dst.partition("-")
+        try:
+            ranges.append((int(low), int(high or low)))
+        except ValueError:
+            continue
+    return ranges
+
+
+def service_ranges(values):
+    # Protocol number (None = any protocol) -> list of destination port ranges
+    protocol = (values.get("protocol") or "TCP/UDP/SCTP").upper()
+    if protocol == "IP":
+        number = int(values.get("protocol-number") or 0)
+        return {None if number == 0 else number: [FULL_PORTS]}
+    if protocol in ("ICMP", "ICMP6"):
+        return {PROTOCOLS[protocol.lower()]: [FULL_PORTS]}
+    ranges = {}
+    for key, number in PORTRANGE_KEYS:
+        ports = parse_portrange(values.get(key))
+        if ports:
+            ranges[number] = ports
+    return ranges
+
+
+def parse_protocol(value):
+    value = str(value).strip().lower()
+    return PROTOCOLS[value] if value in PROTOCOLS else int(value)
+
+
+def parse_ip(value):
+    address = ipaddress.ip_address(value.strip() if isinstance(value, str) else value)
+    return address.version, int(address)
+
+
+class CompiledPolicy:
+    # One policy reduced to interface sets (None = any), merged numeric
+    # address ranges per IP version and merged port ranges per protocol
+    def __init__(self, policy_id, name, action, srcintf, dstintf, src, dst, services,
+                 src_negate=False, dst_negate=False, service_negate=False):
+        self.policy_id = policy_id
+        self.name = name
+        self.action = action
+        self.srcintf = srcintf
+        self.dstintf = dstintf
+        self.src = src
+        self.dst = dst
+        self.services = services
+        self.src_negate = src_negate
+        self.dst_negate = dst_negate
+        self.service_negate = service_negate
+
+    def _address_match(self, ranges, version, ip, negate):
+        found = version in ranges and _in_ranges(ranges[version], ip)
+        return found != negate
+
+    def _service_match(self, protocol, port):
+        found = None in self.services or (
+            protocol in self.services and _in_ranges(self.services[protocol], port)
+        )
+        return found != self.service_negate
+
+    def matches(self, src_version, src, dst_version, dst, protocol, port):
+        return (
+            self._address_match(self.src, src_version, src, self.src_negate)
+            and self._address_match(self.dst, dst_version, dst, self.dst_negate)
+            and self._service_match(protocol, port)
+        )
+
+
+class PolicyEngine:
+    # First-match evaluation of "firewall policy" in configured order. Groups
+    # are flattened and every address/service becomes numeric ranges once at
+    # compile time; per interface pair the candidate policy list is cached.
+    def __init__(self, policies):
+        self.policies = policies
+        self._candidates = {}
+
+    @classmethod
+    def from_config(cls, config_dict):
+        addresses = {name: parse_ip_range(value) for name, value in PREDEFINED_ADDRESSES.items()}
+
+        def add_address(name, bounds):
+            if bounds is not None or name not in PREDEFINED_ADDRESSES:
+                addresses[name] = bounds
+
+        for name, values in config_dict.get("firewall address", {}).items():
+            bounds = parse_ip_range(values.get("subnet"))
+            if bounds is None:
+                bounds = parse_ip_range(values.get("start-ip"), values.get("end-ip"))
+            add_address(name, bounds)
+        for name, values in config_dict.get("firewall address6", {}).items():
+            add_address(name, parse_ip_range(values.get("ip6")))
+
+        address_groups = {}
+        for section in ("firewall addrgrp", "firewall addrgrp6"):
+            for name, values in config_dict.get(section, {}).items():
+                address_groups[name] = _names(values.get("member"))
+        address_resolver = AddressGroupResolver(address_groups)
+
+        services = dict(PREDEFINED_SERVICES)
+        services.update(config_dict.get("firewall service custom", {}))
+        service_groups = {
+            name: _names(values.get("member"))
+            for name, values in config_dict.get("firewall service group", {}).items()
+        }
+        service_resolver = AddressGroupResolver(service_groups)
+
+        zones = {
+            name: _names(values.get("interface"))
+            for name, values in config_dict.get("system zone", {}).items()
+        }
+
+        def interfaces(value):
+            names = set()
+            for name in _names(value):
+                if name == "any":
+                    return None
+                names.update(zones.get(name, (name,)))
+            return frozenset(names)
+
+        def address_ranges(*values):
+            by_version = {}
+            for value in values:
+                for leaf in address_resolver.expand(_names(value)):
+                    bounds = addresses.get(leaf)
+                    # FQDN, geography and unknown objects have no static range
+                    if bounds is not None:
+                        by_version.setdefault(bounds[0], []).append(bounds[1:])
+            return {version: _merge(ranges) for version, ranges in by_version.items()}
+
+        def port_ranges(value):
+            by_protocol = {}
+            for leaf in service_resolver.expand(_names(value)):
+                for protocol, ports in service_ranges(services.get(leaf, {})).items():
+                    by_protocol.setdefault(protocol, []).extend(ports)
+            return {protocol: _merge(ports) for protocol, ports in by_protocol.items()}
+
+        compiled = []
+        for policy_id, values in config_dict.get("firewall policy", {}).items():
+            if values.get("status") == "disable":
+                continue
+            compiled.append(CompiledPolicy(
+                int(policy_id),
+                values.get("name"),
+                values.get("action", "deny"),
+                interfaces(values.get("srcintf")),
+                interfaces(values.get("dstintf")),
+                address_ranges(values.get("srcaddr"), values.get("srcaddr6")),
+                address_ranges(values.get("dstaddr"), values.get("dstaddr6")),
+                port_ranges(values.get("service")),
+                values.get("srcaddr-negate") == "enable",
+                values.get("dstaddr-negate") == "enable",
+                values.get("service-negate") == "enable",
+            ))
+        return cls(compiled)
+
+    def candidates(self, srcintf, dstintf):
+        key = (srcintf, dstintf)
+        found = self._candidates.get(key)
+        if found is None:
+            found = self._candidates[key] = [
+                policy for policy in self.policies
+                if (policy.srcintf is None or srcintf in policy.srcintf)
+                and (policy.dstintf is None or dstintf in policy.dstintf)
+            ]
+        return found
+
+    def match(self, srcintf, dstintf, src, dst, protocol, port):
+        # The first matching CompiledPolicy, or None for the implicit deny
+        src_version, src = parse_ip(src)
+        dst_version, dst = parse_ip(dst)
+        protocol = parse_protocol(protocol)
+        port = int(port)
+        for policy in self.candidates(srcintf, dstintf):
+            if policy.matches(src_version, src, dst_version, dst, protocol, port):
+                return policy
+        return None
+
+    def match_many(self, flows):
+        # flows: iterable of (srcintf, dstintf, src, dst, protocol, port);
+        # yields the matching policy id or None
+        for flow in flows:
+            policy = self.match(*flow)
+            yield None if policy is None else policy.policy_id
+
+    def match_arrays(self, srcintf, dstintf, src, dst, protocol, port):
+        # Vectorized batch over NumPy arrays: interface names, IPv4 addresses
+        # as integers, protocol numbers and ports. Flows are grouped by
+        # interface pair so each group is only tested against its candidate
+        # policies, and each policy only against flows still unmatched.
+        # Returns policy ids, -1 for the implicit deny.
+        if np is None:
+            raise RuntimeError("match_arrays() requires numpy")
+        src = np.asarray(src, dtype=np.int64)
+        dst = np.asarray(dst, dtype=np.int64)
+        protocol = np.asarray(protocol, dtype=np.int64)
+        port = np.asarray(port, dtype=np.int64)
+        result = np.full(len(src), -1, dtype=np.int64)
+
+        src_names, src_codes = np.unique(np.asarray(srcintf), return_inverse=True)
+        dst_names, dst_codes = np.unique(np.asarray(dstintf), return_inverse=True)
+        pair_codes = src_codes.reshape(-1) * len(dst_names) + dst_codes.reshape(-1)
+        order = np.argsort(pair_codes, kind="stable")
+        pairs, group_starts = np.unique(pair_codes[order], return_index=True)
+        group_ends = list(group_starts[1:]) + [len(order)]
+
+        for pair, start, end in zip(pairs.tolist(), group_starts.tolist(), group_ends):
+            pending = order[start:end]
+            pair_src, pair_dst = divmod(pair, len(dst_names))
+            for policy in self.candidates(str(src_names[pair_src]), str(dst_names[pair_dst])):
+                if not len(pending):
+                    break
+                mask = (
+                    _array_address_match(policy.src, src[pending], policy.src_negate)
+                    & _array_address_match(policy.dst, dst[pending], policy.dst_negate)
+                    & _array_service_match(policy, protocol[pending], port[pending])
+                )
+                result[pending[mask]] = policy.policy_id
+                pending = pending[~mask]
+        return result
+
+
+def _array_in_ranges(ranges, values):
+    starts = np.asarray(ranges[0], dtype=np.int64)
+    ends = np.asarray(ranges[1], dtype=np.int64)
+    i = np.searchsorted(starts, values, side="right") - 1
+    return (i >= 0) & (ends[np.maximum(i, 0)] >= values)
+
+
+def _array_address_match(ranges, values, negate):
+    found = _array_in_ranges(ranges[4], values) if 4 in ranges else np.zeros(len(values), dtype=bool)
+    return ~found if negate else found
+
+
+def _array_service_match(policy, protocol, port):
+    if None in policy.services:
+        found = np.ones(len(port), dtype=bool)
+    else:
+        found = np.zeros(len(port), dtype=bool)
+        for number, ranges in policy.services.items():
+            selected = protocol == number
+            if selected.any():
+                found |= selected & _array_in_ranges(ranges, port)
+    return ~found if policy.service_negate else found
+
+
+def read_flows_csv(path):
+    # Columns: srcintf,dstintf,src,dst,protocol,port (header row required)
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            yield row["srcintf"], row["dstintf"], row["src"], row["dst"], row["protocol"], row["port"]
+
+
+def evaluate_flows(engine, flows, use_numpy=False):
+    # Returns the list of matched policy ids (None = implicit deny) and
+    # prints the throughput
+    flows = list(flows)
+    if use_numpy:
+        start = time.perf_counter()
+        arrays = _flow_arrays(flows)
+        print(f"[INFO] Converted {len(flows)} flows to arrays in {time.perf_counter() - start:.2f}s")
+    start = time.perf_counter()
+    if use_numpy:
+        results = _evaluate_arrays(engine, flows, *arrays)
+    else:
+        results = list(engine.match_many(flows))
+    elapsed = time.perf_counter() - start
+    mode = "numpy" if use_numpy else "python"
+    print(f"[INFO] Matched {len(flows)} flows in {elapsed:.2f}s "
+          f"({len(flows) / elapsed if elapsed else 0:.0f} flows/sec, {mode})")
+    return results
+
+
+def _flow_arrays(flows):
+    # IPv4 flows as column arrays for match_arrays(); IPv6 flows do not fit
+    # in int64 and are returned by position for the per-flow path
+    rows, fallback = [], []
+    columns = ([], [], [], [], [], [])
+    for i, (srcintf, dstintf, src, dst, protocol, port) in enumerate(flows):
+        src_version, src_value = parse_ip(src)
+        dst_version, dst_value = parse_ip(dst)
+        if src_version != 4 or dst_version != 4:
+            fallback.append(i)
+            continue
+        rows.append(i)
+        for column, value in zip(columns, (
+            srcintf, dstintf, src_value, dst_value, parse_protocol(protocol), int(port)
+        )):
+            column.append(value)
+    return rows, fallback, [np.asarray(column) for column in columns]
+
+
+def _evaluate_arrays(engine, flows, rows, fallback, columns):
+    results = [None] * len(flows)
+    if rows:
+        for i, policy_id in zip(rows, engine.match_arrays(*columns).tolist()):
+            results[i] = None if policy_id == -1 else policy_id
+    for i in fallback:
+        policy = engine.match(*flows[i])
+        results[i] = None if policy is None else policy.policy_id
+    return results
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Find the first firewall policy matching each flow")
+    arg_parser.add_argument("config", help="FortiGate .conf file")
+    arg_parser.add_argument("flows", help="CSV with srcintf,dstintf,src,dst,protocol,port columns")
+    arg_parser.add_argument("--output", help="write the flows with a policy_id column to this CSV")
+    arg_parser.add_argument("--numpy", action="store_true", help="vectorized batch evaluation (requires numpy)")
+    args = arg_parser.parse_args()
+
+    engine = PolicyEngine.from_config(FortiGateConfigParser().lazy_config(args.config))
+    print(f"[INFO] Compiled {len(engine.policies)} policies")
+    flows = list(read_flows_csv(args.flows))
+    results = evaluate_flows(engine, flows, use_numpy=args.numpy)
+
+    if args.output:
+        with open(args.output, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["srcintf", "dstintf", "src", "dst", "protocol", "port", "policy_id"])
+            for flow, policy_id in zip(flows, results):
+                writer.writerow([*flow, "" if policy_id is None else policy_id])
+    else:
+        matched = sum(policy_id is not None for policy_id in results)
+        print(f"[INFO] {matched} flows matched a policy, {len(results) - matched} hit the implicit deny")
@@ -0,0 +1,207 @@
+import argparse
+import json
+import sys
+from sqlalchemy import literal, select, tuple_, union_all
+from database_handler import POLICY_LINK_TABLES, FortiGateDatabaseHandler
+from ip_index import parse_ip_range, to_key
+
+# Every method returns an iterator of dicts. Results are fetched from the
+# driver in batches of batch_size rows (yield_per), so memory stays flat no
+# matter how large the table is; nothing is read until the iterator is used.
+DEFAULT_BATCH_SIZE = 1000
+
+
+class QueryAPI:
+    def __init__(self, db=None, batch_size=DEFAULT_BATCH_SIZE):
+        self.db = db or FortiGateDatabaseHandler()
+        self.batch_size = batch_size
+
+    def stream(self, query):
+        # Runs a select and yields its rows one at a time; the connection is
+        # held until the iterator is exhausted or closed
+        with self.db.engine.connect() as conn:
+            result = conn.execution_options(yield_per=self.batch_size).execute(query)
+            for row in result.mappings():
+                yield dict(row)
+
+    def _table(self, table):
+        if isinstance(table, str):
+            return self.db.metadata.tables[table]
+        return table
+
+    def _select(self, table, columns=None):
+        # Column projection: only the named columns are read
+        if columns:
+            return select(*(table.c[column] for column in columns))
+        return select(table)
+
+    def _scope(self, query, table, device_name=None, snapshot_id=None):
+        if device_name is not None and 'device_name' in table.c:
+            query = query.where(table.c.device_name == device_name)
+        if snapshot_id is not None and 'snapshot_id' in table.c:
+            query = query.where(table.c.snapshot_id == snapshot_id)
+        return query
+
+    def _snapshot(self, device_name, snapshot_id):
+        # Device-scoped queries default to the device's latest snapshot
+        if device_name is not None and snapshot_id is None:
+            return self.db.latest_snapshot_id(device_name)
+        return snapshot_id
+
+    def rows(self, table, columns=None, device_name=None, snapshot_id=None):
+        # A whole table (or one device/snapshot of it) in primary key order
+        table = self._table(table)
+        query = self._scope(self._select(table, columns), table, device_name, snapshot_id)
+        return self.stream(query.order_by(*table.primary_key.columns))
+
+    def page(self, table, after=None, limit=DEFAULT_BATCH_SIZE, columns=None, device_name=None, snapshot_id=None):
+        # Keyset pagination: up to `limit` rows whose primary key comes after
+        # `after` (the cursor returned with the previous page). Each page is
+        # an index seek, so page 10,000 costs the same as page 1, unlike
+        # OFFSET. Returns (rows, cursor); cursor is None after the last page.
+        table = self._table(table)
+        key = list(table.primary_key.columns)
+        projected = list(columns or table.c.keys())
+        extra = [column.name for column in key if column.name not in projected]
+        query = self._scope(self._select(table, projected + extra), table, device_name, snapshot_id)
+        if after is not None:
+            query = query.where(tuple_(*key) > tuple_(*after))
+        query = query.order_by(*key).limit(limit)
+        rows = list(self.stream(query))
+        cursor = None
+        if len(rows) == limit:
+            cursor = tuple(rows[-1][column.name] for column in key)
+        for row in rows:
+            for name in extra:
+                del row[name]
+        return rows, cursor
+
+    def pages(self, table, limit=DEFAULT_BATCH_SIZE, columns=None, device_name=None, snapshot_id=None):
+        # Every page of a table, each fetched with its own short query
+        cursor = None
+        while True:
+            rows, cursor = self.page(table, cursor, limit, columns, device_name, snapshot_id)
+            if rows:
+                yield rows
+            if cursor is None:
+                return
+
+    def policies(self, device_name, snapshot_id=None, columns=None):
+        # Policies of one device, its latest snapshot by default, in id order
+        return self.rows(self.db.firewall_policies, columns, device_name, self._snapshot(device_name, snapshot_id))
+
+    def addresses_matching(self, prefix, device_name=None, snapshot_id=None):
+        # An IP prefix ("10.10.0.0/16", "2001:db8::/32") matches the address
+        # objects and interface subnets inside it, through the range indexes;
+        # anything else matches object names starting with it, through the
+        # primary key
+        snapshot_id = self._snapshot(device_name, snapshot_id)
+        bounds = parse_ip_range(prefix)
+        queries = []
+        for table, kind, range_prefix in self.db._range_sources():
+            query = select(
+                table.c.device_name, table.c.snapshot_id, table.c.vdom, literal(kind).label('object_type'), table.c.name,
+                table.c[f"{range_prefix}range_start"].label('range_start'),
+                table.c[f"{range_prefix}range_end"].label('range_end')
+            )
+            if bounds is not None:
+                version, start, end = bounds
+                query = (
+                    query.where(table.c[f"{range_prefix}ip_version"] == version)
+                    .where(table.c[f"{range_prefix}range_start"] >= to_key(start))
+                    .where(table.c[f"{range_prefix}range_start"] <= to_key(end))
+                    .where(table.c[f"{range_prefix}range_end"] <= to_key(end))
+                )
+            elif range_prefix:
+                # Name matches come from the first source of each table only
+                continue
+            else:
+                query = query.where(table.c.name >= prefix).where(table.c.name < prefix + "\U0010ffff")
+            queries.append(self._scope(query, table, device_name, snapshot_id))
+        return self.stream(union_all(*queries))
+
+    def policy_objects(self, device_name=None, snapshot_id=None, **filters):
+        # The README's policy -> interface -> address join, read from the
+        # materialized resolved_policies table. filters narrow it by srcintf,
+        # dstintf, srcaddr, dstaddr or action, each served by an index.
+        resolved = self.db.resolved_policies
+        query = self._scope(select(resolved), resolved, device_name, self._snapshot(device_name, snapshot_id))
+        for column, value in filters.items():
+            if value is not None:
+                query = query.where(resolved.c[column] == value)
+        return self.stream(query)
+
+    def policies_referencing(self, object_name, device_name=None, snapshot_id=None):
+        # Streaming variant of FortiGateDatabaseHandler.policies_referencing
+        refs = self.db._policy_references(object_name, POLICY_LINK_TABLES, device_name, snapshot_id)
+        return self.stream(select(refs))
+
+
+def print_rows(rows, out=sys.stdout):
+    # One JSON object per line, written as the rows arrive
+    count = 0
+    for row in rows:
+        out.write(json.dumps(row))
+        out.write("\n")
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Stream query results from the FortiGate database as NDJSON")
+    arg_parser.add_argument("--db-url", default='sqlite:///fortigate_config.db')
+    arg_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    commands = arg_parser.add_subparsers(dest="command", required=True)
+
+    table_cmd = commands.add_parser("table", help="rows of one table, optionally one page of it")
+    table_cmd.add_argument("table")
+    table_cmd.add_argument("--columns", help="comma-separated column names")
+    table_cmd.add_argument("--device")
+    table_cmd.add_argument("--snapshot", type=int)
+    table_cmd.add_argument("--limit", type=int, help="return one page of this many rows")
+    table_cmd.add_argument("--after", help="page cursor (JSON list) printed by the previous page")
+
+    policies_cmd = commands.add_parser("policies", help="policies of a device")
+    policies_cmd.add_argument("device")
+    policies_cmd.add_argument("--snapshot", type=int)
+    policies_cmd.add_argument("--columns", help="comma-separated column names")
+
+    addresses_cmd = commands.add_parser("addresses", help="addresses inside an IP prefix or with a name prefix")
+    addresses_cmd.add_argument("prefix")
+    addresses_cmd.add_argument("--device")
+    addresses_cmd.add_argument("--snapshot", type=int)
+
+    joins_cmd = commands.add_parser("policy-objects", help="policies joined with their interfaces and addresses")
+    joins_cmd.add_argument("--device")
+    joins_cmd.add_argument("--snapshot", type=int)
+    for column in ("srcintf", "dstintf", "srcaddr", "dstaddr", "action"):
+        joins_cmd.add_argument(f"--{column}")
+
+    refs_cmd = commands.add_parser("references", help="policies referencing an object")
+    refs_cmd.add_argument("object_name")
+    refs_cmd.add_argument("--device")
+    args = arg_parser.parse_args()
+
+    api = QueryAPI(FortiGateDatabaseHandler(args.db_url), args.batch_size)
+    columns = getattr(args, "columns", None)
+    columns = columns.split(",") if columns else None
+    if args.command == "table" and args.limit:
+        after = tuple(json.loads(args.after)) if args.after else None
+        rows, cursor = api.page(args.table, after, args.limit, columns, args.device, args.snapshot)
+        print_rows(rows)
+        if cursor is not None:
+            print(f"[INFO] Next page: --after '{json.dumps(list(cursor))}'", file=sys.stderr)
+    else:
+        if args.command == "table":
+            rows = api.rows(args.table, columns, args.device, args.snapshot)
+        elif args.command == "policies":
+            rows = api.policies(args.device, args.snapshot, columns)
+        elif args.command == "addresses":
+            rows = api.addresses_matching(args.prefix, args.device, args.snapshot)
+        elif args.command == "policy-objects":
+            rows = api.policy_objects(args.device, args.snapshot, srcintf=args.srcintf, dstintf=args.dstintf,
+                                      srcaddr=args.srcaddr, dstaddr=args.dstaddr, action=args.action)
+        else:
+            rows = api.policies_referencing(args.object_name, args.device)
+        count = print_rows(rows)
+        print(f"[INFO] {count} rows", file=sys.stderr)
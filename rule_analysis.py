@@ -0,0 +1,275 @@
+import argparse
+import heapq
+import time
+from bisect import bisect_right
+from fortigate_parser import FortiGateConfigParser
+from ip_index import IntervalIndex
+from policy_engine import PolicyEngine
+
+SHADOWED = "shadowed"                          # covered by an earlier rule with another action
+REDUNDANT = "redundant"                        # covered by an earlier rule with the same action
+REDUNDANT_WITH_LATER = "redundant_with_later"  # a later same-action rule covers it, nothing in between conflicts
+
+# Interface candidate lists longer than this are narrowed with the address indexes
+ADDRESS_QUERY_THRESHOLD = 512
+
+
+def _ranges_cover(outer, inner):
+    # Every merged interval of `inner` lies inside one interval of `outer`
+    starts, ends = outer
+    for start, end in zip(*inner):
+        i = bisect_right(starts, start) - 1
+        if i < 0 or ends[i] < end:
+            return False
+    return True
+
+
+def _ranges_overlap(a, b):
+    a_starts, a_ends = a
+    b_starts, b_ends = b
+    i = j = 0
+    while i < len(a_starts) and j < len(b_starts):
+        if a_starts[i] <= b_ends[j] and b_starts[j] <= a_ends[i]:
+            return True
+        if a_ends[i] < b_ends[j]:
+            i += 1
+        else:
+            j += 1
+    return False
+
+
+def _interfaces_cover(outer, inner):
+    return outer is None or (inner is not None and inner <= outer)
+
+
+def _interfaces_overlap(a, b):
+    return a is None or b is None or not a.isdisjoint(b)
+
+
+def _addresses_cover(outer, inner):
+    return all(version in outer and _ranges_cover(outer[version], ranges) for version, ranges in inner.items())
+
+
+def _addresses_overlap(a, b):
+    return any(version in b and _ranges_overlap(ranges, b[version]) for version, ranges in a.items())
+
+
+def _services_cover(outer, inner):
+    if None in outer:
+        return True
+    return None not in inner and all(
+        protocol in outer and _ranges_cover(outer[protocol], ports) for protocol, ports in inner.items()
+    )
+
+
+def _services_overlap(a, b):
+    if None in a or None in b:
+        return bool(a) and bool(b)
+    return any(protocol in b and _ranges_overlap(ports, b[protocol]) for protocol, ports in a.items())
+
+
+def covers(outer, inner):
+    # Every flow matched by `inner` is also matched by `outer`
+    return (
+        _interfaces_cover(outer.srcintf, inner.srcintf)
+        and _interfaces_cover(outer.dstintf, inner.dstintf)
+        and _addresses_cover(outer.src, inner.src)
+        and _addresses_cover(outer.dst, inner.dst)
+        and _services_cover(outer.services, inner.services)
+    )
+
+
+def overlaps(a, b):
+    return (
+        _interfaces_overlap(a.srcintf, b.srcintf)
+        and _interfaces_overlap(a.dstintf, b.dstintf)
+        and _addresses_overlap(a.src, b.src)
+        and _addresses_overlap(a.dst, b.dst)
+        and _services_overlap(a.services, b.services)
+    )
+
+
+def _hulls(ranges):
+    # (version, start, end) spanning the ranges of each IP version
+    return [(version, starts[0], ends[-1]) for version, (starts, ends) in sorted(ranges.items())]
+
+
+def _analyzable(policy):
+    # Negated and FQDN/geography-only rules have no exact numeric match set
+    return (
+        policy.src and policy.dst and policy.services
+        and not (policy.src_negate or policy.dst_negate or policy.service_negate)
+    )
+
+
+class RuleAnalyzer:
+    # Finds rules that can never match (shadowed/redundant behind an earlier
+    # rule) and rules made unnecessary by a later one. Instead of comparing
+    # every pair, each rule is only checked exactly against candidates from
+    # an interface index (a covering rule lists each of its interfaces or
+    # "any") or, when that list is long, from interval indexes over the
+    # source and destination address hulls (a covering rule's hull contains
+    # the covered rule's hull).
+    def __init__(self, policies):
+        self.policies = [policy for policy in policies if _analyzable(policy)]
+        self.timings = {}
+        self.skipped = len(policies) - len(self.policies)
+
+    @classmethod
+    def from_config(cls, config_dict):
+        return cls(PolicyEngine.from_config(config_dict).policies)
+
+    def _build_indexes(self):
+        self.src_index = self._index("src")
+        self.dst_index = self._index("dst")
+        self.srcintf_index = self._interface_index("srcintf")
+        self.dstintf_index = self._interface_index("dstintf")
+
+    def _index(self, field):
+        by_version = {}
+        for i, policy in enumerate(self.policies):
+            for version, start, end in _hulls(getattr(policy, field)):
+                by_version.setdefault(version, []).append((start, end, i))
+        return {version: IntervalIndex(items) for version, items in by_version.items()}
+
+    def _interface_index(self, field):
+        # Interface name -> positions of the rules listing it; None -> "any" rules
+        index = {}
+        for i, policy in enumerate(self.policies):
+            names = getattr(policy, field)
+            for name in (names if names is not None else (None,)):
+                index.setdefault(name, []).append(i)
+        return index
+
+    def _covering_candidates(self, policy):
+        # Sorted positions of the rules that may cover `policy`
+        best = None
+        for field, index in (("srcintf", self.srcintf_index), ("dstintf", self.dstintf_index)):
+            names = getattr(policy, field)
+            lists = [index.get(None, [])]
+            if names is not None:
+                lists.append(min((index.get(name, []) for name in names), key=len))
+            size = sum(map(len, lists))
+            if best is None or size < best_size:
+                best, best_size = lists, size
+        if best_size > ADDRESS_QUERY_THRESHOLD:
+            found = self._address_candidates(policy, "containing")
+            if len(found) < best_size:
+                return found
+        return list(heapq.merge(*best))
+
+    def _address_candidates(self, policy, method):
+        # Positions of rules whose source and destination hulls relate to
+        # `policy` as `method` ("containing" or "overlapping") requires. A
+        # covering rule must contain the hull of any one IP version, an
+        # overlapping one may share any version.
+        found = None
+        for field, index in (("src", self.src_index), ("dst", self.dst_index)):
+            hulls = _hulls(getattr(policy, field))
+            if method == "containing":
+                hulls = hulls[:1]
+            hits = set()
+            for version, start, end in hulls:
+                if version in index:
+                    hits.update(getattr(index[version], method)(start, end))
+            if found is None or len(hits) < len(found):
+                found = hits
+        return sorted(found)
+
+    def analyze(self):
+        # Returns a list of finding dicts and fills self.timings (seconds)
+        start = time.perf_counter()
+        self._build_indexes()
+        self.timings["index"] = time.perf_counter() - start
+
+        findings = []
+        unreachable = set()
+        start = time.perf_counter()
+        for j, policy in enumerate(self.policies):
+            for i in self._covering_candidates(policy):
+                if i >= j:
+                    break
+                earlier = self.policies[i]
+                if covers(earlier, policy):
+                    unreachable.add(j)
+                    kind = REDUNDANT if earlier.action == policy.action else SHADOWED
+                    findings.append(self._finding(policy, kind, earlier))
+                    break
+        self.timings["shadowed"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i, policy in enumerate(self.policies):
+            if i in unreachable:
+                continue
+            later = self._redundant_with(i, policy)
+            if later is not None:
+                findings.append(self._finding(policy, REDUNDANT_WITH_LATER, later))
+        self.timings["redundant_with_later"] = time.perf_counter() - start
+        return findings
+
+    def _redundant_with(self, i, policy):
+        # The first later same-action rule covering `policy`, provided no rule
+        # in between with another action overlaps it (removing `policy` would
+        # then leave every one of its flows with the same verdict)
+        conflicts = None
+        for j in self._covering_candidates(policy):
+            if j <= i:
+                continue
+            later = self.policies[j]
+            if later.action != policy.action or not covers(later, policy):
+                continue
+            if conflicts is None:
+                conflicts = [
+                    k for k in self._address_candidates(policy, "overlapping")
+                    if k > i and self.policies[k].action != policy.action
+                    and overlaps(self.policies[k], policy)
+                ]
+            if not conflicts or conflicts[0] > j:
+                return later
+            return None
+        return None
+
+    def _finding(self, policy, kind, related):
+        return dict(
+            policy_id=policy.policy_id,
+            finding=kind,
+            related_policy_id=related.policy_id,
+            action=policy.action,
+            related_action=related.action
+        )
+
+
+def print_timings(analyzer, findings):
+    total = sum(analyzer.timings.values())
+    print(f"[INFO] Analyzed {len(analyzer.policies)} policies in {total:.2f}s "
+          f"({len(findings)} findings, {analyzer.skipped} skipped as negated or non-numeric)")
+    for phase, seconds in analyzer.timings.items():
+        print(f"[DEBUG]   {phase}: {seconds:.3f}s")
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Find shadowed and redundant firewall policies")
+    arg_parser.add_argument("local_file_path", help="FortiGate .conf file")
+    arg_parser.add_argument("--device", help="store the findings on this device's latest snapshot")
+    arg_parser.add_argument("--db-url", default='sqlite:///fortigate_config.db')
+    args = arg_parser.parse_args()
+
+    start = time.perf_counter()
+    # Only the address, service, zone and policy sections are parsed
+    config = FortiGateConfigParser().lazy_config(args.local_file_path)
+    analyzer = RuleAnalyzer.from_config(config)
+    print(f"[INFO] Parsed and compiled in {time.perf_counter() - start:.2f}s")
+    findings = analyzer.analyze()
+    print_timings(analyzer, findings)
+    for finding in findings:
+        print(f"[INFO] policy {finding['policy_id']} is {finding['finding']} "
+              f"(policy {finding['related_policy_id']}, {finding['related_action']})")
+
+    if args.device:
+        from database_handler import FortiGateDatabaseHandler
+        db = FortiGateDatabaseHandler(args.db_url)
+        if db.use_snapshot(args.device):
+            db.save_policy_findings(findings)
+            print(f"[INFO] Saved {len(findings)} findings to snapshot {db.snapshot_id} of {args.device}")
+        else:
+            print(f"[ERROR] No snapshot stored for device {args.device}")
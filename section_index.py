@@ -0,0 +1,205 @@
+import itertools
+import json
+import mmap
+import os
+import re
+from collections.abc import Mapping
+from fortigate_parser import DEFAULT_VDOM, GLOBAL_VDOM, odd_quotes
+
+# Byte-offset index of the top-level "config ... end" blocks of a config
+# file: {section_name: [[offset, length], ...]}, a list because a section
+# may be opened more than once. Built by one scan of the memory-mapped file
+# that only looks at block keywords, so a single section can later be read
+# with a seek and parsed on its own (FortiGateConfigParser.section).
+
+# Kept next to the config as <file>.idx.json
+INDEX_SUFFIX = ".idx.json"
+
+# "config" and "end" lines, and comment lines. Every "edit" is closed by a
+# "next" inside the same block, so those pairs are not needed to find where
+# a top-level block ends, which halves the matches. Keywords inside
+# multi-line quoted values are told apart by the number of quotes between
+# one match and the next.
+BLOCK_LINE = rb"[ \t]*(?:config[ \t]|end[ \t\r]*(?=\n|\Z)|#)"
+# The same with "edit" and "next", to find the VDOMs inside "config vdom"
+UNIT_LINE = rb"[ \t]*(?:config[ \t]|end[ \t\r]*(?=\n|\Z)|edit[ \t]|next[ \t\r]*(?=\n|\Z)|#)"
+# Anchored on the newline instead of ^ with re.M, and without capture
+# groups (the keyword is read from the match instead): about 3x faster.
+# The first line of the file has no newline before it.
+BLOCK_LINE_RES = (re.compile(BLOCK_LINE), re.compile(rb"\n" + BLOCK_LINE))
+UNIT_LINE_RES = (re.compile(UNIT_LINE), re.compile(rb"\n" + UNIT_LINE))
+
+
+def _line_end(buffer, position):
+    end = buffer.find(b"\n", position)
+    return len(buffer) if end == -1 else end + 1
+
+
+def _keyword_lines(buffer, patterns, start=0, end=None):
+    # (line_start, keyword) for the lines matched by patterns between start
+    # and end, skipping comments and lines inside quoted values. keyword is
+    # the first two bytes of the line: b"co", b"en", b"ed" or b"ne".
+    end = len(buffer) if end is None else end
+    first_re, line_re = patterns
+    # Later lines are matched from their preceding newline on
+    first = first_re.match(buffer, start, end) if start == 0 else None
+    quoted = False
+    last = start
+    matches = line_re.finditer(buffer, max(start - 1, 0), end)
+    for match in itertools.chain([first] if first else (), matches):
+        # Line start (after the newline the match begins with)
+        position = match.start() if match is first else match.start() + 1
+        if position < last:
+            continue
+        # Quote parity over several lines is the parity of their sum
+        if odd_quotes(buffer[last:position]):
+            quoted = not quoted
+        last = position
+        if quoted:
+            continue
+        keyword = match.group().lstrip()[:2]
+        if keyword[:1] == b"#":
+            # Comment: the parser skips the whole line, quotes included
+            last = _line_end(buffer, position)
+            continue
+        yield position, keyword
+
+
+def scan_sections(buffer):
+    # buffer: bytes or mmap of the whole file
+    index = {}
+    depth = 0
+    start = name = None
+    for position, keyword in _keyword_lines(buffer, BLOCK_LINE_RES):
+        if keyword == b"co":
+            if depth == 0:
+                start = position
+                name = bytes(buffer[position:_line_end(buffer, position)]).decode().strip()[6:].strip()
+            depth += 1
+        elif depth:
+            depth -= 1
+            if depth == 0 and start is not None:
+                end = _line_end(buffer, position)
+                index.setdefault(name, []).append([start, end - start])
+                start = None
+    if start is not None:
+        # Truncated file: the open block runs to the end
+        index.setdefault(name, []).append([start, len(buffer) - start])
+    return index
+
+
+def _block_inside(buffer, offset, length):
+    # [offset, length] of a block's lines between its "config" and "end" lines
+    start = _line_end(buffer, offset)
+    stop = offset + length
+    tail = stop - 1 if buffer[stop - 1:stop] == b"\n" else stop
+    end = buffer.rfind(b"\n", start, tail) + 1 or start
+    return [start, max(end - start, 0)]
+
+
+def _vdom_blocks(buffer, offset, length):
+    # (vdom, [offset, length]) for each "edit <vdom>" ... "next" of a
+    # "config vdom" block, the edit and next lines excluded
+    depth = 1
+    vdom = start = None
+    for position, keyword in _keyword_lines(buffer, UNIT_LINE_RES, _line_end(buffer, offset), offset + length):
+        if keyword == b"co" or keyword == b"ed":
+            if depth == 1 and keyword == b"ed":
+                line = bytes(buffer[position:_line_end(buffer, position)]).decode().strip()
+                vdom = line[4:].strip().strip('"')
+                start = _line_end(buffer, position)
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 1 and vdom is not None:
+                yield vdom, [start, position - start]
+                vdom = None
+            if depth == 0:
+                return
+
+
+def scan_units(buffer, index):
+    # {unit: [[offset, length], ...]} of a multi-VDOM config from its
+    # section index; see FortiGateConfigParser.vdom_units
+    units = {}
+    for name, blocks in index.items():
+        for offset, length in blocks:
+            if name == "global":
+                units.setdefault(GLOBAL_VDOM, []).append(_block_inside(buffer, offset, length))
+            elif name == "vdom":
+                for vdom, block in _vdom_blocks(buffer, offset, length):
+                    units.setdefault(vdom, []).append(block)
+            else:
+                units.setdefault(DEFAULT_VDOM, []).append([offset, length])
+    # The first "config vdom" block of a backup only lists the VDOMs
+    return {unit: [block for block in blocks if block[1]] for unit, blocks in units.items()
+            if any(block[1] for block in blocks)}
+
+
+def _scan_file(filepath, scan, *args):
+    with open(filepath, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return {}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return scan(buffer, *args)
+
+
+def build_index(filepath):
+    return _scan_file(filepath, scan_sections)
+
+
+def build_units(filepath, index):
+    return _scan_file(filepath, scan_units, index)
+
+
+def load_index(filepath, persist=False):
+    # A stored index is used while the file's size and modification time
+    # match; otherwise the file is scanned again, and with persist the new
+    # index is written next to it
+    stat = os.stat(filepath)
+    index_path = filepath + INDEX_SUFFIX
+    try:
+        with open(index_path, 'r') as f:
+            stored = json.load(f)
+        if stored["size"] == stat.st_size and stored["mtime_ns"] == stat.st_mtime_ns:
+            return stored["sections"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    sections = build_index(filepath)
+    if persist:
+        with open(index_path, 'w') as f:
+            json.dump({"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sections": sections}, f)
+    return sections
+
+
+def read_blocks(filepath, blocks):
+    # Lines of the given [offset, length] blocks, one seek and read each
+    with open(filepath, 'rb') as f:
+        for offset, length in blocks:
+            f.seek(offset)
+            yield from f.read(length).decode().split("\n")
+
+
+class LazyConfig(Mapping):
+    # Read-only view of an indexed config with the same sections as
+    # parse_from_file(); each is parsed on first access and cached by the
+    # parser, so code written against the parsed dict (config.get(...))
+    # only pays for the sections it reads
+    def __init__(self, parser):
+        self._parser = parser
+
+    def __getitem__(self, section):
+        data = self._parser.section(section)
+        if data is None:
+            raise KeyError(section)
+        return data
+
+    def __iter__(self):
+        return iter(self._parser.section_index)
+
+    def __len__(self):
+        return len(self._parser.section_index)
+
+    def __contains__(self, section):
+        return section in self._parser.section_index
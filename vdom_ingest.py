@@ -0,0 +1,130 @@
+import argparse
+import datetime
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from fortigate_parser import GLOBAL_VDOM, FortiGateConfigParser
+from section_index import read_blocks
+
+# Parallel load of one multi-VDOM config. The file is split into units (the
+# inside of "config global" and of each VDOM, see FortiGateConfigParser.
+# vdom_units) which worker processes parse and load into their own staging
+# SQLite database: SQLite allows a single writer, so workers never write the
+# target database. The main process merges each stage as soon as it is done
+# (FortiGateDatabaseHandler.merge_stages), so the load takes about as long
+# as the largest unit plus the merge, instead of the sum of all units.
+# Starting the workers and merging the stages costs extra time (2.2s on top
+# of a 5.1s serial load of 170k rows, on one CPU), so small configs, few
+# VDOMs or a single CPU are loaded serially unless asked otherwise.
+
+# Below any of these, load_vdoms() parses and loads in this process
+PARALLEL_MIN_UNITS = 4
+PARALLEL_MIN_WORKERS = 2
+PARALLEL_MIN_BYTES = 32 * 2 ** 20
+
+
+def _unit_size(blocks):
+    return sum(length for _, length in blocks)
+
+
+def parse_unit(filepath, unit, blocks, stage_path, batch_size=None):
+    # Runs inside a worker process: parses one unit and bulk loads it into
+    # the staging database stage_path. Returns the stage and the unit's
+    # change log, its object types prefixed with "global/" or "vdom/<name>/".
+    from database_handler import FortiGateDatabaseHandler
+    parser = FortiGateConfigParser()
+    parsed_config = parser.parse_stream(read_blocks(filepath, blocks), f"{filepath}:{unit}")
+    db = FortiGateDatabaseHandler(f"sqlite:///{stage_path}")
+    try:
+        counts = db.bulk_load(parsed_config, batch_size=batch_size, vdom=unit, resolve=False)
+    finally:
+        db.engine.dispose()
+    prefix = "global" if unit == GLOBAL_VDOM else f"vdom/{unit}"
+    change_log = [event._replace(object_type=f"{prefix}/{event.object_type}") for event in parser.change_log]
+    return stage_path, sum(counts.values()), change_log
+
+
+def use_parallel(units, workers):
+    return (len(units) >= PARALLEL_MIN_UNITS and workers >= PARALLEL_MIN_WORKERS
+            and sum(_unit_size(blocks) for blocks in units.values()) >= PARALLEL_MIN_BYTES)
+
+
+def load_serial(filepath, source_file, local_file, device_name, db, batch_size=None):
+    # The same snapshot as the parallel load, parsed and loaded in one pass
+    parser = FortiGateConfigParser()
+    counts = db.bulk_load(parser.iter_sections(filepath), source_file, local_file, batch_size, device_name)
+    db.save_config_changes(parser.change_log, source_file, local_file, parser.run_timestamp)
+    return counts
+
+
+def load_vdoms(filepath, source_file=None, local_file=None, device_name=None, db=None, workers=None,
+               batch_size=None, parallel=None):
+    # Loads a multi-VDOM config as one new snapshot. Returns the row counts
+    # per table, or None for a config without VDOMs (nothing is done).
+    # parallel=None loads in worker processes only when use_parallel() holds
+    # for the config and the CPU count; True or False forces either path.
+    parser = FortiGateConfigParser()
+    units = parser.vdom_units(filepath)
+    if not units:
+        return None
+    if db is None:
+        from database_handler import FortiGateDatabaseHandler
+        db = FortiGateDatabaseHandler()
+    source_file = source_file or os.path.basename(filepath)
+    local_file = local_file or filepath
+    workers = min(workers or os.cpu_count() or 1, len(units))
+    if parallel is None:
+        parallel = use_parallel(units, workers)
+    if not parallel:
+        print(f"[INFO] {len(units)} VDOM units, loading serially")
+        return load_serial(filepath, source_file, local_file, device_name, db, batch_size)
+    # Largest first, so the longest unit never starts last
+    order = sorted(units, key=lambda unit: _unit_size(units[unit]), reverse=True)
+    print(f"[INFO] {len(units)} VDOM units, {workers} workers")
+
+    change_log = []
+    # Taken once here, as a serial parse takes it once per run, so every
+    # unit's change events share the load's timestamp
+    run_timestamp = datetime.datetime.utcnow().isoformat()
+    start = time.perf_counter()
+
+    def stages(futures):
+        for future in as_completed(futures):
+            stage_path, rows, unit_changes = future.result()
+            print(f"[DEBUG] {futures[future]}: {rows} rows staged after {time.perf_counter() - start:.2f}s")
+            change_log.extend(unit_changes)
+            yield stage_path
+
+    with tempfile.TemporaryDirectory(prefix="vdom_stage_") as directory:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(parse_unit, filepath, unit, units[unit], os.path.join(directory, f"{number}.db"),
+                            batch_size): unit
+                for number, unit in enumerate(order)
+            }
+            counts = db.merge_stages(stages(futures), source_file, local_file, device_name)
+
+    db.save_config_changes(change_log, source_file, local_file, run_timestamp)
+    print(f"[INFO] Loaded {sum(counts.values())} rows of {len(units)} VDOM units "
+          f"in {time.perf_counter() - start:.2f}s")
+    return counts
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Load a multi-VDOM FortiGate config with one process per VDOM")
+    arg_parser.add_argument("local_file_path")
+    arg_parser.add_argument("--db-url", default='sqlite:///fortigate_config.db')
+    arg_parser.add_argument("--device", help="device the snapshot belongs to (default: file name)")
+    arg_parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    mode = arg_parser.add_mutually_exclusive_group()
+    mode.add_argument("--parallel", dest="parallel", action="store_true", default=None,
+                      help="always use worker processes")
+    mode.add_argument("--serial", dest="parallel", action="store_false",
+                      help="always parse and load in this process")
+    args = arg_parser.parse_args()
+
+    from database_handler import FortiGateDatabaseHandler
+    if load_vdoms(args.local_file_path, device_name=args.device, db=FortiGateDatabaseHandler(args.db_url),
+                  workers=args.workers, parallel=args.parallel) is None:
+        print(f"[WARN] {args.local_file_path} has no VDOMs, nothing loaded (use main.py)")
@@ -0,0 +1,363 @@
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import signal
+import statistics
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from config_sources import ARCHIVE_SUFFIXES, is_archive, is_config_name, iter_archive, strip_compression
+from fleet_ingest import parse_config_file, parse_config_text
+
+# Long-running ingestion of a drop directory. The directory is polled (no
+# inotify or other dependency, so it runs anywhere offline) and a file is
+# picked up once its size and modification time have not changed for
+# `settle` seconds, so a config still being copied in is never read half
+# written. Files are parsed in a bounded process pool and their results go
+# through a bounded queue to a single writer, the only code that touches
+# FortiGateDatabaseHandler; it runs on one dedicated thread so the event
+# loop keeps polling while SQLite writes. Every config is queued on its own,
+# a tar archive's members one by one as they are read and parsed, so the
+# queue bounds parsed configs whatever an archive holds. When the writer
+# falls behind the queue fills, parse tasks wait to put their result, and
+# no new file is dispatched while `max_in_flight` are parsed or queued: the
+# backlog stays on disk, not in memory. A loaded file is moved to
+# processed/, one that fails to parse or load to failed/.
+
+# Names of files still being written by common copy tools
+PARTIAL_SUFFIXES = (".part", ".tmp", ".partial", ".filepart")
+# Drop-to-DB latencies kept for the percentiles in stats()
+LATENCY_WINDOW = 1000
+
+
+def is_drop_candidate(name):
+    if name.startswith(".") or name.endswith(PARTIAL_SUFFIXES):
+        return False
+    return is_config_name(name) or name.endswith(ARCHIVE_SUFFIXES)
+
+
+def parse_drop_file(local_file_path):
+    # Runs inside a worker process: a config file, as
+    # (local_file, source_file, parsed_config, change_log, run_timestamp)
+    parsed_config, change_log, run_timestamp = parse_config_file(local_file_path)
+    source_file = os.path.basename(strip_compression(local_file_path))
+    return local_file_path, source_file, parsed_config, change_log, run_timestamp
+
+
+def parse_archive_member(local_file_path, member, text):
+    # Runs inside a worker process: one config of a tar archive, as for
+    # parse_drop_file()
+    parsed_config, change_log, run_timestamp = parse_config_text(text, member)
+    return (f"{local_file_path}:{member}", os.path.basename(strip_compression(member)),
+            parsed_config, change_log, run_timestamp)
+
+
+def _read_member(members):
+    # (member, text) of the next config of an iter_archive() stream, or None
+    for member, lines in members:
+        return member, "".join(lines)
+    return None
+
+
+class DropDirectoryIngest:
+    def __init__(self, drop_dir, db_url='sqlite:///fortigate_config.db', workers=None, queue_size=8,
+                 poll_interval=1.0, settle=2.0, processed_dir=None, failed_dir=None):
+        self.drop_dir = drop_dir
+        self.db_url = db_url
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self.settle = settle
+        self.processed_dir = processed_dir or os.path.join(drop_dir, "processed")
+        self.failed_dir = failed_dir or os.path.join(drop_dir, "failed")
+        # Files being parsed or with configs waiting for the writer; bounds
+        # memory together with the queue
+        self.max_in_flight = self.workers + queue_size
+        # path -> (size, mtime_ns, first_seen, unchanged_since) of files not
+        # yet dispatched
+        self._candidates = {}
+        self._in_flight = set()
+        # path -> (size, mtime_ns) of handled files that could not be moved
+        # out of the drop directory; skipped until they change or go away
+        self._unmovable = {}
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counts = {"loaded": 0, "failed": 0, "configs": 0}
+        self._queue = None
+        self._stopping = None
+
+    # === Polling and debouncing ===
+
+    def _settled(self, listing):
+        # Paths of a _list_drop_dir() listing that have settled: same size
+        # and mtime for `settle` seconds. Runs on the event loop, like
+        # _poll() and _finish(), so the state is only ever changed there.
+        now = time.monotonic()
+        seen = set()
+        ready = []
+        for path, size, mtime_ns in listing:
+            if path in self._in_flight:
+                continue
+            seen.add(path)
+            unmovable = self._unmovable.get(path)
+            if unmovable is not None:
+                if unmovable == (size, mtime_ns):
+                    continue
+                # Rewritten since: a new drop under the same name
+                del self._unmovable[path]
+            previous = self._candidates.get(path)
+            if previous is None or previous[:2] != (size, mtime_ns):
+                first_seen = previous[2] if previous else time.time()
+                self._candidates[path] = (size, mtime_ns, first_seen, now)
+            elif now - previous[3] >= self.settle:
+                ready.append(path)
+        for path in set(self._candidates) - seen:
+            # Removed or renamed before it settled
+            del self._candidates[path]
+        for path in set(self._unmovable) - seen:
+            del self._unmovable[path]
+        # Oldest drops first
+        return sorted(ready, key=lambda path: self._candidates[path][2])
+
+    async def _poll(self, parse_pool, tasks):
+        loop = asyncio.get_running_loop()
+        while not self._stopping.is_set():
+            # Only the directory listing runs on a thread
+            listing = await loop.run_in_executor(None, _list_drop_dir, self.drop_dir)
+            for path in self._settled(listing):
+                if len(self._in_flight) >= self.max_in_flight:
+                    # Backpressure: the rest stay in the directory until the
+                    # pipeline drains
+                    break
+                first_seen = self._candidates.pop(path)[2]
+                self._in_flight.add(path)
+                task = asyncio.create_task(self._parse(parse_pool, path, first_seen))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    # === Parsing and writing ===
+
+    async def _parse(self, parse_pool, path, first_seen):
+        # Queues (path, first_seen, config, None) for each config of the
+        # file, then (path, first_seen, None, error) to end it. Each put
+        # waits while the writer is behind.
+        loop = asyncio.get_running_loop()
+        error = None
+        try:
+            if is_archive(path):
+                await self._parse_archive(parse_pool, path, first_seen)
+            else:
+                config = await loop.run_in_executor(parse_pool, parse_drop_file, path)
+                await self._queue.put((path, first_seen, config, None))
+        except Exception as e:
+            error = f"parse: {e}"
+        await self._queue.put((path, first_seen, None, error))
+
+    async def _parse_archive(self, parse_pool, path, first_seen):
+        # Members are read off the archive stream one at a time on a thread
+        # and parsed in the pool; only one is held before it is queued
+        loop = asyncio.get_running_loop()
+        members = iter_archive(path)
+        try:
+            while True:
+                member = await loop.run_in_executor(None, _read_member, members)
+                if member is None:
+                    break
+                config = await loop.run_in_executor(parse_pool, parse_archive_member, path, *member)
+                await self._queue.put((path, first_seen, config, None))
+        finally:
+            members.close()
+
+    def _load(self, db, config):
+        # Runs on the writer thread
+        local_file, source_file, parsed_config, change_log, run_timestamp = config
+        db.bulk_load(parsed_config, source_file, local_file)
+        db.save_config_changes(change_log, source_file, local_file, run_timestamp)
+
+    async def _writer(self, db, write_thread):
+        # The only task that touches the database, one config at a time. A
+        # file is finished when its end arrives; once one of its configs
+        # fails to load, the rest are skipped and it goes to failed/.
+        loop = asyncio.get_running_loop()
+        load_errors = {}
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                break
+            path, first_seen, config, error = item
+            try:
+                if config is None:
+                    await self._finish(path, first_seen, load_errors.pop(path, None) or error)
+                elif path not in load_errors:
+                    await loop.run_in_executor(write_thread, self._load, db, config)
+                    self.counts["configs"] += 1
+            except Exception as e:
+                load_errors[path] = f"load: {e}"
+            finally:
+                self._queue.task_done()
+
+    async def _finish(self, path, first_seen, error):
+        # Moves the file out of the drop directory and records the outcome;
+        # it leaves _in_flight only once it is gone, or marked unmovable, so
+        # no scan re-reads it
+        target_dir = self.processed_dir if error is None else self.failed_dir
+        unmoved = await asyncio.get_running_loop().run_in_executor(None, _move_file, path, target_dir)
+        if unmoved is not None:
+            self._unmovable[path] = unmoved
+        self._in_flight.discard(path)
+        if error is None:
+            latency = time.time() - first_seen
+            self._latencies.append(latency)
+            self.counts["loaded"] += 1
+            print(f"[INFO] Loaded {os.path.basename(path)} {latency:.2f}s after it was dropped")
+        else:
+            self.counts["failed"] += 1
+            print(f"[ERROR] {path}: {error}")
+
+    # === Metrics ===
+
+    def stats(self):
+        # Queue depth and drop-to-DB latency (seconds, over the last
+        # LATENCY_WINDOW loaded files)
+        latencies = sorted(self._latencies)
+        stats = {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_size": self.queue_size,
+            "in_flight": len(self._in_flight),
+            "waiting": len(self._candidates),
+            "unmovable": len(self._unmovable),
+            **self.counts,
+        }
+        if latencies:
+            stats["latency_p50"] = statistics.median(latencies)
+            stats["latency_p95"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            stats["latency_max"] = latencies[-1]
+        return stats
+
+    async def _report(self, interval, status_file):
+        loop = asyncio.get_running_loop()
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            stats = self.stats()
+            print(f"[INFO] queue {stats['queue_depth']}/{stats['queue_size']}, {stats['in_flight']} in flight, "
+                  f"{stats['waiting']} settling, {stats['loaded']} loaded, {stats['failed']} failed"
+                  + (f", latency p50 {stats['latency_p50']:.2f}s p95 {stats['latency_p95']:.2f}s"
+                     if "latency_p50" in stats else ""))
+            if status_file:
+                await loop.run_in_executor(None, _write_status, status_file, stats)
+
+    # === Lifecycle ===
+
+    def stop(self):
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def run(self, report_interval=30.0, status_file=None):
+        # Runs until stop() (SIGINT/SIGTERM from the CLI); files already
+        # dispatched are still loaded before it returns
+        from database_handler import FortiGateDatabaseHandler
+        os.makedirs(self.drop_dir, exist_ok=True)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._stopping = self._stopping or asyncio.Event()
+        tasks = set()
+        with ProcessPoolExecutor(max_workers=self.workers) as parse_pool, \
+                ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer") as write_thread:
+            loop = asyncio.get_running_loop()
+            # The handler is created and used on the writer thread only
+            db = await loop.run_in_executor(write_thread, FortiGateDatabaseHandler, self.db_url)
+            writer = asyncio.create_task(self._writer(db, write_thread))
+            reporter = asyncio.create_task(self._report(report_interval, status_file))
+            print(f"[INFO] Watching {self.drop_dir} with {self.workers} parser processes")
+            await self._poll(parse_pool, tasks)
+
+            if tasks:
+                await asyncio.gather(*tasks)
+            await self._queue.put(None)
+            await writer
+            await reporter
+            await loop.run_in_executor(write_thread, db.engine.dispose)
+        print(f"[INFO] Stopped: {self.counts['loaded']} files ({self.counts['configs']} configs) loaded, "
+              f"{self.counts['failed']} failed")
+        return self.stats()
+
+
+def _list_drop_dir(drop_dir):
+    # (path, size, mtime_ns) of the drop candidates in drop_dir, not its
+    # subdirectories
+    listing = []
+    with os.scandir(drop_dir) as entries:
+        for entry in entries:
+            if not entry.is_file() or not is_drop_candidate(entry.name):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            listing.append((entry.path, stat.st_size, stat.st_mtime_ns))
+    return listing
+
+
+def _move_file(path, target_dir):
+    # None once the file is out of the drop directory, else its (size,
+    # mtime_ns) as it was left there
+    try:
+        os.makedirs(target_dir, exist_ok=True)
+        shutil.move(path, os.path.join(target_dir, os.path.basename(path)))
+        return None
+    except OSError as e:
+        print(f"[WARN] Could not move {path} to {target_dir}, it will not be read again until it changes: {e}")
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _write_status(path, stats):
+    # Written and renamed, so a reader never sees a partial file
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(stats, f)
+    os.replace(temp_path, path)
+
+
+def watch(drop_dir, report_interval=30.0, status_file=None, **kwargs):
+    ingest = DropDirectoryIngest(drop_dir, **kwargs)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        ingest._stopping = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, ingest.stop)
+        return await ingest.run(report_interval, status_file)
+
+    return asyncio.run(main())
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Watch a drop directory and load every FortiGate config "
+                                                     "written to it")
+    arg_parser.add_argument("drop_dir")
+    arg_parser.add_argument("--db-url", default='sqlite:///fortigate_config.db')
+    arg_parser.add_argument("--workers", type=int, default=None, help="parser processes (default: CPU count)")
+    arg_parser.add_argument("--queue-size", type=int, default=8, help="parsed configs buffered for the writer")
+    arg_parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds between directory scans")
+    arg_parser.add_argument("--settle", type=float, default=2.0,
+                            help="seconds a file's size and mtime must stay unchanged before it is read")
+    arg_parser.add_argument("--processed-dir", help="where loaded files are moved (default: <drop_dir>/processed)")
+    arg_parser.add_argument("--failed-dir", help="where failed files are moved (default: <drop_dir>/failed)")
+    arg_parser.add_argument("--report-interval", type=float, default=30.0, help="seconds between stats lines")
+    arg_parser.add_argument("--status-file", help="also write the stats as JSON to this file")
+    args = arg_parser.parse_args()
+
+    watch(args.drop_dir, args.report_interval, args.status_file, db_url=args.db_url, workers=args.workers,
+          queue_size=args.queue_size, poll_interval=args.poll_interval, settle=args.settle,
+          processed_dir=args.processed_dir, failed_dir=args.failed_dir)